@@ -0,0 +1,116 @@
+""" Benchmark audio load latency for WAV and FLAC files.
+
+    Writes the same test signal as .wav and .flac (or uses the
+    files in a corpus folder), then times:
+        - cold reads through the reader (decode every time)
+        - the first read through the decoded-buffer cache
+        - repeated (cached) reads
+
+    Noise compresses poorly, so use --folder with a real corpus
+    (e.g., a .wav and a .flac copy) to compare file sizes.
+
+    Usage (from the repository folder):
+        python -m benchmarks.load_latency [--dur 3] [--files 50]
+        python -m benchmarks.load_latency --folder CORPUS_DIR
+
+    Needs the optional 'soundfile' package for FLAC.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import argparse
+import os
+import tempfile
+import time
+from glob import glob
+
+# Import audio packages
+from scipy.io import wavfile
+
+# Import custom modules
+from models import cachemodel as m_cache
+from models import readermodel as m_reader
+
+
+#########
+# BEGIN #
+#########
+def make_files(folder, ext, count, dur, fs=44100):
+    """ Write COUNT stereo int16 noise files of DUR seconds
+    """
+    rng = np.random.default_rng(1)
+    sig = (rng.standard_normal((int(dur * fs), 2)) * 3000).astype(np.int16)
+    paths = []
+    for ii in range(1, count + 1):
+        path = os.path.join(folder, f"{ii}{ext}")
+        if ext == '.wav':
+            wavfile.write(path, fs, sig)
+        else:
+            m_reader.sf.write(path, sig, fs)
+        paths.append(path)
+    return paths
+
+
+def time_reads(read, paths):
+    """ Median and maximum time (ms) to read each file
+    """
+    times = []
+    for path in paths:
+        start = time.perf_counter()
+        read(path)
+        times.append((time.perf_counter() - start) * 1000)
+    return np.median(times), np.max(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dur', type=float, default=3.0,
+        help="file duration (s)")
+    parser.add_argument('--files', type=int, default=50,
+        help="number of files per format")
+    parser.add_argument('--folder', 
+        help="time the audio files in this folder instead")
+    args = parser.parse_args()
+
+    formats = ['.wav']
+    if m_reader.sf is not None:
+        formats.append('.flac')
+    else:
+        print("soundfile is not installed: skipping FLAC")
+
+    print(f"{'format':<8}{'files':>6}{'size (MB)':>10}{'cold':>16}" +
+        f"{'cache miss':>16}{'cache hit':>16}")
+    with tempfile.TemporaryDirectory() as folder:
+        for ext in formats:
+            if args.folder:
+                paths = sorted(glob(os.path.join(args.folder, f"*{ext}")))
+                if not paths:
+                    continue
+            else:
+                paths = make_files(folder, ext, args.files, args.dur)
+            report(ext, paths)
+    if not args.folder:
+        print(f"Test files: {args.dur} s noise (stereo, int16, 44.1 kHz)")
+    print("Times are median/max per file")
+
+
+def report(ext, paths):
+    """ Time reads of PATHS and print one table row
+    """
+    size = sum(os.path.getsize(path) for path in paths) / 1e6
+    cold = time_reads(m_reader.read, paths)
+    cache = m_cache.AudioCache(max_mb=4096)
+    miss = time_reads(cache.read, paths)
+    hit = time_reads(cache.read, paths)
+    print(f"{ext:<8}{len(paths):>6}{size:>10.1f}" + "".join(
+        f"{f'{med:.2f}/{peak:.2f} ms':>16}"
+        for med, peak in (cold, miss, hit)))
+
+
+if __name__ == "__main__":
+    main()
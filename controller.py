@@ -18,6 +18,7 @@
 import tkinter as tk
 
 # Import system packages
+import multiprocessing
 import os
 import sys
 from tkinter import messagebox
@@ -38,6 +39,12 @@ from models import audiomodel as m_audio
 from models import listmodel as m_list
 from models import csvmodel as m_csv
 from models import scoremodel as m_score
+from models import noisemodel as m_noise
+from models import measuremodel as m_measure
+from models import calibrationmodel as m_calibration
+from models import cachemodel as m_cache
+from models import enginemodel as m_engine
+from models import processmodel as m_process
 # View imports
 from views import main as v_main
 from views import session as v_sess
@@ -82,16 +89,32 @@ class Application(tk.Tk):
         # Create and load list model
         self.listmodel = m_list.StimulusList(self.sessionpars)
         try:
-            self.listmodel.load()
+            self.listmodel.load(sync=True)
         except FileNotFoundError:
             pass
 
         # Create score model
         self.scoremodel = m_score.ScoreModel()
 
+        # Create decoded audio cache
+        self.audiocache = m_cache.AudioCache()
+
+        # Create persistent audio output engine (optionally in
+        # its own process, safe from GUI stalls)
+        if self.sessionpars['Separate Audio Process'].get():
+            self.engine = m_process.EngineProcess()
+        else:
+            self.engine = m_engine.AudioEngine()
+        self._configure_engine()
+
+        # Load calibrations by device, speakers and stimulus
+        self.caltable = m_calibration.CalibrationTable()
+        # Device, speakers and stimulus of the applied calibration
+        self._cal_inputs = None
+
         # Create main view
         self.main_frame = v_main.MainFrame(self, self.scoremodel, 
-            self.sessionpars, self.listmodel)
+            self.sessionpars, self.listmodel, self.audiocache, self.engine)
         self.main_frame.grid()
 
         # Create menus
@@ -112,14 +135,17 @@ class Application(tk.Tk):
             '<<Help>>': lambda _: self._show_help(),
 
             # Session dialog commands
-            '<<SessionSubmit>>': lambda _: self._save_sessionpars(),
+            '<<SessionSubmit>>': lambda _: self._save_sessionpars(sync=True),
 
             # Calibration dialog commands
             '<<PlayCalStim>>': lambda _: self._play_calibration(),
-            '<<CalibrationSubmit>>': lambda _: self._calc_level(),
+            '<<StopCalStim>>': lambda _: self._stop_calibration(),
+            '<<CalLevelChange>>': lambda _: self._set_calibration_level(),
+            '<<MeasureCalStim>>': lambda _: self._measure_calibration(),
+            '<<CalibrationSubmit>>': lambda _: self._on_cal_submit(),
 
             # Audio dialog commands
-            '<<AudioDialogSubmit>>': lambda _: self._save_sessionpars(),
+            '<<AudioDialogSubmit>>': lambda _: self._on_audio_submit(),
 
             # Mainframe commands
             '<<SubmitResponse>>': lambda _: self._on_main_submit(),
@@ -167,6 +193,7 @@ class Application(tk.Tk):
     def _quit(self):
         """ Exit the application
         """
+        self.engine.shutdown()
         self.destroy()
 
 
@@ -236,9 +263,36 @@ class Application(tk.Tk):
 
         # Only write specific sessionpars to file
         drop_list = ['Speaker Number', 'Audio Files Path', 
-            'Sentence File Path', 'Audio Device ID', 'Calibration File']
+            'Sentence File Path', 'Audio Device ID', 'Calibration File',
+            'Block Size', 'Stream Latency', 'Masker Speaker(s)',
+            'Onset Delay (ms)', 'Trigger Channel', 'Separate Audio Process',
+            'Pre-convert List', 'Stream Files Over (s)', 'Local Mirror',
+            'Measurement Input', 'Measurement Channel', 
+            'Input Reference (dB SPL)', 'Calibration Max Age (days)']
         [data.pop(e) for e in drop_list]
 
+        # Document the measured output latency of the audio stream
+        data['Output Latency'] = self.engine.output_latency
+        # and the rate the audio was presented at
+        data['Sample Rate'] = self.engine.fs
+        # Audio dropouts so far this session
+        data['Dropouts'] = self.engine.dropouts
+        # When the trial's first sample reached the DAC (as 
+        # time.time()) and how long after it was queued
+        timing = self.engine.last_timing
+        if timing is None or timing['onset'] is None:
+            data['Onset Time'] = None
+            data['Onset Latency (ms)'] = None
+            data['Clips'] = None
+        else:
+            data['Onset Time'] = f"{timing['clock']:.6f}"
+            data['Onset Latency (ms)'] = round(timing['latency'] * 1000, 3)
+            # Meter readings that clipped during the trial
+            data['Clips'] = timing['clips']
+
+        # Presentation plan (randomization seed and plan number)
+        data['Plan ID'] = self.listmodel.plan.plan_id
+
         # Combine sessionpars dict and scoremodel dict for writing
         data.update(self.scoremodel.fields)
 
@@ -263,6 +317,11 @@ class Application(tk.Tk):
         #print(f"Total words correct: {np.sum(self.tracker['PC Word'])}")
         mean_lvl = round(np.mean(self.tracker['Level']), 2)
         print(f"Tracker list of levels: {self.tracker['Level']}")
+        print(f"Audio cache stats: {self.audiocache.stats()}")
+        onset_stats = self.engine.onset_stats()
+        if onset_stats is not None:
+            print(f"Onset timing (ms): {onset_stats}")
+            self.csvmodel.save_timing(onset_stats)
         pc_word = round((np.sum(self.tracker['PC Word']) / (len(self.tracker['PC Custom'] * num_possible_words))) * 100, 2)
         pc_custom = round((np.sum(self.tracker['PC Custom']) / len(self.tracker['PC Custom'])) * 100, 2)
 
@@ -276,6 +335,7 @@ class Application(tk.Tk):
         )
 
         # Close app when done
+        self.engine.shutdown()
         self.quit()
 
 
@@ -308,9 +368,11 @@ class Application(tk.Tk):
             "running sessionpars dict")
 
 
-    def _save_sessionpars(self, *_):
+    def _save_sessionpars(self, *_, sync=False):
         """ Save current runtime parameters to file.
             Update session info labels with new parameters.
+            SYNC updates the local copy of the stimuli (see
+            StimulusList.load).
         """
         print("\nApp_266: Calling sessionpar model set and save funcs...")
         for key, variable in self.sessionpars.items():
@@ -318,7 +380,7 @@ class Application(tk.Tk):
             self.sessionpars_model.save()
 
         # Update session info labels
-        self.listmodel.load()
+        self.listmodel.load(sync)
         self.main_frame._load_listmodel()
         self.main_frame._update_labels()
 
@@ -333,6 +395,25 @@ class Application(tk.Tk):
         v_aud.AudioDialog(self, self.sessionpars)
 
 
+    def _on_audio_submit(self):
+        """ Save audio settings and apply them to the engine
+        """
+        self._save_sessionpars()
+        self._configure_engine()
+
+
+    def _configure_engine(self):
+        """ Apply block size and latency settings to the 
+            audio engine
+        """
+        self.engine.configure(
+            blocksize=self.sessionpars['Block Size'].get(),
+            latency=self.sessionpars['Stream Latency'].get(),
+            onset_delay=self.sessionpars['Onset Delay (ms)'].get() / 1000,
+            trigger_channel=self.sessionpars['Trigger Channel'].get() or None
+        )
+
+
     ################################
     # Calibration Dialog Functions #
     ################################
@@ -340,12 +421,88 @@ class Application(tk.Tk):
         """ Show calibration dialog
         """
         print("\nApp_296: Calling calibration dialog...")
-        v_cal.CalibrationDialog(self, self.sessionpars)
+        self.cal_dialog = v_cal.CalibrationDialog(self, self.sessionpars)
+
+
+    def _on_cal_submit(self):
+        """ Store the calibration for the current device, 
+            speakers and stimulus, then update the level
+        """
+        inputs = self._calibration_inputs()
+        key = self._calibration_key(inputs)
+        if key is not None:
+            self.caltable.record(key, self.sessionpars['raw_lvl'].get(),
+                self.sessionpars['slm_cal_value'].get())
+            self._cal_inputs = inputs
+        self._calc_level()
+
+
+    def _calibration_inputs(self):
+        """ Current (device ID, speakers, calibration stimulus)
+        """
+        cal_type = self.sessionpars['Calibration Type'].get()
+        if cal_type not in m_noise.NoiseGenerator.kinds:
+            cal_type = os.path.basename(
+                self.sessionpars['Calibration File'].get())
+        try:
+            device_id = self.sessionpars['Audio Device ID'].get()
+        except tk.TclError:
+            device_id = None
+        return (device_id, self.sessionpars['Speaker Number'].get(), 
+            cal_type)
+
+
+    def _calibration_key(self, inputs):
+        """ Calibration table key for (device ID, speakers, 
+            stimulus), or None if the device or speakers are 
+            invalid
+        """
+        device_id, speakers, stimulus = inputs
+        try:
+            return self.caltable.key(self.engine.device_name(device_id),
+                self.engine.parse_speakers(speakers), stimulus)
+        except ValueError:
+            return None
+
+
+    def _apply_calibration(self):
+        """ Use the stored calibration when the device, speakers
+            or calibration stimulus have changed
+        """
+        inputs = self._calibration_inputs()
+        if inputs == self._cal_inputs:
+            return
+        self._cal_inputs = inputs
+        key = self._calibration_key(inputs)
+        if key is None:
+            return
+
+        entry = self.caltable.lookup(key)
+        if entry is None:
+            print(f"App_443: No calibration for {key}")
+            messagebox.showwarning(title="Not Calibrated",
+                message="No calibration for this device and speaker!",
+                detail=f"{key}\n\nUsing the last calibration. Please " +
+                    "calibrate using Tools-->Calibration.")
+            return
+        print(f"App_449: Using calibration for {key}")
+        self.sessionpars['raw_lvl'].set(entry['raw_lvl'])
+        self.sessionpars['slm_cal_value'].set(entry['slm_cal_value'])
+
+        age = self.caltable.age(entry)
+        if age > self.sessionpars['Calibration Max Age (days)'].get():
+            messagebox.showwarning(title="Calibration Out of Date",
+                message=f"Last calibrated {age:.0f} days ago!",
+                detail=f"{key}\n\nPlease recalibrate using " +
+                    "Tools-->Calibration.")
 
 
     def _calc_level(self):
         """ Calculate and save adjusted presentation level
         """
+        # Look up the calibration if the device or speakers changed
+        self._apply_calibration()
+
         # Calculate SLM offset
         print("\nApp_304: Calculating new presentation level...")
         self.sessionpars['slm_offset'].set(self.sessionpars['slm_cal_value'].get() - self.sessionpars['raw_lvl'].get())
@@ -365,6 +522,11 @@ class Application(tk.Tk):
     def _play_calibration(self):
         """ Load and present calibration stimulus
         """
+        # Generated noise plays until stopped
+        if self.sessionpars['Calibration Type'].get() in m_noise.NoiseGenerator.kinds:
+            self._play_calibration_noise()
+            return
+
         # Check for default calibration stimulus request
         if self.sessionpars['Calibration File'].get() == 'cal_stim.wav':
             # Create calibration audio object
@@ -372,13 +534,15 @@ class Application(tk.Tk):
                 # If running from compiled, look in compiled temporary location
                 print("Looking for cal file in temp location: compiled version")
                 cal_file = self.resource_path('cal_stim.wav')
-                cal_stim = m_audio.Audio(cal_file, self.sessionpars['raw_lvl'].get())
+                cal_stim = m_audio.Audio(cal_file, self.sessionpars['raw_lvl'].get(),
+                    stream=True)
             except FileNotFoundError:
                 # If running from command line, look in assets folder
                 print("Looking for cal file in assets folder: script version")
                 cal_file = '.\\assets\\cal_stim.wav'
                 try:
-                    cal_stim = m_audio.Audio(cal_file, self.sessionpars['raw_lvl'].get())
+                    cal_stim = m_audio.Audio(cal_file, self.sessionpars['raw_lvl'].get(),
+                        stream=True)
                 except FileNotFoundError:
                     print("Default calibration file not found!")
                     messagebox.showerror(title="File Not Found",
@@ -388,7 +552,7 @@ class Application(tk.Tk):
             print("App_336: Looking for provided custom calibration file...")
             try:
                 cal_stim = m_audio.Audio(self.sessionpars['Calibration File'].get(), 
-                    self.sessionpars['raw_lvl'].get())
+                    self.sessionpars['raw_lvl'].get(), stream=True)
                 print("Custom calibration file found!")
             except FileNotFoundError:
                 messagebox.showerror(title="File Not Found",
@@ -397,10 +561,106 @@ class Application(tk.Tk):
 
         # Present calibration stimulus
         print("App_341: Attempting to play calibration file...")
-        cal_stim.play(device_id=self.sessionpars['Audio Device ID'].get(), 
-            channels=self.sessionpars['Speaker Number'].get())
+        try:
+            cal_stim.play(device_id=self.sessionpars['Audio Device ID'].get(), 
+                channels=self.engine.parse_speakers(
+                    self.sessionpars['Speaker Number'].get()),
+                engine=self.engine,
+                eq='n' if self.sessionpars['Preserve ILD'].get() else 'y')
+        except ValueError as e:
+            messagebox.showerror(title="Invalid Audio Device",
+                message="Cannot present the calibration stimulus!",
+                detail=str(e))
+
+
+    def _play_calibration_noise(self):
+        """ Present generated calibration noise continuously at
+            the raw level
+        """
+        print("App_452: Playing calibration noise...")
+        device_id = self.sessionpars['Audio Device ID'].get()
+        try:
+            noise = m_noise.NoiseGenerator(
+                self.sessionpars['Calibration Type'].get(), 
+                fs=self.engine.device_rate(device_id))
+            self.engine.play_noise(noise, device_id, noise.gain_matrix(
+                self.sessionpars['raw_lvl'].get(),
+                self.engine.parse_speakers(
+                    self.sessionpars['Speaker Number'].get())))
+        except ValueError as e:
+            messagebox.showerror(title="Invalid Audio Device",
+                message="Cannot present the calibration stimulus!",
+                detail=str(e))
+
+
+    def _set_calibration_level(self):
+        """ Apply a new raw level to the calibration noise while
+            it plays
+        """
+        if self.engine.noise is None:
+            return
+        try:
+            level = self.sessionpars['raw_lvl'].get()
+            speakers = self.engine.parse_speakers(
+                self.sessionpars['Speaker Number'].get())
+        except (tk.TclError, ValueError):
+            # Level is still being typed
+            return
+        self.engine.set_noise_gain(self.engine.noise.gain_matrix(level, speakers))
+
+
+    def _stop_calibration(self):
+        """ Stop the calibration stimulus
+        """
+        self.engine.stop_noise()
+        self.engine.stop()
+
+
+    def _measure_calibration(self):
+        """ Play the calibration stimulus and measure its level
+            from the measurement input
+        """
+        print("\nApp_503: Measuring calibration stimulus...")
+        try:
+            inp = m_measure.open_input(
+                self.sessionpars['Measurement Input'].get(),
+                self.sessionpars['Measurement Channel'].get())
+        except ValueError as e:
+            messagebox.showerror(title="Invalid Measurement Input",
+                message="Cannot measure the calibration stimulus!",
+                detail=str(e))
+            return
+        self._play_calibration()
+        self.measurement = m_measure.Measurement(inp,
+            self.sessionpars['Input Reference (dB SPL)'].get())
+        self.after(100, self._check_measurement)
+
+
+    def _check_measurement(self):
+        """ Wait for the measurement, then stop the stimulus and
+            fill in the SLM value and offset
+        """
+        if not self.measurement.done:
+            self.after(100, self._check_measurement)
+            return
+        self._stop_calibration()
+        if self.measurement.error is not None:
+            messagebox.showerror(title="Measurement Failed",
+                message="Cannot measure the calibration stimulus!",
+                detail=str(self.measurement.error))
+            return
+
+        result = self.measurement.result
+        print("App_533: Octave band levels (dB SPL): " + ", ".join(
+            f"{band}: {level:.1f}" for band, level in result['bands'].items()))
+        self.sessionpars['slm_cal_value'].set(round(result['overall'], 1))
+        self._on_cal_submit()
+        if self.cal_dialog.winfo_exists():
+            self.cal_dialog.show_measurement(result)
 
 
 if __name__ == "__main__":
+    # Needed for the resampling process pool in compiled versions
+    multiprocessing.freeze_support()
     app = Application()
     app.mainloop()
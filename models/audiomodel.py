@@ -20,6 +20,11 @@ import os
 import sounddevice as sd
 from scipy.io import wavfile
 
+# Import custom modules
+from models import bundlemodel as m_bundle
+from models import cachemodel as m_cache
+from models import streammodel as m_stream
+
 
 
 
@@ -40,16 +45,38 @@ class Audio:
         'uint8': (0, 255)
     }
 
-    def __init__(self, file_path, level):
+    # Data types written to the output stream without conversion
+    native_types = ('float32', 'int32', 'int16')
+
+    # Fade in/out applied to trimmed audio (s)
+    ramp_dur = 0.005
+
+    # Frames per block when streaming or measuring long files
+    block_frames = 65536
+
+    def __init__(self, file_path, level, cache=None, trim=None, mmap=False,
+        stream=False, target_fs=None):
         # Parse file path
         self.directory = file_path.split(os.sep) # path only
         self.name = str(file_path.split(os.sep)[-1]) # file name only
         self.file_path = file_path
         self.level = level
 
-        # Read audio file
+        # Read audio file (from the decoded buffer cache, if provided).
+        # MMAP maps the file instead of reading it into memory.
+        # STREAM also maps the file, and presents it block by block
+        # (for long passages), so memory use stays constant.
+        # TARGET_FS presents the audio at another sample rate: 
+        # blocks are resampled as they are read (for streamed or
+        # mapped audio; the cache resamples whole files).
+        self.stream = stream
         try:
-            fs, audio_file = wavfile.read(self.file_path)
+            if cache is not None and not stream:
+                fs, audio_file = cache.read(self.file_path)
+            else:
+                # Files in a corpus bundle are always mapped
+                fs, audio_file = m_bundle.read(self.file_path, 
+                    mmap=mmap or stream)
         except FileNotFoundError:
             print("Audio_Model_47: Audio file not found!")
             raise FileNotFoundError
@@ -63,57 +90,245 @@ class Audio:
         print(f"\nNumber of channels: {self.channels}")
 
         # Assign audio file attributes
-        self.fs = fs
+        self.source_fs = fs
+        self.resample = target_fs is not None and target_fs != fs
+        self.fs = target_fs if self.resample else fs
         self.original_audio = audio_file
-        self.dur = len(self.original_audio) / self.fs
-        self.t = np.arange(0, self.dur, 1/self.fs)
 
         # Get data type
         #self.data_type = np.dtype(audio_file[0])
         self.data_type = audio_file.dtype
         print(f"Incoming audio data type: {self.data_type}")
 
-        # Immediately convert to float64 for processing
-        self.convert_to_float()
+        # Work on the original buffer (no copy). The level and the 
+        # conversion to float are applied as a per-channel gain 
+        # when the audio is written to the output stream.
+        self.full_audio = self._native_audio()
+
+        # Optionally present only the (onset, offset) samples.
+        # Slicing is a view, so trimming makes no copy.
+        self.trim = trim
+        if trim is not None:
+            self.working_audio = self.full_audio[trim[0]:trim[1]]
+        else:
+            self.working_audio = self.full_audio
+        self.dur = len(self.working_audio) / self.source_fs
+        # Frames presented (at the output rate)
+        self.frames = m_cache.resampled_frames(len(self.working_audio),
+            self.source_fs, self.fs)
+
+
+    def _native_audio(self):
+        """ Return a buffer the output stream can take directly:
+            the original buffer for int16, int32 and float32
+            data, otherwise a single float32 copy. Streamed 
+            audio is never copied (blocks are converted as they
+            are read).
+        """
+        if str(self.data_type) in self.native_types or self.stream:
+            return self.original_audio
+        elif self.data_type == 'float64':
+            return self.original_audio.astype(np.float32)
+        else:
+            self.convert_to_float()
+            return self.working_audio
 
 
     def convert_to_float(self):
-        """ Convert original audio data type to float64 
+        """ Convert original audio data type to float32 
             for processing
         """
-        if self.data_type == 'float64':
-            self.working_audio = self.original_audio
+        # 1. Convert to float32 (the only copy)
+        sig = self.original_audio.astype(np.float32)
+        # 2. Divide by original dtype max val, in place
+        if self.data_type not in ('float32', 'float64'):
+            sig *= 1 / self.wav_dict[str(self.data_type)][1]
+        self.working_audio = sig
+
+
+    def scale(self):
+        """ Factor to convert the samples presented to float
+            (resampled blocks are float already)
+        """
+        if self.resample:
+            return 1.0
+        return self._dtype_scale(self.working_audio.dtype)
+
+
+    @classmethod
+    def _dtype_scale(cls, dtype):
+        """ Factor to convert samples of DTYPE to float
+        """
+        if np.dtype(dtype).kind == 'f':
+            return 1.0
+        return 1 / cls.wav_dict[str(dtype)][1]
+
+
+    def blocks(self, frames=None):
+        """ Yield working audio in blocks of FRAMES (frames x 
+            channels). Data types the output stream can't take 
+            are converted one block at a time, and blocks are 
+            resampled to the output rate if needed.
+        """
+        frames = frames or self.block_frames
+        sig = self.working_audio.reshape(len(self.working_audio), -1)
+        if self.resample:
+            yield from m_cache.resample_blocks(sig, self.source_fs, 
+                self.fs, frames)
+            return
+        for start in range(0, len(sig), frames):
+            block = sig[start:start + frames]
+            if block.dtype == 'float64':
+                block = block.astype(np.float32)
+            yield block
+
+
+    @property
+    def block_dtype(self):
+        """ Data type of the blocks yielded by blocks()
+        """
+        dtype = self.working_audio.dtype
+        if self.resample or dtype == 'float64':
+            return np.dtype(np.float32)
+        return dtype
+
+
+    def stream_source(self):
+        """ Ring-buffered block stream of the working audio, for
+            the output engine. Its source is the (file path, 
+            trim, output rate) to stream the same audio with.
+        """
+        return m_stream.BlockStream(self.blocks(), self.frames,
+            self.channels, self.block_dtype, 
+            ring_frames=2 * self.block_frames,
+            source=(self.file_path, self.trim, self.fs))
+
+
+    def channel_rms(self, block=65536):
+        """ RMS of each channel of the whole file (in float
+            units), so trimming does not change the level. 
+            Computed in blocks, so no full-size temporary 
+            copies are made.
+        """
+        sig = self.full_audio.reshape(len(self.full_audio), -1)
+        acc = np.zeros(sig.shape[1])
+        for start in range(0, len(sig), block):
+            chunk = sig[start:start + block].astype(np.float64)
+            acc += np.einsum('ij,ij->j', chunk, chunk)
+        return np.sqrt(acc / max(len(sig), 1)) * self._dtype_scale(sig.dtype)
+
+
+    def channel_peaks(self, block=65536):
+        """ Peak level of each channel in dB FS (-inf if 
+            silent). Computed in blocks, like channel_rms.
+        """
+        sig = self.full_audio.reshape(len(self.full_audio), -1)
+        peak = np.zeros(sig.shape[1])
+        for start in range(0, len(sig), block):
+            chunk = np.abs(sig[start:start + block].astype(np.float64))
+            peak = np.maximum(peak, chunk.max(axis=0, initial=0))
+        with np.errstate(divide='ignore'):
+            return 20 * np.log10(peak * self._dtype_scale(sig.dtype))
+
+
+    def channel_levels(self):
+        """ RMS level of each channel in dB (-inf if silent)
+        """
+        with np.errstate(divide='ignore'):
+            return 20 * np.log10(self.channel_rms())
+
+
+    def gain_matrix(self, level, speakers, eq='y', rmsdb=None):
+        """ Channels x outputs gain matrix that sets the level 
+            and routes the audio to the given speakers.
+
+            LEVEL: the desired RMS level (dB) per channel
+            SPEAKERS: output channel numbers (starting at 1). 
+                A 1-channel signal is sent to every speaker; 
+                otherwise channel N is sent to speaker N.
+            EQ: 'y' sets every channel to LEVEL. 'n' applies 
+                one gain to all channels, so the mean channel
+                level is LEVEL and any ILD is preserved.
+            RMSDB: precomputed channel levels (dB), if known
+        """
+        speakers = np.atleast_1d(speakers).astype(int)
+        if self.channels > 1 and len(speakers) != self.channels:
+            raise ValueError(f"{self.channels}-channel audio needs " +
+                f"{self.channels} speakers, got {len(speakers)}")
+
+        if rmsdb is None:
+            rmsdb = self.channel_levels()
+        diffdb = self.level_differences(rmsdb, level, eq)
+        gains = 10 ** (diffdb / 20) * self.scale()
+
+        # Route channel -> speaker(s), with each gain on its route
+        rows = np.arange(self.channels).repeat(
+            len(speakers) if self.channels == 1 else 1)
+        matrix = np.zeros((self.channels, speakers.max()), np.float32)
+        matrix[rows, speakers - 1] = gains[rows]
+        return matrix
+
+
+    @staticmethod
+    def level_differences(rmsdb, level, eq='y'):
+        """ Gain (dB) per channel to reach LEVEL. Silent 
+            channels get -inf (they stay silent).
+        """
+        rmsdb = np.atleast_1d(np.asarray(rmsdb, dtype=np.float64))
+        audible = np.isfinite(rmsdb)
+        if eq == 'y':
+            diffdb = level - rmsdb
         else:
-            # 1. Convert to float64
-            sig = self.original_audio.astype(np.float64)
-            # 2. Divide by original dtype max val
-            sig = sig / self.wav_dict[str(self.data_type)][1]
-            self.working_audio = sig
+            diffdb = np.full(rmsdb.shape, level - rmsdb[audible].mean()
+                if audible.any() else -np.inf)
+        return np.where(audible, diffdb, -np.inf)
 
 
-    def play(self, device_id, channels):
-        """ Present working audio """
-        #print(f"Presenting audio data type: {np.dtype(self.working_audio[0])}")
+    def ramp(self):
+        """ Raised-cosine fade-in for trimmed audio (None if the
+            audio is not trimmed)
+        """
+        if self.trim is None:
+            return None
+        n = min(int(self.ramp_dur * self.fs), self.frames // 2)
+        return (0.5 - 0.5 * np.cos(np.pi * np.arange(n) / n)).astype(np.float32)
+
+
+    def play(self, device_id, channels, engine=None, eq='y',
+        rmsdb=None, masker_gain=None, on_finished=None, onset=None):
+        """ Present working audio on the speaker(s) in CHANNELS.
+            If a persistent output engine is provided, queue the
+            audio into its stream rather than opening a new 
+            stream. ON_FINISHED is called by the engine when 
+            playback has ended. See gain_matrix for EQ and RMSDB,
+            and AudioEngine.play for MASKER_GAIN and ONSET.
+        """
         print(f"Presenting audio data type: {self.working_audio.dtype}")
-        # plt.subplot(1,3,1)
-        # plt.plot(self.original_audio)
-        # plt.subplot(1,3,2)
-        # plt.plot(self.working_audio)
-
-        sd.default.device = device_id
-
-        if self.channels == 1:
-            sig = self.setRMS(self.working_audio, self.level)
-            self.working_audio = sig
-        elif self.channels > 1:
-            left = self.setRMS(self.working_audio[:,0], self.level)
-            right = self.setRMS(self.working_audio[:,1], self.level)
-            self.working_audio = np.array([left, right])
-        # plt.subplot(1,3,3)
-        # plt.plot(self.working_audio)
-        # plt.show()
-
-        sd.play(self.working_audio.T, self.fs, mapping=channels)
+
+        # Set the level and route channels to speakers
+        gain = self.gain_matrix(self.level, channels, eq, rmsdb)
+
+        if engine is not None:
+            # The engine applies the gain in its output callback
+            if self.stream or self.resample:
+                sig = self.stream_source()
+            else:
+                sig = self.working_audio
+            engine.play(sig, self.fs, device_id, gain,
+                ramp=self.ramp(), masker_gain=masker_gain, 
+                on_finished=on_finished, onset=onset)
+        else:
+            sd.default.device = device_id
+            if self.resample:
+                sig = np.concatenate(list(self.blocks()))
+            else:
+                sig = self.working_audio.reshape(len(self.working_audio), -1)
+            sig = sig @ gain
+            ramp = self.ramp()
+            if ramp is not None:
+                sig[:len(ramp)] *= ramp[:, np.newaxis]
+                sig[len(sig) - len(ramp):] *= ramp[::-1, np.newaxis]
+            sd.play(sig, self.fs)
         #sd.wait(self.dur+0.5)
 
 
@@ -177,14 +392,15 @@ class Audio:
 
     def setRMS(self, sig, amp, eq='n'):
         """
-            Set RMS level of a 1-channel or 2-channel signal.
+            Set RMS level of an N-channel signal.
         
-            SIG: a 1-channel or 2-channel signal
+            SIG: a 1-D signal, or a 2-D signal with one 
+                channel per row
             AMP: the desired amplitude to be applied to 
                 each channel. Note this will be the RMS 
                 per channel, not the total of both channels.
             EQ: takes 'y' or 'n'. Whether or not to equalize 
-                the levels in a 2-channel signal. For example, 
+                the levels in a multichannel signal. For example, 
                 a signal with an ILD would lose the ILD with 
                 EQ='y', so the default in 'n'.
 
@@ -199,62 +415,15 @@ class Audio:
             Created: Jan. 10, 2022
             Last edited: May 17, 2022
         """
-        #amp = self.level
-        #sig = self.working_audio
-        if len(sig.shape) == 1:
-            rmsdb = self.mag2db(self.rms(sig))
-            refdb = amp
-            diffdb = np.abs(rmsdb - refdb)
-            if rmsdb > refdb:
-                sigAdj = sig / self.db2mag(diffdb)
-            elif rmsdb < refdb:
-                sigAdj = sig * self.db2mag(diffdb)
-            # Edit 5/17/22
-            # Added handling for when rmsdb == refdb
-            elif rmsdb == refdb:
-                sigAdj = sig
-            return sigAdj
-            
-        elif len(sig.shape) == 2:
-            rmsdbLeft = self.mag2db(self.rms(sig[0]))
-            rmsdbRight = self.mag2db(self.rms(sig[1]))
-
-            ILD = np.abs(rmsdbLeft - rmsdbRight) # get lvl diff
-
-            # Determine lvl advantage
-            if rmsdbLeft > rmsdbRight:
-                lvlAdv = 'left'
-                #print("Adv: %s" % lvlAdv)
-            elif rmsdbRight > rmsdbLeft:
-                lvlAdv = 'right'
-                #print("Adv: %s" % lvlAdv)
-            elif rmsdbLeft == rmsdbRight:
-                lvlAdv = None
-
-            #refdb = amp - 3 # apply half amp to each channel
-            refdb = amp
-            diffdbLeft = np.abs(rmsdbLeft - refdb)
-            diffdbRight = np.abs(rmsdbRight - refdb)
-
-            # Adjust left channel
-            if rmsdbLeft > refdb:
-                sigAdjLeft = sig[0] / self.db2mag(diffdbLeft)
-            elif rmsdbLeft < refdb:
-                sigAdjLeft = sig[0] * self.db2mag(diffdbLeft)
-            # Adjust right channel
-            if rmsdbRight > refdb:
-                sigAdjRight = sig[1] / self.db2mag(diffdbRight)
-            elif rmsdbRight < refdb:
-                sigAdjRight = sig[1] * self.db2mag(diffdbRight)
-
-            # If there is a lvl difference to maintain across channels
-            if eq == 'n':
-                if lvlAdv == 'left':
-                    sigAdjLeft = sigAdjLeft * self.db2mag(ILD/2)
-                    sigAdjRight = sigAdjRight / self.db2mag(ILD/2)
-                elif lvlAdv == 'right':
-                    sigAdjLeft = sigAdjLeft / self.db2mag(ILD/2)
-                    sigAdjRight = sigAdjRight * self.db2mag(ILD/2)
-
-            sigBothAdj = np.array([sigAdjLeft, sigAdjRight])
-            return sigBothAdj
+        sig = np.asarray(sig, dtype=np.float64)
+        # Channels are rows (a 1-D signal is one channel)
+        with np.errstate(divide='ignore'):
+            rmsdb = 20 * np.log10(np.sqrt(np.mean(np.square(
+                np.atleast_2d(sig)), axis=1)))
+        diffdb = self.level_differences(rmsdb, amp, eq)
+        # Silent channels are returned unchanged
+        diffdb[~np.isfinite(diffdb)] = 0
+        gains = 10 ** (diffdb / 20)
+        if sig.ndim == 1:
+            return sig * gains[0]
+        return sig * gains[:, np.newaxis]
@@ -0,0 +1,139 @@
+""" Multi-talker babble built from the loaded corpus.
+
+    N randomly chosen corpus sentences are equalized in level
+    and summed per talker. The result is cached as a .wav file
+    keyed by corpus, number of talkers, seed and duration, so it
+    is built once and memory-mapped afterwards.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import hashlib
+import os
+from pathlib import Path
+
+# Import audio packages
+from scipy.io import wavfile
+
+# Import custom modules
+from models import audiomodel as a
+from models import bundlemodel as m_bundle
+
+
+#########
+# BEGIN #
+#########
+class BabbleGenerator:
+    """ Render babble tracks from a corpus.
+
+        paths: corpus audio file paths
+        metadata: metamodel.AudioMetadata for the corpus
+    """
+    # Store cached babble in user's home directory
+    cache_dir = Path.home() / 'stc_babble'
+
+    # Level of each talker before summing (dB FS)
+    talker_db = -30
+
+    def __init__(self, paths, metadata):
+        self.paths = sorted(paths)
+        self.metadata = metadata
+
+
+    def get(self, talkers, seed=1, dur=60.0):
+        """ Return the path to a cached babble .wav file,
+            building it first if needed.
+        """
+        if talkers < 1 or not self.paths:
+            raise ValueError("Babble needs at least 1 talker and " +
+                "a corpus with audio files")
+
+        path = self.cache_dir / f"babble_{talkers}talkers_seed{seed}_" \
+            f"{int(dur)}s_{self._corpus_key()}.wav"
+        if path.exists():
+            print(f"Models_Babble_56: Using cached babble: {path.name}")
+            return str(path)
+
+        print(f"Models_Babble_59: Building {talkers}-talker babble...")
+        fs, babble = self.render(talkers, seed, dur)
+        self.cache_dir.mkdir(exist_ok=True)
+        # Write to a temporary file first, so an interrupted build
+        # never leaves a partial file in the cache
+        tmp = path.with_suffix('.tmp')
+        wavfile.write(tmp, fs, babble)
+        os.replace(tmp, path)
+        return str(path)
+
+
+    def render(self, talkers, seed=1, dur=60.0):
+        """ Sum TALKERS streams of random, level-equalized corpus
+            sentences. Returns (fs, mono float32 babble).
+        """
+        # Measure any new corpus files once, up front
+        self.metadata.update(self.paths)
+        info = self.metadata.df.loc[[os.path.basename(p) for p in self.paths]]
+        fs = int(info['fs'].iloc[0])
+        usable = np.flatnonzero(info['fs'].to_numpy() == fs)
+        if len(usable) < len(self.paths):
+            print(f"Models_Babble_82: Skipping {len(self.paths) - len(usable)} " +
+                f"files that are not {fs} Hz")
+        lengths = (info['offset'] - info['onset']).to_numpy(dtype=int)
+
+        rng = np.random.default_rng(seed)
+        frames = int(dur * fs)
+        # Shuffled passes through the corpus needed to fill a track
+        passes = int(np.ceil((frames + fs) / max(lengths[usable].sum(), 1)))
+        babble = np.zeros(frames, dtype=np.float32)
+        for _ in range(talkers):
+            # Plan this talker's sentences back to back, starting up
+            # to 1 s into the first one so talkers are not aligned
+            order = np.concatenate(
+                [rng.permutation(usable) for _ in range(passes)])
+            lens = lengths[order]
+            starts = np.cumsum(lens) - lens - int(rng.integers(0, fs))
+            keep = starts < frames
+
+            for idx, pos in zip(order[keep], starts[keep]):
+                sig = self._sentence(self.paths[idx])
+                start, stop = max(pos, 0), min(pos + len(sig), frames)
+                if stop > start:
+                    babble[start:stop] += sig[start - pos:stop - pos]
+
+        # Avoid clipping when written to file
+        peak = np.abs(babble).max()
+        if peak > 1:
+            babble /= peak
+        return fs, babble
+
+
+    #####################
+    # Private functions #
+    #####################
+    def _corpus_key(self):
+        """ Short hash identifying the corpus files
+        """
+        h = hashlib.sha1()
+        for path in self.paths:
+            stat = m_bundle.stat(path)
+            h.update(f"{os.path.abspath(path)}|{stat.st_size}|" \
+                f"{stat.st_mtime_ns}".encode())
+        return h.hexdigest()[:12]
+
+
+    def _sentence(self, path):
+        """ The speech portion of one sentence as mono float32,
+            at the talker level
+        """
+        audio = a.Audio(path, 0, trim=self.metadata.speech_bounds(path))
+        rmsdb = self.metadata.levels(path)[0]
+
+        # Equalize and downmix in one step
+        diffdb = a.Audio.level_differences(rmsdb, self.talker_db, 'n')
+        gain = 10 ** (diffdb / 20) * audio.scale() / audio.channels
+        sig = audio.working_audio.reshape(len(audio.working_audio), -1)
+        return sig @ gain.astype(np.float32)
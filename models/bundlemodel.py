@@ -0,0 +1,240 @@
+""" Packed corpus bundles.
+
+    A bundle is a single file holding a corpus's sentence list,
+    an index of its audio files (with their metadata) and the
+    raw audio data. It is memory-mapped when opened, and each
+    audio file is handed out as a zero-copy view, so loading a
+    corpus doesn't need to list or read thousands of small
+    files.
+
+    Audio files inside a bundle are addressed as if the bundle
+    were a directory (e.g., 'C:/corpora/ieee.stcb/12.wav'). The
+    read() and stat() functions accept both bundle members and
+    ordinary audio files.
+
+    Build a bundle from the command line:
+        python -m models.bundlemodel AUDIO_DIR SENTENCE_FILE OUT.stcb
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import system packages
+import argparse
+import io
+import json
+import os
+import struct
+import threading
+from glob import glob
+from types import SimpleNamespace
+
+# Import custom modules
+from models import indexmodel as m_index
+from models import readermodel as m_reader
+
+
+#########
+# BEGIN #
+#########
+# File extension and format identifier
+extension = '.stcb'
+magic = b'STCBNDL1'
+# Byte alignment of each audio file in the bundle
+alignment = 64
+
+# Open bundles, by absolute path
+_bundles = dict()
+_lock = threading.Lock()
+
+
+class CorpusBundle:
+    """ A memory-mapped corpus bundle.
+
+        index: data frame of audio files (by file name), with
+            their metadata and location in the bundle
+        sentences: data frame of the sentence list
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with open(self.path, 'rb') as f:
+            if f.read(len(magic)) != magic:
+                raise ValueError(f"Not a corpus bundle: {path}")
+            size, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(size).decode('utf-8'))
+
+        self.sentences = m_index.read_sentences(
+            io.StringIO(header['sentences']))
+        self.index = pd.DataFrame(header['files']).set_index('name')
+        self.index['path'] = [os.path.join(self.path, name)
+            for name in self.index.index]
+
+        # Map the whole file once; audio is sliced from it
+        self._data = np.memmap(self.path, dtype=np.uint8, mode='r')
+
+
+    def read(self, name):
+        """ Return (fs, audio) for a file name in the bundle.
+            The audio is a read-only view (no copy), shaped
+            like wavfile.read output.
+        """
+        row = self.index.loc[name]
+        dtype = np.dtype(row['dtype'])
+        start = int(row['data_offset'])
+        stop = start + int(row['frames']) * int(row['channels']) * dtype.itemsize
+        audio = self._data[start:stop].view(dtype)
+        if row['channels'] > 1:
+            audio = audio.reshape(-1, int(row['channels']))
+        return int(row['fs']), audio
+
+
+    def audio(self, sentence_num):
+        """ Return (fs, audio) for a sentence number
+        """
+        return self.read(self.index.index[
+            self.index['file_num'] == sentence_num][0])
+
+
+def is_bundle(path):
+    """ True if PATH is a corpus bundle file
+    """
+    return str(path).endswith(extension) and os.path.isfile(path)
+
+
+def open_bundle(path):
+    """ Return the open bundle for PATH (opening it once)
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        if path not in _bundles:
+            _bundles[path] = CorpusBundle(path)
+        return _bundles[path]
+
+
+def split(file_path):
+    """ Return (bundle, name) for a bundle member, or None for
+        an ordinary file
+    """
+    bundle_path, name = os.path.split(str(file_path))
+    if is_bundle(bundle_path):
+        return open_bundle(bundle_path), name
+    return None
+
+
+def read(file_path, mmap=False):
+    """ Read an audio file, or a file in a bundle. Returns
+        (fs, audio) like wavfile.read.
+    """
+    member = split(file_path)
+    if member is None:
+        return m_reader.read(file_path, mmap=mmap)
+    bundle, name = member
+    if name not in bundle.index.index:
+        raise FileNotFoundError(file_path)
+    return bundle.read(name)
+
+
+def stat(file_path):
+    """ os.stat for an audio file. Files in a bundle report
+        the size and modification time (st_size, st_mtime_ns)
+        of the original file.
+    """
+    member = split(file_path)
+    if member is None:
+        return os.stat(file_path)
+    bundle, name = member
+    if name not in bundle.index.index:
+        raise FileNotFoundError(file_path)
+    row = bundle.index.loc[name]
+    return SimpleNamespace(st_size=int(row['size']),
+        st_mtime_ns=int(row['mtime']))
+
+
+def build(audio_dir, sentence_file, out_path):
+    """ Pack the audio files in AUDIO_DIR and SENTENCE_FILE 
+        into a bundle at OUT_PATH. Compressed files are stored
+        decoded. Levels and speech onsets are taken from (or 
+        added to) the directory's metadata file.
+    """
+    from models import metamodel as m_meta
+
+    paths = [path for pattern in m_reader.patterns()
+        for path in glob(os.path.join(audio_dir, pattern))]
+    if not paths:
+        raise FileNotFoundError(f"No audio files in {audio_dir}")
+    paths.sort(key=_file_num)
+    metadata = m_meta.AudioMetadata(audio_dir)
+    metadata.update(paths)
+
+    with open(sentence_file, encoding='utf-8') as f:
+        sentences = f.read()
+
+    # Lay out the audio data after the header, each file aligned
+    files = []
+    for path in paths:
+        name = os.path.basename(path)
+        row = metadata.df.loc[name]
+        _, audio = m_reader.read(path, mmap=True)
+        entry = {
+            'name': name,
+            'file_num': _file_num(path),
+            'nbytes': audio.nbytes
+        }
+        for col in m_meta.AudioMetadata.columns[1:]:
+            value = row[col]
+            entry[col] = value.item() if hasattr(value, 'item') else value
+        files.append(entry)
+
+    # The header size depends on the offsets, so fix a width
+    # for the offsets first
+    for entry in files:
+        entry['data_offset'] = 10 ** 15
+    start = _align(len(magic) + 8 + len(json.dumps(
+        {'version': 1, 'sentences': sentences, 'files': files}).encode()))
+    offset = start
+    for entry in files:
+        entry['data_offset'] = offset
+        offset = _align(offset + entry.pop('nbytes'))
+    header = json.dumps({'version': 1, 'sentences': sentences,
+        'files': files}).encode()
+
+    # Write to a temporary file first, so an interrupted build
+    # never leaves a partial bundle
+    tmp = f"{out_path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(magic)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for path, entry in zip(paths, files):
+            f.seek(entry['data_offset'])
+            _, audio = m_reader.read(path, mmap=True)
+            f.write(np.ascontiguousarray(audio).tobytes())
+    os.replace(tmp, out_path)
+    print(f"Models_Bundle_213: Packed {len(files)} files into {out_path}")
+    return out_path
+
+
+def _file_num(path):
+    """ Sentence number from an audio file name (e.g., 12.wav)
+    """
+    return int(os.path.splitext(os.path.basename(path))[0])
+
+
+def _align(offset):
+    """ Round an offset up to the bundle alignment
+    """
+    return -(-offset // alignment) * alignment
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pack a corpus into a Speech Task Controller bundle")
+    parser.add_argument('audio_dir', help="directory of numbered audio files")
+    parser.add_argument('sentence_file', help="sentence list .csv file")
+    parser.add_argument('out_path', help=f"bundle file to write ({extension})")
+    args = parser.parse_args()
+    build(args.audio_dir, args.sentence_file, args.out_path)
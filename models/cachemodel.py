@@ -0,0 +1,323 @@
+""" Model for caching decoded audio files in memory.
+
+    Decoded buffers are kept in a memory-bounded LRU cache
+    keyed by file path and modification time. A background
+    worker decodes upcoming files while the current trial
+    plays, so that REPEAT and NEXT never touch the disk.
+
+    If a target sample rate is set (e.g., the output device's
+    native rate), files at other rates are resampled once with
+    a polyphase filter. Resampled files are also saved to disk,
+    so each file is only ever resampled once.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import hashlib
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from math import gcd
+from pathlib import Path
+
+# Import audio packages
+from scipy.io import wavfile
+from scipy.signal import resample_poly
+
+# Import custom modules
+from models import bundlemodel as m_bundle
+
+# Dictionary of integer data types and full scale values
+# (as in Audio.wav_dict; 8-bit data are offset by 128)
+full_scale = {
+    'int32': 2147483647,
+    'int16': 32767,
+    'uint8': 128
+}
+
+
+def resample(audio, fs, target_fs):
+    """ Resample AUDIO (frames x channels, or 1-D) from FS to
+        TARGET_FS with a polyphase filter. Returns float32
+        data (integer data are scaled to +/- 1).
+    """
+    sig = audio.astype(np.float32)
+    if audio.dtype == 'uint8':
+        sig -= 128
+    if str(audio.dtype) in full_scale:
+        sig *= 1 / full_scale[str(audio.dtype)]
+    div = gcd(int(target_fs), int(fs))
+    return resample_poly(sig, int(target_fs) // div, int(fs) // div,
+        axis=0).astype(np.float32)
+
+
+def resampled_frames(frames, fs, target_fs):
+    """ Number of frames FRAMES become when resampled from FS
+        to TARGET_FS
+    """
+    return -(-int(frames) * int(target_fs) // int(fs))
+
+
+def resample_blocks(audio, fs, target_fs, frames):
+    """ Resample AUDIO (frames x channels) from FS to 
+        TARGET_FS one block at a time, yielding float32 blocks
+        of FRAMES output frames (the last may be shorter). Each
+        block is made from only the input it needs, plus the
+        filter length on each side, so the blocks join up to
+        the output of resample() and memory use does not depend
+        on the length of AUDIO.
+    """
+    div = gcd(int(target_fs), int(fs))
+    up, down = int(target_fs) // div, int(fs) // div
+    # Input frames each side of an output frame that it depends
+    # on (resample_poly's default filter half-length)
+    pad = 10 * max(up, down) // up + 2
+    n_in = len(audio)
+    n_out = resampled_frames(n_in, fs, target_fs)
+    for start in range(0, n_out, frames):
+        stop = min(start + frames, n_out)
+        # Start the input on a multiple of DOWN, so that its
+        # output frames line up with those of the whole signal
+        first = max((start * down // up - pad) // down, 0) * down
+        last = min(stop * down // up + pad + 1, n_in)
+        out = resample(audio[first:last], fs, target_fs)
+        offset = start - first * up // down
+        yield out[offset:offset + stop - start]
+
+
+def resample_file(file_path, target_fs, out_path):
+    """ Resample a .wav file and write it to OUT_PATH. Runs in
+        a worker process when pre-converting a list.
+    """
+    fs, audio = m_bundle.read(file_path)
+    sig = resample(audio, fs, target_fs)
+    # Write to a temporary file first, so an interrupted write
+    # never leaves a partial file in the cache
+    tmp = f"{out_path}.{os.getpid()}.tmp"
+    wavfile.write(tmp, int(target_fs), sig)
+    os.replace(tmp, out_path)
+    return out_path
+
+
+#########
+# BEGIN #
+#########
+class AudioCache:
+    """ Memory-bounded LRU cache of decoded audio buffers.
+
+        max_mb: upper limit on the memory used by cached
+            buffers (in megabytes)
+        lookahead: number of upcoming files to prefetch
+    """
+    # Store resampled files in user's home directory
+    resample_dir = Path.home() / 'stc_resampled'
+
+    def __init__(self, max_mb=256, lookahead=3):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lookahead = lookahead
+
+        # Sample rate buffers are returned at (None: as recorded)
+        self.target_fs = None
+
+        # Running totals for sizing the cache
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Cached (fs, audio) tuples, least recently used first
+        self._buffers = OrderedDict()
+        # Keys currently being decoded, mapped to a "done" event
+        self._pending = dict()
+        self._lock = threading.Lock()
+
+        # Start prefetch worker
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._prefetch_worker,
+            daemon=True)
+        self._worker.start()
+
+
+    def read(self, file_path):
+        """ Return (fs, audio) for the given file. Only decode
+            the file if it is not already cached. Cached
+            buffers are read-only and must not be modified.
+        """
+        key = self._key(file_path)
+        while True:
+            with self._lock:
+                if key in self._buffers:
+                    self._buffers.move_to_end(key)
+                    self.hits += 1
+                    return self._buffers[key]
+                done = self._pending.get(key)
+                if done is None:
+                    self.misses += 1
+                    done = self._pending[key] = threading.Event()
+                    break
+            # The prefetch worker is decoding this file: wait for it
+            done.wait()
+
+        return self._load(key, done)
+
+
+    def set_rate(self, target_fs):
+        """ Return audio at TARGET_FS (None: at the file's own
+            rate) from now on
+        """
+        self.target_fs = None if target_fs is None else int(target_fs)
+
+
+    def preconvert(self, file_paths, workers=None):
+        """ Resample every file that is not at the target rate
+            and not already on disk, using a pool of WORKERS 
+            processes. Returns the number of files converted.
+        """
+        if self.target_fs is None:
+            return 0
+        jobs = []
+        for file_path in file_paths:
+            fs, _ = m_bundle.read(file_path, mmap=True)
+            out_path = self._resampled_path(file_path)
+            if fs != self.target_fs and not os.path.exists(out_path):
+                jobs.append((file_path, out_path))
+        if not jobs:
+            return 0
+
+        print(f"Models_Cache_169: Resampling {len(jobs)} files to " +
+            f"{self.target_fs} Hz...")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(resample_file, [job[0] for job in jobs],
+                [self.target_fs] * len(jobs), [job[1] for job in jobs]))
+        return len(jobs)
+
+
+    def prefetch(self, file_paths):
+        """ Queue files to be decoded in the background
+        """
+        for file_path in file_paths:
+            self._queue.put(file_path)
+
+
+    def stats(self):
+        """ Return a dictionary of cache statistics
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else None,
+                'entries': len(self._buffers),
+                'target_fs': self.target_fs,
+                'size_mb': round(self.nbytes / (1024 * 1024), 2),
+                'max_mb': round(self.max_bytes / (1024 * 1024), 2)
+            }
+
+
+    def clear(self):
+        """ Remove all cached buffers and reset statistics
+        """
+        with self._lock:
+            self._buffers.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+    #####################
+    # Private functions #
+    #####################
+    def _key(self, file_path):
+        """ Cache key: absolute path, modification time and 
+            target rate. Raises FileNotFoundError for missing 
+            files.
+        """
+        file_path = os.path.abspath(file_path)
+        return (file_path, m_bundle.stat(file_path).st_mtime_ns, 
+            self.target_fs)
+
+
+    def _resampled_path(self, file_path):
+        """ Path of the resampled copy of a file. The name 
+            changes if the file changes.
+        """
+        file_path = os.path.abspath(file_path)
+        stat = m_bundle.stat(file_path)
+        tag = hashlib.sha1(f"{file_path}|{stat.st_size}|" \
+            f"{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+        self.resample_dir.mkdir(exist_ok=True)
+        return str(self.resample_dir / 
+            f"{Path(file_path).stem}_{tag}_{self.target_fs}.wav")
+
+
+    def _decode(self, file_path, target_fs):
+        """ Read a file at TARGET_FS, using (or making) the 
+            resampled copy on disk if the rates differ
+        """
+        fs, audio = m_bundle.read(file_path)
+        if target_fs is None or fs == target_fs:
+            return fs, audio
+        out_path = self._resampled_path(file_path)
+        if not os.path.exists(out_path):
+            print(f"Models_Cache_244: Resampling {os.path.basename(file_path)}" +
+                f" from {fs} to {target_fs} Hz")
+            resample_file(file_path, target_fs, out_path)
+        return wavfile.read(out_path)
+
+
+    def _load(self, key, done):
+        """ Decode a file and store it in the cache. The
+            caller must have registered DONE as pending.
+        """
+        try:
+            fs, audio = self._decode(key[0], key[2])
+            # Protect cached buffer from in-place changes
+            audio.setflags(write=False)
+            self._store(key, (fs, audio))
+        finally:
+            with self._lock:
+                del self._pending[key]
+            done.set()
+        return fs, audio
+
+
+    def _store(self, key, item):
+        """ Add a buffer and evict least recently used
+            buffers until the cache fits in memory.
+        """
+        size = item[1].nbytes
+        if size > self.max_bytes:
+            # Never cache a buffer that can't fit
+            return
+
+        with self._lock:
+            if key in self._buffers:
+                return
+            self._buffers[key] = item
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, old) = self._buffers.popitem(last=False)
+                self.nbytes -= old.nbytes
+
+
+    def _prefetch_worker(self):
+        """ Decode queued files that are not already cached
+        """
+        while True:
+            file_path = self._queue.get()
+            try:
+                key = self._key(file_path)
+                with self._lock:
+                    if key in self._buffers or key in self._pending:
+                        continue
+                    done = self._pending[key] = threading.Event()
+                self._load(key, done)
+            except (OSError, ValueError) as e:
+                print(f"Models_Cache_298: Could not prefetch {file_path}: {e}")
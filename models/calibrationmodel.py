@@ -0,0 +1,90 @@
+""" Calibration table.
+
+    Stores one calibration per output device, speaker(s) and
+    calibration stimulus, with the time it was made, so that
+    changing speakers or devices uses the right SLM offset
+    without recalibrating.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import json
+import os
+import time
+from pathlib import Path
+
+
+#########
+# BEGIN #
+#########
+class CalibrationTable:
+    """ Calibrations by (device name, speakers, stimulus).
+
+        Each entry holds raw_lvl, slm_cal_value, slm_offset
+        and timestamp (seconds since the epoch).
+    """
+    def __init__(self):
+        # Store calibration file in user's home directory
+        self.filepath = Path.home() / 'speech_task_cal.json'
+        self.entries = dict()
+
+        # Load calibration file
+        self.load()
+
+
+    @staticmethod
+    def key(device, speakers, stimulus):
+        """ Table key for a device name, speaker numbers and
+            calibration stimulus
+        """
+        return f"{device}|{' '.join(str(s) for s in speakers)}|{stimulus}"
+
+
+    def lookup(self, key):
+        """ Return the calibration entry for KEY, or None
+        """
+        return self.entries.get(key)
+
+
+    def record(self, key, raw_lvl, slm_cal_value):
+        """ Store a new calibration for KEY and save the table
+        """
+        entry = {
+            'raw_lvl': raw_lvl,
+            'slm_cal_value': slm_cal_value,
+            'slm_offset': slm_cal_value - raw_lvl,
+            'timestamp': time.time()
+        }
+        self.entries[key] = entry
+        self.save()
+        return entry
+
+
+    @staticmethod
+    def age(entry):
+        """ Age of a calibration entry in days
+        """
+        return (time.time() - entry['timestamp']) / 86400
+
+
+    def load(self):
+        """ Load calibrations from file
+        """
+        print("\nModels_Calibration_73: Checking for calibration file...")
+        if not self.filepath.exists():
+            return
+        with open(self.filepath, 'r') as fh:
+            self.entries = json.load(fh)
+
+
+    def save(self):
+        """ Write calibrations to file, replacing the old file in
+            one step
+        """
+        print("Models_Calibration_83: Writing calibration table to file...")
+        tmp = self.filepath.with_suffix('.tmp')
+        with open(tmp, 'w') as fh:
+            json.dump(self.entries, fh, indent=1)
+        os.replace(tmp, self.filepath)
@@ -53,3 +53,16 @@ class CSVModel:
                 csvwriter.writeheader()
             csvwriter.writerow(data)
         print("Models_csvmodel_52:Record successfully saved!")
+
+
+    def save_timing(self, stats):
+        """ Save a session's onset timing summary next to the
+            trial data (one row, in ms)
+        """
+        filename = f"{self.datestamp}_{self.sessionpars['Condition'].get()}_{self.sessionpars['Subject'].get()}_timing.csv"
+        with open(filename, 'w', newline='') as fh:
+            csvwriter = csv.DictWriter(fh, fieldnames=stats.keys())
+            csvwriter.writeheader()
+            csvwriter.writerow({key: round(float(val), 3) 
+                for key, val in stats.items()})
+        print("Models_csvmodel_66: Onset timing saved!")
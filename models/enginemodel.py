@@ -0,0 +1,585 @@
+""" Persistent audio output engine.
+
+    Keeps one sounddevice output stream open for the current
+    device/output channels/sample rate, instead of opening and
+    closing a stream for every trial. Trials are queued and
+    written to the device from the stream callback, which also
+    reports when the last sample of a trial has been played and
+    mixes in an optional continuous masker and calibration 
+    noise.
+
+    Each trial can be scheduled to start at a chosen stream 
+    time. The callback records when its first sample reaches
+    the DAC (outputBufferDacTime) and can write a trigger pulse
+    on a spare output channel at that moment.
+
+    The callback also meters the output: per-channel RMS (from
+    every few samples) and peak levels are published every 
+    meter_interval seconds for the GUI, and readings that clip
+    are counted per trial.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import queue
+import threading
+import time as _time
+
+# Import data science packages
+import numpy as np
+
+# Import audio packages
+import sounddevice as sd
+
+
+#########
+# BEGIN #
+#########
+def onset_stats(timings):
+    """ Summary (ms) of trial onset timing dictionaries: 
+        latency from queueing to the first sample at the DAC,
+        and the error relative to the scheduled onset. None if
+        no trial has started.
+    """
+    timings = [t for t in timings if t['onset'] is not None]
+    if not timings:
+        return None
+    latency = np.array([t['latency'] for t in timings]) * 1000
+    error = np.array([t['onset'] - t['scheduled'] 
+        for t in timings]) * 1000
+    return {
+        'trials': len(timings),
+        'latency mean': latency.mean(),
+        'latency sd': latency.std(),
+        'latency min': latency.min(),
+        'latency max': latency.max(),
+        'error mean': error.mean(),
+        'error max': np.abs(error).max()
+    }
+
+
+class AudioEngine:
+    """ Long-lived output stream that presents queued trials.
+
+        blocksize: frames per callback (0 lets the host API
+            choose an optimal, possibly varying, block size)
+        latency: suggested output latency in seconds, or
+            'low'/'high' for the device defaults
+        onset_delay: start each trial this long (s) after it
+            is queued, rather than as soon as possible
+        trigger_channel: output channel (1 = first) for a 
+            trigger pulse at each trial onset (None: no trigger)
+    """
+    # Trigger pulse length (s) and amplitude
+    trigger_dur = 0.01
+    trigger_level = 1.0
+
+    # Seconds per meter reading, and the RMS uses every Nth
+    # sample
+    meter_interval = 0.04
+    meter_decimate = 4
+
+    def __init__(self, blocksize=0, latency='low', onset_delay=0.0,
+        trigger_channel=None):
+        self.blocksize = blocksize
+        self.latency = latency
+        self.onset_delay = onset_delay
+        self.trigger_channel = trigger_channel
+
+        # Measured output latency of the open stream (seconds)
+        self.output_latency = None
+        # Sample rate of the open stream (Hz)
+        self.fs = None
+        # Number of callbacks reporting an underflow
+        self.underflows = 0
+        # Onset timing of each trial played (see play)
+        self.onsets = []
+        self.last_timing = None
+        # Frames of trigger pulse still to write
+        self._trigger_left = 0
+
+        # Latest meter reading: (RMS, peak) per output channel 
+        # (linear), replaced every meter_interval
+        self.meter = None
+        # Meter readings that clipped
+        self.clips = 0
+        self._meter_sq = np.zeros(0)
+        self._meter_peak = np.zeros(0, dtype=np.float32)
+        self._meter_count = 0
+        self._meter_frames = 0
+
+        self._stream = None
+        self._key = None
+        self._trials = queue.SimpleQueue()
+        self._current = None
+        self._block = np.zeros((0, 0), dtype=np.float32)
+
+        # Continuous masker (maskermodel.MaskerStream)
+        self.masker = None
+        # Calibration noise (noisemodel.NoiseGenerator)
+        self.noise = None
+
+        # Deliver "playback finished" notifications off the audio 
+        # thread, so slow handlers can't cause underflows
+        self._finished = queue.SimpleQueue()
+        self._notifier = threading.Thread(target=self._notify_worker,
+            daemon=True)
+        self._notifier.start()
+
+
+    def configure(self, blocksize, latency, onset_delay=0.0,
+        trigger_channel=None):
+        """ Update stream settings. The stream is reopened
+            with the new settings on the next trial.
+        """
+        self.onset_delay = onset_delay
+        self.trigger_channel = trigger_channel
+        try:
+            latency = float(latency)
+        except ValueError:
+            # 'low' or 'high'
+            pass
+
+        if (blocksize, latency) != (self.blocksize, self.latency):
+            self.blocksize = blocksize
+            self.latency = latency
+            self.close()
+
+
+    @staticmethod
+    def parse_speakers(text):
+        """ Get space-separated speaker numbers as integers
+        """
+        speakers = [int(val) for val in str(text).split()]
+        if not speakers or min(speakers) < 1:
+            raise ValueError("Speaker numbers must be integers >= 1")
+        return speakers
+
+
+    @staticmethod
+    def device_rate(device_id):
+        """ Return the default (native) sample rate of an 
+            output device. Raises ValueError for an invalid 
+            device.
+        """
+        try:
+            info = sd.query_devices(device_id, 'output')
+        except (sd.PortAudioError, ValueError) as e:
+            raise ValueError(str(e)) from e
+        return int(info['default_samplerate'])
+
+
+    @staticmethod
+    def device_name(device_id):
+        """ Return the name of an output device. Raises 
+            ValueError for an invalid device.
+        """
+        try:
+            info = sd.query_devices(device_id, 'output')
+        except (sd.PortAudioError, ValueError) as e:
+            raise ValueError(str(e)) from e
+        return info['name']
+
+
+    def open(self, device_id, channels, fs):
+        """ Open (or reuse) an output stream with CHANNELS
+            output channels on a device, at a sample rate. 
+            Raises ValueError if the stream cannot be opened.
+        """
+        key = (device_id, int(channels), int(fs))
+        if self._stream is not None and key == self._key:
+            return
+
+        # Only one stream per device at a time
+        self.close()
+        try:
+            self._stream = sd.OutputStream(
+                device=device_id,
+                samplerate=fs,
+                blocksize=self.blocksize,
+                latency=self.latency,
+                channels=int(channels),
+                dtype='float32',
+                callback=self._callback,
+                finished_callback=self._on_stream_finished
+            )
+            self._stream.start()
+        except sd.PortAudioError as e:
+            self._stream = None
+            raise ValueError(str(e)) from e
+
+        self._key = key
+        self.fs = int(fs)
+        self.output_latency = self._stream.latency
+        print(f"Models_Engine_81: Opened output stream on device " +
+            f"{device_id} at {fs} Hz, {channels} channels, " +
+            f"blocksize {self.blocksize}")
+        print(f"Models_Engine_84: Output latency: " +
+            f"{self.output_latency * 1000:.1f} ms")
+
+
+    def set_masker(self, masker, gain=None):
+        """ Start mixing a continuous masker into the stream.
+            GAIN is the masker's channels x outputs matrix 
+            (None: silent until the first trial sets it).
+        """
+        if self._stream is not None and masker.fs != self._key[2]:
+            raise ValueError(f"Masker sample rate ({masker.fs} Hz) " +
+                f"does not match the stream ({self._key[2]} Hz)")
+        if gain is not None:
+            masker.gain = self._fit(gain)
+        self.remove_masker()
+        self.masker = masker
+
+
+    def remove_masker(self):
+        """ Stop mixing the masker
+        """
+        masker, self.masker = self.masker, None
+        if masker is not None:
+            masker.stop()
+
+
+    def play_noise(self, noise, device_id, gain):
+        """ Play generated noise continuously until stopped.
+            GAIN is the noise's 1 x outputs gain matrix.
+        """
+        self.open(device_id, gain.shape[1], noise.fs)
+        noise.gain = self._fit(gain)
+        self.noise = noise
+
+
+    def set_noise_gain(self, gain):
+        """ Change the noise level (and routing) while it plays
+        """
+        if self.noise is not None:
+            self.noise.gain = self._fit(gain)
+
+
+    def stop_noise(self):
+        """ Stop the calibration noise
+        """
+        self.noise = None
+
+
+    @property
+    def time(self):
+        """ Current time of the open stream's clock (s), or 
+            None if no stream is open
+        """
+        if self._stream is None:
+            return None
+        return self._stream.time
+
+
+    @property
+    def dropouts(self):
+        """ Output underflows plus masker ring underruns
+        """
+        masker = self.masker
+        return self.underflows + (0 if masker is None else masker.underruns)
+
+
+    def onset_stats(self):
+        """ Summary (ms) of the onset timing of the trials
+            played so far. See onset_stats.
+        """
+        return onset_stats(self.onsets)
+
+
+    def play(self, sig, fs, device_id, gain, ramp=None, masker_gain=None,
+        on_finished=None, onset=None):
+        """ Queue a signal (frames x channels, or 1-D for a
+            single channel) for presentation. Any trial still
+            playing is replaced.
+
+            The signal is not copied: it may be float32 or the
+            file's native int16/int32 data, or a streammodel 
+            BlockStream for long files. GAIN is a channels 
+            x outputs matrix that levels the signal and routes 
+            it to the output channels in one step. It is 
+            applied in the callback, and must include any 
+            int-to-float scaling.
+
+            ramp: optional fade-in envelope. It is applied to 
+                the start of the signal and, reversed, to the end.
+
+            masker_gain: new masker gain matrix, applied when 
+                the trial starts (sets the per-trial SNR)
+
+            on_finished: called (from a worker thread) once the
+                last sample has left the output buffer. Also 
+                called, right away, if the stream stops or is
+                closed while the trial plays (e.g., the device
+                is lost), so the caller is never left waiting.
+                Not called if the trial is replaced by another
+                trial or silenced with stop().
+
+            onset: stream time (see time) at which the first 
+                sample should reach the DAC. Default: 
+                onset_delay after now (as soon as possible if 
+                onset_delay is 0).
+
+            Returns the trial's timing dictionary: 'requested'
+            (stream time when queued), 'scheduled', and, once
+            the trial starts, 'onset' (stream time of the first
+            sample at the DAC), 'latency' (onset - requested, s)
+            and 'clock' (onset as time.time()). 'clips' counts 
+            the meter readings that clipped during the trial.
+        """
+        if isinstance(sig, np.ndarray):
+            sig = sig.reshape(len(sig), -1)
+        gain = np.asarray(gain, dtype=np.float32)
+        if gain.ndim != 2 or gain.shape[0] != sig.shape[1]:
+            raise ValueError("Gain matrix must have one row per " +
+                "audio channel")
+
+        if ramp is None or len(ramp) == 0:
+            ramp = None
+        else:
+            ramp = np.asarray(ramp, dtype=np.float32)[:, np.newaxis]
+            ramp = (ramp, ramp[::-1])
+
+        channels = gain.shape[1]
+        if self.masker is not None:
+            if self.masker.fs != fs:
+                raise ValueError(f"Masker sample rate ({self.masker.fs} " +
+                    f"Hz) does not match the audio ({fs} Hz)")
+            if masker_gain is None:
+                masker_gain = self.masker.gain
+            if masker_gain is not None:
+                channels = max(channels, masker_gain.shape[1])
+        if self.trigger_channel:
+            channels = max(channels, self.trigger_channel)
+
+        self.open(device_id, channels, fs)
+        if masker_gain is not None:
+            masker_gain = self._fit(masker_gain)
+        requested = self._stream.time
+        if onset is None:
+            onset = requested + self.onset_delay
+        timing = {'requested': requested, 'scheduled': onset, 
+            'onset': None, 'latency': None, 'clock': None, 'clips': 0}
+        self.last_timing = timing
+        self._trials.put(
+            (sig, self._fit(gain), ramp, masker_gain, on_finished, timing))
+        return timing
+
+
+    def stop(self):
+        """ Silence the current trial without closing the stream
+        """
+        self._trials.put(None)
+
+
+    def close(self):
+        """ Stop and close the open stream
+        """
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            print("Models_Engine_117: Closed output stream")
+        self._stream = None
+        self._key = None
+        self._release()
+        self._current = None
+        self.noise = None
+
+
+    def shutdown(self):
+        """ Close the stream when the application exits
+        """
+        self.close()
+
+
+    def _fit(self, gain):
+        """ Pad a gain matrix with silent outputs to match the
+            number of stream channels
+        """
+        gain = np.asarray(gain, dtype=np.float32)
+        channels = self._key[1] if self._key else gain.shape[1]
+        if gain.shape[1] < channels:
+            gain = np.pad(gain, ((0, 0), (0, channels - gain.shape[1])))
+        return gain
+
+
+    ###################
+    # Stream callback #
+    ###################
+    def _callback(self, outdata, frames, time, status):
+        """ Write and meter the next block
+        """
+        if status.output_underflow:
+            self.underflows += 1
+        self._render(outdata, frames, time)
+        self._meter(outdata)
+
+
+    def _render(self, outdata, frames, time):
+        """ Write the next block of the current trial. When the
+            trial ends, schedule its finished notification for 
+            the moment the last sample reaches the DAC.
+        """
+        # Newest queued trial (or stop request) replaces current
+        try:
+            while True:
+                trial = self._trials.get_nowait()
+                self._release()
+                self._current = None if trial is None else [trial, 0]
+                # Set the masker level for the new trial
+                if trial is not None and trial[3] is not None and \
+                    self.masker is not None:
+                    self.masker.gain = trial[3]
+        except queue.Empty:
+            pass
+
+        outdata.fill(0)
+        if self.masker is not None:
+            self.masker.mix_into(outdata)
+        noise = self.noise
+        if noise is not None:
+            noise.mix_into(outdata)
+        if self._trigger_left:
+            self._write_trigger(outdata, 0)
+        if self._current is None:
+            return
+
+        (sig, gain, ramp, _, on_finished, timing), pos = self._current
+        fs = self._stream.samplerate
+        start = 0
+        if timing['onset'] is None:
+            # Wait for the scheduled onset, then start at the 
+            # frame that reaches the DAC at that time
+            start = round((timing['scheduled'] - 
+                time.outputBufferDacTime) * fs)
+            if start >= frames:
+                return
+            start = max(start, 0)
+            timing['onset'] = time.outputBufferDacTime + start / fs
+            timing['latency'] = timing['onset'] - timing['requested']
+            timing['clock'] = _time.time() + timing['onset'] - \
+                time.currentTime
+            self.onsets.append(timing)
+            if self.trigger_channel:
+                self._trigger_left = round(self.trigger_dur * fs)
+                self._write_trigger(outdata, start)
+        out = outdata[start:]
+
+        n = min(frames - start, len(sig) - pos)
+        if isinstance(sig, np.ndarray):
+            chunk = sig[pos:pos + n]
+        else:
+            # Streamed: take what the reader thread has ready
+            # (the rest of this block is silent if it fell behind)
+            chunk = sig.read(n)
+            n = len(chunk)
+        # Level and route all channels in one step, into a 
+        # reused block (mixed with the masker below)
+        if (self._block.shape[0] < n or
+            self._block.shape[1] != gain.shape[1]):
+            self._block = np.empty((frames, gain.shape[1]), np.float32)
+        block = self._block[:n]
+        np.matmul(chunk, gain, out=block)
+
+        if ramp is not None:
+            ramp_in, ramp_out = ramp
+            # Fade in
+            if pos < len(ramp_in):
+                k = min(n, len(ramp_in) - pos)
+                block[:k] *= ramp_in[pos:pos + k]
+            # Fade out
+            fade_start = len(sig) - len(ramp_out)
+            if pos + n > fade_start:
+                k = max(fade_start - pos, 0)
+                r = pos + k - fade_start
+                block[k:n] *= ramp_out[r:r + n - k]
+        out[:n] += block
+        pos += n
+        if pos >= len(sig):
+            self._release()
+            self._current = None
+            if on_finished is not None:
+                # Time at which the last sample of this block is output
+                end = time.outputBufferDacTime + (start + n) / fs
+                delay = max(0.0, end - time.currentTime)
+                self._finished.put((_time.perf_counter() + delay, on_finished))
+        else:
+            self._current[1] = pos
+
+
+    def _meter(self, outdata):
+        """ Add a block to the running meter reading, and 
+            publish the reading every meter_interval
+        """
+        channels = outdata.shape[1]
+        if len(self._meter_sq) != channels:
+            self._meter_sq = np.zeros(channels)
+            self._meter_peak = np.zeros(channels, dtype=np.float32)
+            self._meter_count = self._meter_frames = 0
+
+        # Sum of squares of every Nth sample; exact peak
+        sub = outdata[::self.meter_decimate]
+        self._meter_sq += np.einsum('ij,ij->j', sub, sub)
+        self._meter_count += len(sub)
+        np.maximum(self._meter_peak, outdata.max(axis=0), 
+            out=self._meter_peak)
+        np.maximum(self._meter_peak, -outdata.min(axis=0), 
+            out=self._meter_peak)
+        self._meter_frames += len(outdata)
+        fs = self._stream.samplerate
+        if self._meter_frames < self.meter_interval * fs:
+            return
+
+        peak = self._meter_peak
+        self.meter = (np.sqrt(self._meter_sq / self._meter_count), peak)
+        if peak.max() >= 1:
+            self.clips += 1
+            if self._current is not None:
+                self._current[0][5]['clips'] += 1
+        self._meter_sq = np.zeros(channels)
+        self._meter_peak = np.zeros(channels, dtype=np.float32)
+        self._meter_count = self._meter_frames = 0
+
+
+    def _write_trigger(self, outdata, start):
+        """ Write (the rest of) the trigger pulse from frame 
+            START on
+        """
+        k = min(self._trigger_left, len(outdata) - start)
+        outdata[start:start + k, self.trigger_channel - 1] = \
+            self.trigger_level
+        self._trigger_left -= k
+
+
+    def _release(self):
+        """ Stop the reader thread of a streamed trial
+        """
+        if self._current is not None and \
+            not isinstance(self._current[0][0], np.ndarray):
+            self._current[0][0].stop()
+
+
+    def _on_stream_finished(self):
+        """ Stream stopped or aborted: release a trial that 
+            was still playing
+        """
+        if self._current is not None:
+            on_finished = self._current[0][4]
+            self._release()
+            self._current = None
+            if on_finished is not None:
+                self._finished.put((_time.perf_counter(), on_finished))
+
+
+    def _notify_worker(self):
+        """ Wait until each trial has been output, then call 
+            its finished handler
+        """
+        while True:
+            deadline, on_finished = self._finished.get()
+            remaining = deadline - _time.perf_counter()
+            if remaining > 0:
+                _time.sleep(remaining)
+            on_finished()
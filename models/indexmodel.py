@@ -0,0 +1,271 @@
+""" Persistent index of stimulus directories.
+
+    Keeps the audio and sentence files of each stimulus
+    directory, and the rows of each sentence file, in an SQLite
+    database. A directory is only listed again when its
+    modification time changes, and then only new, changed
+    (size or modification time) and removed files are updated.
+    A sentence file is only read again when it changes, so
+    CSV parsing is skipped at later startups. Files and
+    sentences are selected with indexed queries.
+
+    A sentence directory can hold any number of sentence files.
+    Only the sentence, list_num and sentence_num columns are
+    read (in chunks), and selected sentences are returned with
+    compact column types (Arrow-backed strings if the optional
+    pyarrow package is installed).
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import pandas as pd
+
+# Import system packages
+import itertools
+import os
+import sqlite3
+from pathlib import Path
+
+# pyarrow is optional: Arrow-backed strings take less memory
+try:
+    _string = pd.StringDtype('pyarrow')
+except ImportError:
+    _string = pd.StringDtype()
+
+# Import custom modules
+from models import readermodel as m_reader
+
+
+#########
+# BEGIN #
+#########
+# Version of the database layout: databases with an older
+# layout are rebuilt
+_version = 2
+
+_drop = """
+    DROP TABLE IF EXISTS dirs;
+    DROP TABLE IF EXISTS files;
+    DROP TABLE IF EXISTS sentence_files;
+    DROP TABLE IF EXISTS sentences;
+"""
+
+_schema = """
+    CREATE TABLE IF NOT EXISTS dirs (
+        path TEXT PRIMARY KEY, mtime_ns INTEGER, exts TEXT);
+    CREATE TABLE IF NOT EXISTS files (
+        dir TEXT, name TEXT, size INTEGER, mtime_ns INTEGER,
+        ext TEXT, file_num INTEGER, PRIMARY KEY (dir, name));
+    CREATE INDEX IF NOT EXISTS files_num ON files (dir, file_num);
+    CREATE TABLE IF NOT EXISTS sentence_files (
+        path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER);
+    CREATE TABLE IF NOT EXISTS sentences (
+        file TEXT, row INTEGER, list_num INTEGER, sentence_num INTEGER,
+        sentence TEXT, PRIMARY KEY (file, row));
+    CREATE INDEX IF NOT EXISTS sentences_list ON sentences (file, list_num);
+    CREATE TEMP TABLE IF NOT EXISTS selected_nums (value PRIMARY KEY);
+    CREATE TEMP TABLE IF NOT EXISTS selected_files (value PRIMARY KEY);
+    CREATE TEMP TABLE IF NOT EXISTS selected_lists (value PRIMARY KEY);
+"""
+
+
+def _marks(values):
+    """ SQL placeholders for a list of values
+    """
+    return ", ".join("?" * len(values))
+
+
+# Sentence file columns used by the task
+sentence_columns = ('sentence', 'list_num', 'sentence_num')
+
+
+def read_sentences(source, chunksize=None):
+    """ Read the columns used by the task from a sentence file
+        (path or buffer), with compact types. Returns an 
+        iterator of data frames of CHUNKSIZE rows, if given.
+        Raises ValueError if a column is missing.
+    """
+    return pd.read_csv(source, usecols=sentence_columns,
+        chunksize=chunksize, dtype={
+            'sentence': _string,
+            'list_num': 'int32',
+            'sentence_num': 'int32'
+        })
+
+
+class CorpusIndex:
+    """ SQLite index of audio files and sentences.
+
+        filepath: database file
+    """
+    # Store index in user's home directory
+    filepath = Path.home() / 'stc_index.sqlite'
+
+    # Rows of a sentence file read at a time
+    chunksize = 10000
+
+    def __init__(self, filepath=None):
+        if filepath is not None:
+            self.filepath = Path(filepath)
+        self._db = sqlite3.connect(self.filepath)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != \
+            _version:
+            self._db.executescript(_drop)
+            self._db.execute(f"PRAGMA user_version = {_version}")
+        self._db.executescript(_schema)
+
+
+    def audio_files(self, audio_dir, file_nums=None):
+        """ Data frame of audio file paths and numbers in
+            AUDIO_DIR, sorted by file number. Only files
+            numbered FILE_NUMS, if given.
+        """
+        folder = self._refresh(audio_dir)
+        exts = list(m_reader.extensions())
+        query = "SELECT name, file_num FROM files WHERE dir = ? AND " + \
+            f"file_num IS NOT NULL AND ext IN ({_marks(exts)})"
+        params = [folder] + exts
+        with self._db:
+            if file_nums is not None:
+                query += " AND file_num IN " + self._select('selected_nums',
+                    (int(num) for num in file_nums))
+            rows = self._db.execute(query + " ORDER BY file_num", params
+                ).fetchall()
+        return pd.DataFrame({
+            'path': [os.path.join(audio_dir, name) for name, _ in rows],
+            'file_num': [num for _, num in rows]
+        })
+
+
+    def sentences(self, sentence_dir, lists, exclude=()):
+        """ Sentences in LISTS from all sentence files in
+            SENTENCE_DIR (in file name order), with the file name
+            in the 'file' column and their row number in that 
+            file in the 'index' column. Also returns the number 
+            of sentence files found, and the names of .csv files
+            skipped because they lack the sentence_columns. 
+            Files named in EXCLUDE are ignored.
+        """
+        folder = self._refresh(sentence_dir)
+        names = [name for name, in self._db.execute("SELECT name FROM " +
+            "files WHERE dir = ? AND ext = '.csv' ORDER BY name", (folder,))
+            if name not in exclude]
+        skipped = [name for name in names 
+            if not self._import(os.path.join(folder, name))]
+        names = [name for name in names if name not in skipped]
+        if not names:
+            raise FileNotFoundError(f"No sentence file in {sentence_dir}")
+        paths = [os.path.join(folder, name) for name in names]
+
+        with self._db:
+            rows = self._db.execute("SELECT file, row, sentence, list_num, " +
+                "sentence_num FROM sentences WHERE file IN " + 
+                self._select('selected_files', paths) + " AND list_num IN " + 
+                self._select('selected_lists', (int(num) for num in lists)) +
+                " ORDER BY file, row").fetchall()
+        files, index, sentence, list_num, sentence_num = \
+            zip(*rows) if rows else ((),) * 5
+        df = pd.DataFrame({
+            'index': pd.array(index, dtype='int32'),
+            'file': pd.Categorical([os.path.basename(path) for path 
+                in files], categories=names),
+            'sentence': pd.array(sentence, dtype=_string),
+            'list_num': pd.Categorical(list_num),
+            'sentence_num': pd.array(sentence_num, dtype='int32')
+        })
+        return df, len(names), skipped
+
+
+    #####################
+    # Private functions #
+    #####################
+    def _select(self, table, values):
+        """ Fill temporary TABLE with VALUES, and return a
+            subquery of them for an IN clause. Used instead of
+            one parameter per value, as SQLite limits the 
+            number of parameters in a query.
+        """
+        self._db.execute(f"DELETE FROM temp.{table}")
+        self._db.executemany(f"INSERT OR IGNORE INTO temp.{table} " +
+            "VALUES (?)", ((value,) for value in values))
+        return f"(SELECT value FROM temp.{table})"
+
+
+    def _refresh(self, folder):
+        """ Update the files of FOLDER if it has changed since
+            it was indexed. Returns its key in the index.
+        """
+        key = os.path.abspath(folder)
+        mtime = os.stat(key).st_mtime_ns
+        exts = " ".join(m_reader.extensions() + ('.csv',))
+        row = self._db.execute("SELECT mtime_ns, exts FROM dirs WHERE " +
+            "path = ?", (key,)).fetchone()
+        if row != (mtime, exts):
+            self._scan(key, mtime, exts.split())
+        return key
+
+
+    def _scan(self, key, mtime, exts):
+        """ List a directory and update only the entries that
+            were added, changed or removed
+        """
+        old = {name: (size, mtime_ns) for name, size, mtime_ns in
+            self._db.execute("SELECT name, size, mtime_ns FROM files " +
+            "WHERE dir = ?", (key,))}
+        new = dict()
+        with os.scandir(key) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() in exts and entry.is_file():
+                    stat = entry.stat()
+                    new[entry.name] = (stat.st_size, stat.st_mtime_ns,
+                        ext.lower(), int(stem) if stem.isdigit() else None)
+        changed = [(key, name) + values for name, values in new.items()
+            if old.get(name) != values[:2]]
+        removed = [(key, name) for name in set(old) - set(new)]
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO files VALUES " +
+                "(?, ?, ?, ?, ?, ?)", changed)
+            self._db.executemany("DELETE FROM files WHERE dir = ? AND " +
+                "name = ?", removed)
+            self._db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                (key, mtime, " ".join(exts)))
+        print(f"Models_Index_150: Indexed {key}: {len(changed)} new or " +
+            f"changed, {len(removed)} removed")
+
+
+    def _import(self, path):
+        """ Read a sentence file into the index (in chunks) if
+            it has changed. Returns False if it is not a 
+            sentence file (a sentence_columns column is missing).
+        """
+        stat = os.stat(path)
+        row = self._db.execute("SELECT size, mtime_ns FROM " +
+            "sentence_files WHERE path = ?", (path,)).fetchone()
+        if row == (stat.st_size, stat.st_mtime_ns):
+            return True
+        try:
+            columns = pd.read_csv(path, nrows=0).columns
+        except ValueError:
+            # Empty file
+            return False
+        if not set(sentence_columns) <= set(columns):
+            return False
+
+        count = 0
+        with self._db:
+            self._db.execute("DELETE FROM sentences WHERE file = ?", (path,))
+            for chunk in read_sentences(path, self.chunksize):
+                self._db.executemany("INSERT INTO sentences VALUES " +
+                    "(?, ?, ?, ?, ?)", zip(itertools.repeat(path),
+                    range(count, count + len(chunk)),
+                    chunk['list_num'].astype(int).tolist(),
+                    chunk['sentence_num'].tolist(),
+                    chunk['sentence'].tolist()))
+                count += len(chunk)
+            self._db.execute("INSERT OR REPLACE INTO sentence_files VALUES " +
+                "(?, ?, ?)", (path, stat.st_size, stat.st_mtime_ns))
+        print(f"Models_Index_172: Indexed {count} sentences from {path}")
+        return True
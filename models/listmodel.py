@@ -9,12 +9,17 @@
 # Import GUI packages
 from tkinter import messagebox
 
-# Import data science packages
-import pandas as pd
-
 # Import system packages
 import os
-from glob import glob
+
+# Import custom modules
+from models import babblemodel as m_babble
+from models import bundlemodel as m_bundle
+from models import indexmodel as m_index
+from models import metamodel as m_meta
+from models import mirrormodel as m_mirror
+from models import planmodel as m_plan
+from models import readermodel as m_reader
 
 
 #########
@@ -22,34 +27,76 @@ from glob import glob
 #########
 class StimulusList:
     """ Load audio files and written sentences into dataframes.
-        Subset dataframes based on provided list numbers.
+        Subset dataframes based on provided list numbers. The
+        audio files path can be a directory or a corpus bundle
+        (which also holds the sentences).
 
         Returns:
             self.audio_df: data frame of audio paths/names
             self.sentence_df: data frame of sentences, indexes
+            self.plan: trials (sentence and audio file joined
+                on sentence number) in presentation order
+            self.metadata: levels, peak, duration, etc. of 
+                each audio file
+            self.corpus_df: data frame of all audio files in
+                the directory (not subset)
+            self.mirror: local mirror of the stimulus 
+                directories (None if not used)
     """
+    # Session parameters the loaded stimuli depend on
+    load_pars = ('Audio Files Path', 'Sentence File Path', 'Local Mirror',
+        'Key Word Markup', 'Shuffle Sentences', 'List Order',
+        'Counterbalance Conditions', 'Randomization Seed', 'Plan Number',
+        'Condition')
 
     def __init__(self, sessionpars):
         # Initialize
         self.sessionpars = sessionpars
+        self.bundle = None
+        self.mirror = None
+        # Lists and parameters of the last successful load
+        self._loaded = None
 
+        # Persistent index of stimulus directories
+        self.index = m_index.CorpusIndex()
 
-    def load(self):
+
+    def load(self, sync=False):
         """ Controller to call task functions 
-            in the proper order.
+            in the proper order. SYNC brings the local 
+            mirror up to date (otherwise the last synced 
+            copy is used, if there is one). Otherwise, the
+            stimuli are only loaded again (and any warnings 
+            shown again) if the lists or load_pars have 
+            changed.
         """
         # Retrieve specified list number(s)
         self._get_list_nums()
+        key = (tuple(self.lists),) + tuple(self.sessionpars[name].get() 
+            for name in self.load_pars)
+        if not sync and key == self._loaded:
+            return
+        self._loaded = None
 
         try:
+            # Get stimulus paths (local copies, if mirrored)
+            self._get_paths(sync)
+            # Open corpus bundle (if given)
+            self._get_bundle()
             # Load and subset sentences
             # Must occur before audio call
             self._get_sentences()
             # Load and subset audio files
             # Based on sentence call
             self._get_audio_files()
+            # Pair sentences with audio files
+            self._get_plan()
+            # Load or compute audio file levels
+            self._get_metadata()
         except FileNotFoundError:
             print("Models_Listmodel_52: Cannot find stimuli!")
+            return
+        self._loaded = key
 
 
     def _get_list_nums(self):
@@ -59,6 +106,79 @@ class StimulusList:
         self.lists = [int(val) for val in self.lists]
 
 
+    def _get_paths(self, sync=False):
+        """ Get the audio files and sentence file paths. If the
+            local mirror is enabled, use local copies of the 
+            stimulus directories. SYNC (or no local copy yet)
+            first syncs them to the local disk.
+        """
+        self.audio_path = self.sessionpars['Audio Files Path'].get()
+        self.sentence_path = self.sessionpars['Sentence File Path'].get()
+        if not self.sessionpars['Local Mirror'].get():
+            self.mirror = None
+            return
+
+        if self.mirror is None:
+            self.mirror = m_mirror.CorpusMirror()
+        self.mirror_sources = []
+        if m_bundle.is_bundle(self.audio_path):
+            # Mirror just the bundle file
+            folder, name = os.path.split(self.audio_path)
+            self.mirror_sources.append((folder, name, ()))
+        else:
+            # Older metadata sidecars are not copied
+            self.mirror_sources.append((self.audio_path, m_reader.patterns(), 
+                (m_meta.AudioMetadata.filename,)))
+        self.mirror_sources.append((self.sentence_path, '*.csv', ()))
+
+        local = []
+        for folder, pattern, exclude in self.mirror_sources:
+            path = None if sync else self.mirror.local(folder, pattern)
+            if path is None:
+                print(f"Models_listmodel_86: Syncing local mirror of " +
+                    f"{folder}...")
+                try:
+                    path = self.mirror.sync(folder, pattern, exclude)
+                except FileNotFoundError:
+                    # Never synced and not reachable
+                    path = folder
+            local.append(path)
+        if m_bundle.is_bundle(self.audio_path):
+            local[0] = os.path.join(local[0], name)
+        self.audio_path, self.sentence_path = local
+
+
+    def mirror_status(self, scan=False):
+        """ Readout of how stale the local mirror is (None if
+            the mirror is not used). SCAN checks the source
+            directories for changes (slow on a network share).
+        """
+        if getattr(self, 'mirror', None) is None:
+            return None
+        return "; ".join(self.mirror.describe(
+            self.mirror.status(folder, pattern, exclude, scan)) 
+            for folder, pattern, exclude in self.mirror_sources)
+
+
+    def _get_bundle(self):
+        """ Open the corpus bundle, if the audio files path is
+            a bundle file
+        """
+        self.bundle = None
+        path = self.audio_path
+        if not m_bundle.is_bundle(path):
+            return
+        try:
+            self.bundle = m_bundle.open_bundle(path)
+        except ValueError as e:
+            messagebox.showerror(
+                title='Invalid Corpus Bundle',
+                message="Cannot open the corpus bundle!",
+                detail=str(e)
+            )
+            raise FileNotFoundError from e
+
+
     #############
     # Sentences #
     #############
@@ -66,9 +186,15 @@ class StimulusList:
         """ Open sentences file and load contents into dataframe. 
             Subset by specified list number(s) from session info.
         """
+        if self.bundle is not None:
+            s = self.bundle.sentences
+            self.sentence_df = s.loc[s['list_num'].isin(self.lists)].reset_index()
+            print("Models_listmodel_83: Sentences loaded from corpus bundle")
+            return
+
         # Check whether sentence directory exists
         print("Models_listmodel_66: Checking for sentences dir...")
-        if not os.path.exists(self.sessionpars['Sentence File Path'].get()):
+        if not os.path.exists(self.sentence_path):
             print("Models_listmodel_68: Not a valid 'sentences' file directory!")
             #messagebox.showerror(
             #    title='Directory Not Found!',
@@ -77,21 +203,45 @@ class StimulusList:
             #)
             raise FileNotFoundError
 
-        # If a valid directory has been given, 
-        # get a list of sentence files
-        glob_pattern = os.path.join(self.sessionpars['Sentence File Path'].get(), '*.csv')
-        sentence_file = glob(glob_pattern)
-        # Check to make sure there's only one file in the directory
-        if len(sentence_file) > 1:
+        # If a valid directory has been given, get sentences
+        # for specified list numbers from all sentence files in
+        # the index (a sentence file is only read again if it 
+        # has changed). Older audio metadata sidecars are not
+        # sentence files.
+        try:
+            self.sentence_df, num_files, skipped = self.index.sentences(
+                self.sentence_path, self.lists, 
+                exclude=(m_meta.AudioMetadata.filename,))
+        except ValueError as e:
+            messagebox.showerror(
+                title="Invalid Sentence File",
+                message="Cannot read the sentence file(s)!",
+                detail=str(e)
+            )
+            raise FileNotFoundError from e
+        if skipped:
             messagebox.showwarning(
-                title="Too Many Files!",
-                message="Multiple sentence files found - taking the first one."
+                title="Skipped Sentence Files",
+                message="Some .csv files in the sentence directory are " +
+                "not sentence files and were skipped.",
+                detail="Sentence files need the columns: " +
+                    ", ".join(m_index.sentence_columns) + "\n\n" +
+                    "Skipped: " + ", ".join(skipped)
             )
-        # Read sentence file into dataframe
-        s = pd.read_csv(sentence_file[0])
-
-        # Get sentences for specified list numbers
-        self.sentence_df = s.loc[s['list_num'].isin(self.lists)].reset_index()
+        # Sentence numbers must be unique across the files
+        repeats = self.sentence_df.loc[self.sentence_df['sentence_num'
+            ].duplicated(), 'sentence_num'].unique()
+        if len(repeats):
+            messagebox.showwarning(
+                title="Repeated Sentence Numbers",
+                message=f"Sentence numbers are repeated across the " +
+                f"{num_files} sentence files. Only the first sentence " +
+                "with each number will be used.",
+                detail="Sentence number(s): " + 
+                    ", ".join(str(num) for num in repeats)
+            )
+            self.sentence_df = self.sentence_df.drop_duplicates(
+                'sentence_num').reset_index(drop=True)
         print(self.sentence_df)
         print("Models_listmodel_91: Sentence list dataframe loaded into listmodel")
 
@@ -103,9 +253,16 @@ class StimulusList:
         """ Load in files as full paths. Select files based 
             on sentences data frame.
         """
+        if self.bundle is not None:
+            # The bundle index lists every file: no need to search
+            self.audio_df = self.bundle.index[['path', 'file_num']
+                ].sort_values(by=['file_num'])
+            self._subset_audio_files()
+            return
+
         # Check whether audio directory exists
         print("Models_listmodel_102: Checking for audio files dir...")
-        if not os.path.exists(self.sessionpars['Audio Files Path'].get()):
+        if not os.path.exists(self.audio_path):
             print("Models_listmodel_104: Not a valid audio files directory!")
             messagebox.showerror(
                 title='Directory Not Found!',
@@ -113,19 +270,124 @@ class StimulusList:
                 "Please choose another file path."
             )
 
-        # If a valid directory has been given, 
-        # get the audio file paths and names
-        glob_pattern = os.path.join(self.sessionpars['Audio Files Path'].get(), '*.wav')
-        # Create audio paths dataframe
-        self.audio_df = pd.DataFrame(glob(glob_pattern), columns=['path'])
-        # Create new column based on file names (which are numbered)
-        self.audio_df['file_num'] = self.audio_df['path'].apply(lambda x: x.split(os.sep)[-1][:-4])
-        # Convert to integers
-        self.audio_df['file_num'] = self.audio_df['file_num'].astype(int)
-        # Sort ascending by new column of integers
-        self.audio_df = self.audio_df.sort_values(by=['file_num'])
+        # If a valid directory has been given, get the 
+        # (.wav, .flac, etc.) files numbered in the sentences
+        # data frame, sorted by number, from the index
+        self.audio_df = self.index.audio_files(self.audio_path,
+            self.sentence_df['sentence_num'])
+        print(self.audio_df)
+        print("Models_listmodel_126: Audio list dataframe loaded into listmodel")
+
+
+    def _get_plan(self):
+        """ Order the sentences by the session's presentation
+            plan. Join sentences and audio files on sentence 
+            number, and find the key words of each sentence.
+            Warn about sentences without an audio file (they
+            are left out).
+        """
+        try:
+            generator = self.plan_generator()
+        except ValueError as e:
+            messagebox.showerror(
+                title="Invalid Randomization",
+                message="Cannot make the presentation plan!",
+                detail=str(e)
+            )
+            raise FileNotFoundError from e
+        plan_num = self.sessionpars['Plan Number'].get()
+        condition = self.sessionpars['Condition'].get()
+        if generator.conditions and condition not in generator.conditions:
+            messagebox.showerror(
+                title="Invalid Randomization",
+                message=f"Condition '{condition}' is not one of the " +
+                "counterbalanced conditions!",
+                detail=", ".join(generator.conditions)
+            )
+            raise FileNotFoundError
+        # Lists in the order entered (without randomization),
+        # sentences in file order within each list
+        order = generator.order(plan_num, self.sentence_df, condition)
+        sentences = self.sentence_df.set_index('sentence_num').loc[order
+            ].reset_index()
+        if generator.randomized:
+            print(f"Models_listmodel_245: Plan {generator.plan_id(plan_num)}" +
+                f": sentences {order.tolist()}")
+
+        self.plan = m_plan.TrialPlan(sentences, self.audio_df,
+            self.sessionpars['Key Word Markup'].get(),
+            generator.plan_id(plan_num))
+        if self.plan.missing:
+            print(f"Models_listmodel_232: No audio file for sentence(s) " +
+                f"{list(self.plan.missing)}")
+            messagebox.showwarning(
+                title="Missing Audio Files",
+                message="Some sentences have no audio file and will be " +
+                "skipped.",
+                detail="Sentence number(s): " + 
+                    ", ".join(str(num) for num in self.plan.missing)
+            )
+
+
+    def plan_generator(self):
+        """ Presentation plan generator for the session's lists
+            and randomization settings
+        """
+        conditions = [name.strip() for name in self.sessionpars[
+            'Counterbalance Conditions'].get().split(',') if name.strip()]
+        return m_plan.PlanGenerator(self.lists, conditions,
+            shuffle=self.sessionpars['Shuffle Sentences'].get(),
+            latin=self.sessionpars['List Order'].get() == 'Latin Square',
+            seed=self.sessionpars['Randomization Seed'].get())
+
+
+    def generate_plans(self, plans):
+        """ Trials of PLANS (plan numbers, e.g., one per 
+            subject) for the loaded lists, in one data frame
+            (see planmodel.PlanGenerator.table)
+        """
+        return self.plan_generator().table(plans, self.sentence_df)
+
+
+    @property
+    def corpus_df(self):
+        """ Data frame of all audio files in the corpus (not
+            subset), e.g., for building babble
+        """
+        if self.bundle is not None:
+            return self.bundle.index[['path', 'file_num']
+                ].sort_values(by=['file_num'])
+        return self.index.audio_files(self.audio_path)
+
 
+    def _subset_audio_files(self):
+        """ Select files based on sentences data frame.
+        """
         # Subset based on sentence dataframe values
         self.audio_df = self.audio_df.loc[self.audio_df['file_num'].isin(self.sentence_df['sentence_num'])]
         print(self.audio_df)
         print("Models_listmodel_126: Audio list dataframe loaded into listmodel")
+
+
+    ##################
+    # Audio Metadata #
+    ##################
+    def _get_metadata(self):
+        """ Load per-file levels from the audio directory's 
+            metadata file. Measure any new or changed files.
+        """
+        print("Models_listmodel_138: Checking audio metadata...")
+        self.metadata = m_meta.AudioMetadata(
+            self.audio_path)
+        self.metadata.update(self.audio_df['path'])
+
+
+    ##########
+    # Babble #
+    ##########
+    def babble(self, talkers, seed=1, dur=60.0):
+        """ Return the path to a cached TALKERS-talker babble
+            file built from every file in the audio directory
+        """
+        return m_babble.BabbleGenerator(
+            self.corpus_df['path'], self.metadata).get(talkers, seed, dur)
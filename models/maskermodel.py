@@ -0,0 +1,161 @@
+""" Continuous masker for speech-in-noise conditions.
+
+    A long masker (e.g., a noise file) is looped through a
+    fixed-size ring buffer by a background thread, and mixed
+    into the output stream by the audio engine callback. Memory
+    use is constant, no matter how long the session runs.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import threading
+
+# Import data science packages
+import numpy as np
+
+# Import custom modules
+from models import audiomodel as a
+
+
+#########
+# BEGIN #
+#########
+class MaskerStream:
+    """ Loop a masker through a ring buffer.
+
+        source: path to an audio file (streamed: read and 
+            converted a block at a time), or an Audio object
+        ring_dur: ring buffer length (s)
+        target_fs: sample rate to present a file SOURCE at (it
+            is resampled block by block by the fill thread)
+    """
+    def __init__(self, source, ring_dur=2.0, target_fs=None):
+        if isinstance(source, str):
+            source = a.Audio(source, 0, stream=True, target_fs=target_fs)
+        self.audio = source
+        self.fs = self.audio.fs
+        self.channels = self.audio.channels
+        if self.audio.frames == 0:
+            raise ValueError("Masker file is empty")
+
+        # Source blocks (frames x channels), looped. Blocks of
+        # native data types are views, never copies; others 
+        # are converted one block at a time.
+        self._blocks = self._loop()
+        self._leftover = None
+        # Channel levels (dB), measured once: level changes are
+        # then only a gain matrix update
+        self.rmsdb = self.audio.channel_levels()
+
+        # Ring buffer holds source samples; gain (with any
+        # int-to-float scaling) is applied when mixing
+        self._ring = np.zeros((int(ring_dur * self.fs), self.channels),
+            dtype=self.audio.block_dtype)
+        self._read = 0 # total frames mixed
+        self._write = 0 # total frames written to the ring
+
+        # Channels x outputs gain matrix (None: silent)
+        self.gain = None
+        self._mix = np.zeros((0, 0), dtype=np.float32)
+        # Callbacks that found the ring empty
+        self.underruns = 0
+
+        self._space = threading.Event()
+        self._running = True
+        self._fill()
+        self._worker = threading.Thread(target=self._fill_worker,
+            daemon=True)
+        self._worker.start()
+
+
+    def gain_matrix(self, level, speakers, eq='y'):
+        """ Gain matrix to present the masker at LEVEL (dB FS)
+            from SPEAKERS. See Audio.gain_matrix.
+        """
+        return self.audio.gain_matrix(level, speakers, eq, self.rmsdb)
+
+
+    def mix_into(self, outdata):
+        """ Add the next block of masker to OUTDATA. Called from
+            the audio callback.
+        """
+        gain = self.gain
+        frames = len(outdata)
+        if gain is None:
+            # Keep the masker running while silent
+            self._advance(frames)
+            return
+
+        if (self._mix.shape[0] < frames or
+            self._mix.shape[1] != gain.shape[1]):
+            self._mix = np.empty((frames, gain.shape[1]), np.float32)
+
+        size = len(self._ring)
+        n = min(frames, self._write - self._read)
+        if n < frames:
+            self.underruns += 1
+
+        # Mix the (at most two) contiguous ring segments
+        done = 0
+        while done < n:
+            start = (self._read + done) % size
+            count = min(n - done, size - start)
+            mix = self._mix[:count]
+            np.matmul(self._ring[start:start + count], gain, out=mix)
+            outdata[done:done + count] += mix
+            done += count
+        self._advance(n)
+
+
+    def stop(self):
+        """ Stop the fill thread
+        """
+        self._running = False
+        self._space.set()
+
+
+    #####################
+    # Private functions #
+    #####################
+    def _advance(self, frames):
+        """ Mark frames as read and wake the fill thread
+        """
+        self._read += min(frames, self._write - self._read)
+        self._space.set()
+
+
+    def _loop(self):
+        """ Yield the masker in blocks, over and over
+        """
+        while True:
+            yield from self.audio.blocks()
+
+
+    def _fill(self):
+        """ Copy source blocks (looping) into free ring space
+        """
+        size = len(self._ring)
+        free = size - (self._write - self._read)
+        while free > 0:
+            if self._leftover is None:
+                self._leftover = next(self._blocks)
+            block = self._leftover
+            start = self._write % size
+            count = min(free, size - start, len(block))
+            self._ring[start:start + count] = block[:count]
+            self._leftover = block[count:] if count < len(block) else None
+            self._write += count
+            free -= count
+
+
+    def _fill_worker(self):
+        """ Refill the ring whenever the callback has used some
+            of it
+        """
+        while self._running:
+            self._space.wait()
+            self._space.clear()
+            if self._running:
+                self._fill()
@@ -0,0 +1,185 @@
+""" Automated calibration measurements.
+
+    Records the calibration stimulus from a measurement input
+    (a microphone on a sound card input) and computes its
+    overall and octave-band levels from averaged FFT spectra.
+    A measurement input can also be an audio file: a
+    file-backed stand-in for the input device, so that the
+    analysis can be checked without hardware.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Import system packages
+import os
+import threading
+
+# Import audio packages
+import sounddevice as sd
+from scipy import signal
+
+# Import custom modules
+from models import readermodel as m_reader
+from models.cachemodel import full_scale
+
+
+#########
+# BEGIN #
+#########
+# Octave band center frequencies (Hz)
+octave_bands = (125, 250, 500, 1000, 2000, 4000, 8000)
+
+
+def band_levels(recording, fs, bands=octave_bands, nfft=8192):
+    """ Overall and band levels (dB re: full scale RMS) of a
+        mono RECORDING, from the average power spectrum of
+        50%-overlapping Hann-windowed frames. Bands are one
+        octave wide around the given center frequencies; bands
+        above the Nyquist frequency are -inf.
+
+        Returns (overall, band levels array).
+    """
+    x = np.asarray(recording, dtype=np.float64)
+    if len(x) < nfft:
+        x = np.pad(x, (0, nfft - len(x)))
+
+    # All frames at once: frames x nfft view of the recording
+    frames = sliding_window_view(x, nfft)[::nfft // 2]
+    window = signal.get_window('hann', nfft)
+    spectra = np.fft.rfft(frames * window, axis=1)
+    power = np.mean(spectra.real ** 2 + spectra.imag ** 2, axis=0)
+
+    # One-sided power per bin, scaled so that the bins add up
+    # to the mean square of the recording
+    power[1:-1] *= 2
+    power /= nfft * np.sum(window ** 2)
+
+    # Sum the bins in each band with one matrix product
+    freqs = np.fft.rfftfreq(nfft, 1 / fs)
+    centers = np.asarray(bands, dtype=np.float64)[:, np.newaxis]
+    in_band = ((freqs >= centers / np.sqrt(2)) &
+        (freqs < centers * np.sqrt(2)))
+    with np.errstate(divide='ignore'):
+        return (10 * np.log10(np.sum(power)),
+            10 * np.log10(in_band.astype(np.float64) @ power))
+
+
+class DeviceInput:
+    """ Measurement microphone on a sound card input.
+
+        device_id: input device ID
+        channel: input channel (1 = first)
+    """
+    def __init__(self, device_id, channel=1):
+        self.device_id = device_id
+        self.channel = channel
+        try:
+            self.fs = int(sd.query_devices(device_id, 'input')
+                ['default_samplerate'])
+        except (sd.PortAudioError, ValueError) as e:
+            raise ValueError(
+                f"Cannot open measurement input {device_id}: {e}") from e
+
+
+    def record(self, frames):
+        """ Record FRAMES samples from the input channel
+        """
+        try:
+            recording = sd.rec(frames, samplerate=self.fs,
+                channels=self.channel, device=self.device_id,
+                dtype='float32')
+            sd.wait()
+        except sd.PortAudioError as e:
+            raise ValueError(f"Recording failed: {e}") from e
+        return recording[:, self.channel - 1]
+
+
+class FileInput:
+    """ File-backed stand-in for a measurement input. Returns
+        the file's audio (looped as needed) instead of
+        recording.
+
+        file_path: audio file
+        channel: file channel to use (1 = first)
+    """
+    def __init__(self, file_path, channel=1):
+        self.fs, audio = m_reader.read(file_path)
+        audio = audio.reshape(len(audio), -1)
+        if not 1 <= channel <= audio.shape[1]:
+            raise ValueError(f"{os.path.basename(file_path)} has no " +
+                f"channel {channel}")
+        self.audio = audio[:, channel - 1].astype(np.float64)
+        if str(audio.dtype) in full_scale:
+            self.audio /= full_scale[str(audio.dtype)]
+
+
+    def record(self, frames):
+        """ Return the next FRAMES samples of the file
+        """
+        return np.resize(self.audio, frames)
+
+
+def open_input(source, channel=1):
+    """ Measurement input for SOURCE: an input device ID, or
+        the path of an audio file
+    """
+    source = str(source).strip()
+    if source.lower().endswith(m_reader.extensions()):
+        if not os.path.isfile(source):
+            raise ValueError(f"Measurement file not found: {source}")
+        return FileInput(source, channel)
+    try:
+        device_id = int(source)
+    except ValueError:
+        raise ValueError("Measurement input must be an input device " +
+            f"ID or an audio file: {source!r}") from None
+    return DeviceInput(device_id, channel)
+
+
+class Measurement:
+    """ Record from a measurement input on a worker thread and
+        compute the levels. Poll done; then read result (or
+        error).
+
+        inp: DeviceInput or FileInput
+        reference: level (dB SPL) of a full scale RMS signal
+            at the input
+    """
+    # Seconds to let the stimulus settle, and to analyze
+    settle = 0.5
+    duration = 4.0
+
+    def __init__(self, inp, reference):
+        self.inp = inp
+        self.reference = reference
+        self.result = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    @property
+    def done(self):
+        return not self._thread.is_alive()
+
+
+    def _run(self):
+        """ Record, discard the settling time and analyze
+        """
+        fs = self.inp.fs
+        skip = int(self.settle * fs)
+        try:
+            recording = self.inp.record(skip + int(self.duration * fs))
+        except ValueError as e:
+            self.error = e
+            return
+        overall, bands = band_levels(recording[skip:], fs)
+        self.result = {
+            'overall': overall + self.reference,
+            'bands': dict(zip(octave_bands, bands + self.reference))
+        }
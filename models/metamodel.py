@@ -0,0 +1,217 @@
+""" Model for per-file audio metadata (levels, peak, duration,
+    sample rate, data type and speech onset/offset).
+
+    Levels never change for a corpus file, so they are computed
+    once and stored in a .csv file per audio directory, in the
+    user's home directory (audio directories may be read-only
+    or network shares). Entries are recomputed only when a 
+    file's size or modification time changes.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import system packages
+import hashlib
+import os
+from pathlib import Path
+
+# Import custom modules
+from models import audiomodel as a
+from models import bundlemodel as m_bundle
+
+
+#########
+# BEGIN #
+#########
+class AudioMetadata:
+    """ Per-file metadata index for an audio directory.
+
+        store: directory of the metadata files
+    """
+    # Store metadata files in user's home directory
+    store = Path.home() / 'stc_metadata'
+
+    # Sidecar file name in the audio directory (older versions).
+    # Read if the store has no metadata for the directory yet.
+    filename = 'stc_metadata.csv'
+
+    columns = ['name', 'size', 'mtime', 'fs', 'dtype', 'channels',
+        'frames', 'dur', 'rms_db', 'peak_db', 'onset', 'offset']
+
+    # Speech detection settings
+    frame_dur = 0.010 # short-time energy frame (s)
+    threshold_db = -40 # speech threshold, relative to loudest frame
+    floor_db = -70 # frames below this are always silence (dB FS)
+    pad_dur = 0.020 # silence kept before onset and after offset (s)
+
+    def __init__(self, audio_dir, store=None):
+        self.audio_dir = audio_dir
+        if store is not None:
+            self.store = Path(store)
+        # Corpus bundles carry their own (read-only) metadata
+        self.bundle = m_bundle.open_bundle(audio_dir) \
+            if m_bundle.is_bundle(audio_dir) else None
+        # One file per directory, keyed by its absolute path
+        key = hashlib.sha1(os.path.abspath(audio_dir).encode()
+            ).hexdigest()[:16]
+        self.filepath = self.store / f"{key}.csv"
+        self.sidecar = os.path.join(audio_dir, self.filename)
+
+        # Per-channel levels as arrays, by file name
+        self._levels = dict()
+
+        self.load()
+
+
+    def load(self):
+        """ Read the metadata file (or bundle index, or an
+            older sidecar file), if there is one
+        """
+        path = next((path for path in (self.filepath, self.sidecar)
+            if os.path.exists(path)), None)
+        if self.bundle is not None:
+            self.df = self.bundle.index[self.columns[1:]].copy()
+        elif path is not None:
+            print("Models_Meta_51: Reading audio metadata file...")
+            self.df = pd.read_csv(path, index_col='name',
+                dtype={'dtype': str, 'rms_db': str, 'peak_db': str})
+            # Files in older metadata files are measured again
+            for col in self.columns[1:]:
+                if col not in self.df:
+                    self.df[col] = np.nan
+        else:
+            self.df = pd.DataFrame(columns=self.columns).set_index('name')
+        self._levels.clear()
+
+
+    def save(self):
+        """ Write the metadata file. The index still works from
+            memory if it cannot be written.
+        """
+        if self.bundle is not None:
+            return
+        try:
+            self.store.mkdir(parents=True, exist_ok=True)
+            self.df.to_csv(self.filepath)
+        except OSError as e:
+            print(f"Models_Meta_66: Could not save audio metadata: {e}")
+
+
+    def update(self, paths):
+        """ Compute metadata for new or changed files
+        """
+        changed = False
+        for path in paths:
+            name = os.path.basename(path)
+            stat = m_bundle.stat(path)
+            if name in self.df.index:
+                row = self.df.loc[name]
+                if (row['size'] == stat.st_size and
+                    row['mtime'] == stat.st_mtime_ns and
+                    not pd.isna(row['onset'])):
+                    continue
+            self.df.loc[name] = self._measure(path, stat)
+            self._levels.pop(name, None)
+            changed = True
+
+        if changed:
+            print("Models_Meta_86: Audio metadata updated")
+            self.save()
+
+
+    def levels(self, path):
+        """ Return (rms_db, peak_db) arrays, one value per
+            channel, for a file.
+        """
+        name = os.path.basename(path)
+        if name not in self._levels:
+            row = self.df.loc[name]
+            self._levels[name] = (
+                np.array(row['rms_db'].split(), dtype=np.float64),
+                np.array(row['peak_db'].split(), dtype=np.float64)
+            )
+        return self._levels[name]
+
+
+    def speech_bounds(self, path, fs=None):
+        """ Return the (onset, offset) sample indices of the
+            speech in a file. If FS is given, the indices are
+            for the file resampled to FS.
+        """
+        row = self.df.loc[os.path.basename(path)]
+        ratio = 1 if fs is None else fs / row['fs']
+        return int(row['onset'] * ratio), int(row['offset'] * ratio)
+
+
+    def headroom(self, path, level, eq='y'):
+        """ Return the peak level (dB FS) a file will reach
+            when presented at LEVEL. Values above 0 clip.
+        """
+        rmsdb, peakdb = self.levels(path)
+        diffdb = a.Audio.level_differences(rmsdb, level, eq)
+        with np.errstate(invalid='ignore'):
+            return np.nanmax(peakdb + diffdb)
+
+
+    def would_clip(self, path, level, eq='y'):
+        """ True if a file presented at LEVEL would clip
+        """
+        return self.headroom(path, level, eq) > 0
+
+
+    @classmethod
+    def speech_onset_offset(cls, audio):
+        """ Find the first and last sample of speech from the
+            short-time energy of all channels. Returns sample 
+            indices (with padding) suitable for slicing.
+        """
+        sig = audio.working_audio.reshape(len(audio.working_audio), -1)
+        frame = max(int(cls.frame_dur * audio.fs), 1)
+        nframes = len(sig) // frame
+        if nframes == 0:
+            return 0, len(sig)
+
+        # Energy of each frame (dB FS), all frames at once
+        frames = sig[:nframes * frame].reshape(nframes, -1)
+        energy = np.mean(np.square(frames.astype(np.float32)), axis=1)
+        with np.errstate(divide='ignore'):
+            energy_db = 10 * np.log10(energy * audio.scale() ** 2)
+
+        threshold = max(energy_db.max() + cls.threshold_db, cls.floor_db)
+        speech = np.flatnonzero(energy_db > threshold)
+        if len(speech) == 0:
+            return 0, len(sig)
+
+        pad = int(cls.pad_dur * audio.fs)
+        onset = max(speech[0] * frame - pad, 0)
+        offset = min((speech[-1] + 1) * frame + pad, len(sig))
+        return onset, offset
+
+
+    #####################
+    # Private functions #
+    #####################
+    @classmethod
+    def _measure(cls, path, stat):
+        """ Compute the metadata row for one file
+        """
+        audio = a.Audio(path, 0)
+        onset, offset = cls.speech_onset_offset(audio)
+        return {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'fs': audio.fs,
+            'dtype': str(audio.data_type),
+            'channels': audio.channels,
+            'frames': len(audio.original_audio),
+            'dur': audio.dur,
+            'rms_db': ' '.join(f"{x:.4f}" for x in audio.channel_levels()),
+            'peak_db': ' '.join(f"{x:.4f}" for x in audio.channel_peaks()),
+            'onset': onset,
+            'offset': offset
+        }
@@ -0,0 +1,247 @@
+""" Local mirror of stimulus directories on network shares.
+
+    Files are copied once into a content-addressed local store
+    (named by their SHA-1 hash, so identical files are stored
+    once) and linked into a local copy of each directory. Only
+    files whose size or modification time changed are copied
+    again, and all reads are served from the local disk. If the
+    share can't be reached, the last synced copy is used.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import hashlib
+import json
+import os
+import shutil
+import time
+from fnmatch import fnmatch
+from pathlib import Path
+
+
+#########
+# BEGIN #
+#########
+class CorpusMirror:
+    """ Content-addressed local copies of directories.
+
+        root: local directory for the store
+    """
+    # Store mirror in user's home directory
+    root = Path.home() / 'stc_mirror'
+
+    # Bytes per read when copying and hashing
+    chunk_size = 1024 * 1024
+
+    def __init__(self, root=None):
+        if root is not None:
+            self.root = Path(root)
+        self.objects = self.root / 'objects'
+        self.views = self.root / 'views'
+        self.manifests = self.root / 'manifests'
+
+        # Sources that couldn't be read at the last sync
+        self.offline = set()
+
+
+    def sync(self, src_dir, pattern='*', exclude=()):
+        """ Bring the local copy of SRC_DIR (files matching
+            PATTERN, or any of a tuple of patterns) up to date,
+            and return its path. Files in
+            EXCLUDE are skipped. Uses the last synced copy if
+            SRC_DIR can't be read.
+        """
+        key = self._key(src_dir, pattern)
+        view = self.views / key
+        manifest = self._load_manifest(key)
+        try:
+            entries = self._scan(src_dir, pattern, exclude)
+        except OSError as e:
+            if not manifest['files']:
+                raise FileNotFoundError(src_dir) from e
+            print(f"Models_Mirror_63: Cannot read {src_dir} ({e}): " +
+                "using local copy")
+            self.offline.add(key)
+            return str(view)
+        self.offline.discard(key)
+
+        view.mkdir(parents=True, exist_ok=True)
+        files = manifest['files']
+        copied = 0
+        for name, stat in entries.items():
+            old = files.get(name)
+            if (old is not None and old[0] == stat.st_size and
+                old[1] == stat.st_mtime_ns and (view / name).exists()):
+                continue
+            digest = self._store(os.path.join(src_dir, name))
+            self._link(digest, view / name)
+            files[name] = [stat.st_size, stat.st_mtime_ns, digest]
+            copied += 1
+
+        # Remove files that were deleted from the source
+        for name in set(files) - set(entries):
+            (view / name).unlink(missing_ok=True)
+            del files[name]
+
+        manifest['source'] = os.path.abspath(src_dir)
+        manifest['last_sync'] = time.time()
+        self._save_manifest(key, manifest)
+        print(f"Models_Mirror_90: Synced {src_dir}: {copied} of " +
+            f"{len(entries)} files copied")
+        return str(view)
+
+
+    def local(self, src_dir, pattern='*'):
+        """ Path of the last synced copy of SRC_DIR, without 
+            reading SRC_DIR (None if it was never synced)
+        """
+        key = self._key(src_dir, pattern)
+        if not self._load_manifest(key)['files']:
+            return None
+        return str(self.views / key)
+
+
+    def status(self, src_dir, pattern='*', exclude=(), scan=True):
+        """ Return a dictionary describing how stale the local
+            copy of SRC_DIR is: the time of the last sync, its
+            age (s), whether the source was offline, and the 
+            number of files changed, added or removed on the 
+            source since then. The file counts are None unless
+            SCAN is True and the source can be read.
+        """
+        key = self._key(src_dir, pattern)
+        manifest = self._load_manifest(key)
+        last_sync = manifest.get('last_sync')
+        status = {
+            'last_sync': last_sync,
+            'age': None if last_sync is None else time.time() - last_sync,
+            'offline': key in self.offline,
+            'changed': None,
+            'added': None,
+            'removed': None
+        }
+        if not scan:
+            return status
+        try:
+            entries = self._scan(src_dir, pattern, exclude)
+        except OSError:
+            status['offline'] = True
+            return status
+
+        files = manifest['files']
+        status['changed'] = sum(1 for name, stat in entries.items()
+            if name in files and (files[name][0], files[name][1]) !=
+            (stat.st_size, stat.st_mtime_ns))
+        status['added'] = len(set(entries) - set(files))
+        status['removed'] = len(set(files) - set(entries))
+        return status
+
+
+    @staticmethod
+    def describe(status):
+        """ Short readout of a status dictionary
+        """
+        if status['last_sync'] is None:
+            return "not synced"
+        age = status['age']
+        if age < 60:
+            text = "synced just now"
+        elif age < 3600:
+            text = f"synced {age // 60:.0f} min ago"
+        elif age < 86400:
+            text = f"synced {age // 3600:.0f} h ago"
+        else:
+            text = f"synced {age // 86400:.0f} days ago"
+        if status['offline']:
+            return text + " (offline)"
+        if status['changed'] is None:
+            return text
+        stale = status['changed'] + status['added'] + status['removed']
+        if stale:
+            text += f", {stale} files out of date"
+        return text
+
+
+    #####################
+    # Private functions #
+    #####################
+    @staticmethod
+    def _key(src_dir, pattern):
+        """ Local name for a source directory and file pattern
+        """
+        return hashlib.sha1(f"{os.path.abspath(src_dir)}|{pattern}".encode()
+            ).hexdigest()[:16]
+
+
+    @staticmethod
+    def _scan(src_dir, pattern, exclude):
+        """ Return the stat results of matching files in 
+            SRC_DIR, by name
+        """
+        patterns = (pattern,) if isinstance(pattern, str) else pattern
+        return {e.name: e.stat() for e in os.scandir(src_dir)
+            if e.is_file() and e.name not in exclude and
+            any(fnmatch(e.name, p) for p in patterns)}
+
+
+    def _load_manifest(self, key):
+        """ Return the manifest of a synced directory (files:
+            name -> [size, mtime_ns, sha1])
+        """
+        path = self.manifests / f"{key}.json"
+        if path.exists():
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        return {'files': dict()}
+
+
+    def _save_manifest(self, key, manifest):
+        """ Write a manifest, replacing the old one in one step
+        """
+        self.manifests.mkdir(parents=True, exist_ok=True)
+        path = self.manifests / f"{key}.json"
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, path)
+
+
+    def _store(self, path):
+        """ Copy a file into the store (hashing it as it is
+            copied) and return its hash. Files already in the
+            store are not kept twice.
+        """
+        self.objects.mkdir(parents=True, exist_ok=True)
+        tmp = self.objects / f"incoming_{os.getpid()}.tmp"
+        h = hashlib.sha1()
+        with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+            while True:
+                chunk = src.read(self.chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+                dst.write(chunk)
+        digest = h.hexdigest()
+        obj = self.objects / digest[:2] / digest
+        if obj.exists():
+            tmp.unlink()
+        else:
+            obj.parent.mkdir(exist_ok=True)
+            os.replace(tmp, obj)
+        return digest
+
+
+    def _link(self, digest, dest):
+        """ Place a stored file at DEST: a hard link where the
+            file system allows it, otherwise a copy
+        """
+        obj = self.objects / digest[:2] / digest
+        tmp = dest.with_name(dest.name + '.tmp')
+        tmp.unlink(missing_ok=True)
+        try:
+            os.link(obj, tmp)
+        except OSError:
+            shutil.copyfile(obj, tmp)
+        os.replace(tmp, dest)
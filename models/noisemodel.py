@@ -0,0 +1,129 @@
+""" Generated calibration noise.
+
+    White, pink or speech-shaped noise is generated block by
+    block in the audio engine callback, so it plays for as long
+    as needed, at a level that can be changed while it plays,
+    using constant memory.
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import audio packages
+from scipy import signal
+
+
+#########
+# BEGIN #
+#########
+class NoiseGenerator:
+    """ Endless noise source for the audio engine.
+
+        kind: 'white', 'pink' or 'speech' (speech-shaped)
+        fs: sample rate (Hz)
+        seed: random seed (None: different noise each time)
+    """
+    kinds = ('white', 'pink', 'speech')
+
+    def __init__(self, kind='white', fs=48000, seed=None):
+        if kind not in self.kinds:
+            raise ValueError(f"Unknown noise type: {kind}")
+        self.kind = kind
+        self.fs = fs
+        self.channels = 1
+        self._rng = np.random.default_rng(seed)
+
+        # Shaping filter (None for white noise), with its state
+        # carried from block to block
+        self._sos = self._shaping_filter(kind, fs)
+        if self._sos is not None:
+            self._zi = np.zeros((self._sos.shape[0], 2))
+        # Scale filtered noise back to an RMS of 1
+        self._norm = self._filter_rms()
+
+        # 1 x outputs gain matrix (None: silent)
+        self.gain = None
+        # Reused buffers
+        self._white = np.zeros(0)
+        self._mix = np.zeros((0, 0), dtype=np.float32)
+
+
+    def gain_matrix(self, level, speakers, eq='y'):
+        """ Gain matrix to present the noise at LEVEL (dB FS
+            RMS) from each of SPEAKERS. EQ is not used (the
+            noise has one channel).
+        """
+        speakers = np.atleast_1d(speakers).astype(int)
+        matrix = np.zeros((1, speakers.max()), dtype=np.float32)
+        matrix[0, speakers - 1] = 10 ** (level / 20) * self._norm
+        return matrix
+
+
+    def mix_into(self, outdata):
+        """ Add the next block of noise to OUTDATA. Called from
+            the audio callback.
+        """
+        gain = self.gain
+        if gain is None:
+            return
+        frames = len(outdata)
+        if len(self._white) < frames:
+            self._white = np.empty(frames)
+        if (self._mix.shape[0] < frames or
+            self._mix.shape[1] != gain.shape[1]):
+            self._mix = np.empty((frames, gain.shape[1]), np.float32)
+
+        noise = self._white[:frames]
+        self._rng.standard_normal(out=noise)
+        if self._sos is not None:
+            noise, self._zi = signal.sosfilt(self._sos, noise, zi=self._zi)
+        mix = self._mix[:frames]
+        np.multiply(noise[:, np.newaxis], gain, out=mix, casting='unsafe')
+        outdata += mix
+
+
+    def stop(self):
+        """ Nothing to stop: noise is generated in the callback
+        """
+        pass
+
+
+    #####################
+    # Private functions #
+    #####################
+    @staticmethod
+    def _shaping_filter(kind, fs):
+        """ Second-order sections that shape white noise
+        """
+        if kind == 'pink':
+            # -3 dB/octave (P. Kellet's "economy" pink noise filter)
+            b = [0.049922035, -0.095993537, 0.050612699, -0.004408786]
+            a = [1, -2.494956002, 2.017265875, -0.522189400]
+            return signal.tf2sos(b, a)
+        if kind == 'speech':
+            # Approximate long-term average speech spectrum:
+            # flat from 100 to 500 Hz, then falling about 6
+            # dB/octave, and 12 dB/octave above 4 kHz
+            nyq = fs / 2
+            return np.vstack([
+                signal.butter(2, 100, 'highpass', fs=fs, output='sos'),
+                signal.butter(1, 500, 'lowpass', fs=fs, output='sos'),
+                signal.butter(1, min(4000, 0.9 * nyq), 'lowpass', fs=fs,
+                    output='sos')
+            ])
+        return None
+
+
+    def _filter_rms(self):
+        """ Gain that gives the shaped noise an RMS of 1, from
+            the energy of the filter's impulse response
+        """
+        if self._sos is None:
+            return 1.0
+        impulse = np.zeros(int(4 * self.fs))
+        impulse[0] = 1
+        h = signal.sosfilt(self._sos, impulse)
+        return 1 / np.sqrt(np.sum(h ** 2))
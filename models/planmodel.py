@@ -0,0 +1,366 @@
+""" Trial plan for a session.
+
+    Joins the sentences and audio files of the selected lists
+    on sentence number, once, when the lists are loaded. Each
+    trial holds everything needed to present and score it, so
+    the main view never has to touch a data frame during the
+    task, and a sentence can never be paired with the wrong
+    audio file. Sentences are split into words, and their key
+    words found, when the plan is built.
+
+    PlanGenerator makes seeded presentation orders: sentences
+    shuffled within each list, lists ordered by a balanced Latin
+    square across subjects, and lists counterbalanced across
+    conditions. Plans for any number of subjects are made in one
+    call. Write plans to a .csv file from the command line:
+        python -m models.planmodel SENTENCE_FILE OUT.csv --plans 1000
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import system packages
+import argparse
+import re
+
+# Import custom modules
+from models import indexmodel as m_index
+
+
+#########
+# BEGIN #
+#########
+# Key word markup styles. Pattern matching a marked key word
+# (the word, then any punctuation after the closing mark).
+# Capitals: every word in capitals except 'A'.
+markups = {
+    'Capitals': None,
+    'Asterisks': re.compile(r'^\*(.+)\*(\W*)$'),
+    'Brackets': re.compile(r'^\[(.+)\](\W*)$'),
+    'Underscores': re.compile(r'^_(.+)_(\W*)$')
+}
+
+
+def tokenize(sentence, markup='Capitals'):
+    """ Split SENTENCE into the words to display (marks and
+        final period removed) and a mask of the key words
+        marked in the MARKUP style
+    """
+    pattern = markups[markup]
+    words = sentence.split()
+    mask = []
+    for idx, word in enumerate(words):
+        if pattern is None:
+            mask.append(word.isupper() and word != 'A')
+            continue
+        match = pattern.match(word)
+        mask.append(match is not None)
+        if match is not None:
+            words[idx] = match.group(1) + match.group(2)
+    # Remove period from last word
+    if words and words[-1][-1] == '.':
+        words[-1] = words[-1][:-1]
+    return words, mask
+
+
+def _frozen(values, dtype):
+    """ Read-only array
+    """
+    arr = np.array(values, dtype=dtype)
+    arr.flags.writeable = False
+    return arr
+
+
+class Trial:
+    """ One trial of the plan (read-only).
+
+        sentence_num: sentence (and audio file) number
+        list_num: list the sentence belongs to
+        sentence: sentence text
+        words: array of words to display
+        mask: boolean array, True for key words
+        keywords: array of the indexes of the key words
+        path: audio file path
+        markup: key word markup style (see markups)
+    """
+    __slots__ = ('sentence_num', 'list_num', 'sentence', 'words',
+        'mask', 'keywords', 'path')
+
+    def __init__(self, sentence_num, list_num, sentence, path,
+        markup='Capitals'):
+        words, mask = tokenize(sentence, markup)
+        mask = _frozen(mask, bool)
+        for name, value in zip(self.__slots__, (sentence_num, list_num,
+            sentence, _frozen(words, object), mask,
+            _frozen(np.flatnonzero(mask), np.intp), path)):
+            object.__setattr__(self, name, value)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Trial is read-only")
+
+
+    def __repr__(self):
+        return f"Trial({self.sentence_num}, {self.path!r})"
+
+
+class TrialPlan:
+    """ Ordered, read-only sequence of trials, with lookup by
+        sentence number.
+
+        markup: key word markup style (see markups)
+        plan_id: ID of the presentation plan (see PlanGenerator)
+        missing: sentence numbers without an audio file (left
+            out of the plan)
+    """
+    __slots__ = ('_trials', '_by_num', 'missing', 'plan_id')
+
+    def __init__(self, sentence_df, audio_df, markup='Capitals',
+        plan_id=None):
+        # Audio file path by number
+        paths = dict(zip(audio_df['file_num'].astype(int),
+            audio_df['path']))
+        trials = []
+        missing = []
+        for num, list_num, sentence in zip(
+            sentence_df['sentence_num'].astype(int),
+            sentence_df['list_num'].astype(int),
+            sentence_df['sentence']):
+            path = paths.get(num)
+            if path is None:
+                missing.append(num)
+            else:
+                trials.append(Trial(num, list_num, str(sentence), path,
+                    markup))
+        self._trials = tuple(trials)
+        self._by_num = {trial.sentence_num: trial for trial in trials}
+        self.missing = tuple(missing)
+        self.plan_id = plan_id
+
+
+    def __len__(self):
+        return len(self._trials)
+
+
+    def __getitem__(self, idx):
+        """ Trial at IDX (a tuple of trials for a slice)
+        """
+        return self._trials[idx]
+
+
+    def __iter__(self):
+        return iter(self._trials)
+
+
+    def lookup(self, sentence_num):
+        """ Trial for SENTENCE_NUM (None if not in the plan)
+        """
+        return self._by_num.get(sentence_num)
+
+
+    @property
+    def paths(self):
+        """ Audio file paths in trial order
+        """
+        return [trial.path for trial in self._trials]
+
+
+#################
+# Randomization #
+#################
+def _mix(x):
+    """ splitmix64 finalizer: spread the bits of uint64 values
+    """
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def sort_keys(seed, plans, items):
+    """ Random sort keys (plans x items). A key depends only on
+        the seed, plan number and item (e.g., sentence number),
+        so a plan is the same however many plans are made at
+        once.
+    """
+    with np.errstate(over='ignore'):
+        base = _mix(_mix(np.full(1, seed, np.uint64)) ^
+            np.asarray(plans, np.uint64)[:, None])
+        return _mix(base ^ np.asarray(items, np.uint64)[None, :])
+
+
+def latin_square(n):
+    """ Balanced Latin square (Williams design) for N
+        treatments: one order per row. Each treatment appears
+        once in each position, and follows every other
+        treatment equally often. Odd N needs 2N rows.
+    """
+    first = np.zeros(n, int)
+    idx = np.arange(1, n)
+    # 0, 1, n-1, 2, n-2, ...
+    first[1:] = np.where(idx % 2, (idx + 1) // 2, n - idx // 2)
+    square = (first[None, :] + np.arange(n)[:, None]) % n
+    if n % 2:
+        square = np.concatenate([square, square[:, ::-1]])
+    return square
+
+
+class PlanGenerator:
+    """ Seeded presentation plans, numbered from 1 (e.g., one 
+        per subject).
+
+        lists: list numbers used in the study
+        conditions: names of the conditions to counterbalance
+            the lists across. The lists are split into one 
+            block per condition, and the blocks rotate across
+            conditions from plan to plan. Empty for none.
+        shuffle: shuffle the sentences within each list
+        latin: order the lists by a balanced Latin square 
+            across plans (otherwise as given)
+        seed: randomization seed (0 to 2**64 - 1)
+    """
+    def __init__(self, lists, conditions=(), shuffle=False, latin=False,
+        seed=0):
+        self.lists = np.asarray(lists, int)
+        self.conditions = list(conditions)
+        self.shuffle = shuffle
+        self.latin = latin
+        self.seed = seed
+        if not 0 <= seed < 2 ** 64:
+            raise ValueError(f"Randomization seed must be from 0 to " +
+                f"{2 ** 64 - 1}, got {seed}")
+        blocks = max(len(self.conditions), 1)
+        if len(self.lists) % blocks:
+            raise ValueError(f"{len(self.lists)} lists cannot be split " +
+                f"evenly across {blocks} conditions")
+
+
+    @property
+    def randomized(self):
+        """ True if plans differ from the lists in file order
+        """
+        return self.shuffle or self.latin or bool(self.conditions)
+
+
+    def plan_id(self, plan):
+        """ ID of plan number PLAN (seed and plan number)
+        """
+        return f"{self.seed}-{plan}"
+
+
+    def assign(self, plans):
+        """ List numbers of PLANS (plan numbers) in presentation 
+            order: array (plans x conditions x lists per 
+            condition)
+        """
+        return self.lists[self._assign_idx(plans)]
+
+
+    def _assign_idx(self, plans):
+        """ As assign, but indexes into LISTS
+        """
+        rows = np.asarray(plans, int) - 1
+        n_blocks = max(len(self.conditions), 1)
+        blocks = np.arange(len(self.lists)).reshape(n_blocks, -1)
+        # Rotate the list blocks across conditions
+        block = (np.arange(n_blocks)[None, :] + rows[:, None]) % n_blocks
+        size = blocks.shape[1]
+        order = latin_square(size) if self.latin else \
+            np.arange(size)[None, :]
+        # Step through the list orders once every block rotation
+        # has been used, so that all combinations occur
+        within = order[(rows // n_blocks) % len(order)]
+        return blocks[block[:, :, None], within[:, None, :]]
+
+
+    def table(self, plans, sentences):
+        """ Trials of PLANS (plan numbers) in one data frame, in
+            presentation order: plan ID, seed, plan number, 
+            condition, trial number (within the condition), 
+            list number and sentence number. SENTENCES is a data
+            frame of the sentences of the lists (sentence_num 
+            and list_num columns).
+        """
+        plans = np.asarray(plans, int)
+        nums = sentences['sentence_num'].to_numpy(int)
+        list_nums = sentences['list_num'].to_numpy(int)
+        assigned = self._assign_idx(plans)
+        size = assigned.shape[2]
+
+        # Position of each list in each plan and condition
+        # (SIZE if not used; the last entry is for sentences
+        # not in LISTS)
+        positions = np.full(assigned.shape[:2] + (len(self.lists) + 1,),
+            size)
+        np.put_along_axis(positions, assigned, 
+            np.broadcast_to(np.arange(size), assigned.shape), axis=2)
+        match = list_nums[:, None] == self.lists[None, :]
+        sentence_list = np.where(match.any(axis=1), match.argmax(axis=1),
+            len(self.lists))
+        pos = positions[:, :, sentence_list]
+
+        # Sort by list position, then by random key (or file
+        # order)
+        if self.shuffle:
+            keys = sort_keys(self.seed, plans, nums)[:, None, :]
+        else:
+            keys = np.arange(len(nums))[None, None, :]
+        order = np.lexsort((np.broadcast_to(keys, pos.shape), pos), 
+            axis=-1)
+        used = np.take_along_axis(pos, order, axis=-1) < size
+        trial = np.cumsum(used, axis=-1)[used]
+        plan_idx, cond_idx, _ = np.nonzero(used)
+        rows = order[used]
+        conditions = np.array(self.conditions or [''], dtype=object)
+        return pd.DataFrame({
+            'Plan ID': [self.plan_id(plan) for plan in plans[plan_idx]],
+            'Seed': self.seed,
+            'Plan Number': plans[plan_idx],
+            'Condition': pd.Categorical(conditions[cond_idx]),
+            'Trial': trial,
+            'List Number': list_nums[rows],
+            'Sentence Number': nums[rows]
+        })
+
+
+    def order(self, plan, sentences, condition=None):
+        """ Sentence numbers of plan number PLAN in presentation
+            order, for CONDITION if the lists are counterbalanced
+        """
+        trials = self.table([plan], sentences)
+        if self.conditions:
+            trials = trials.loc[trials['Condition'] == condition]
+        return trials['Sentence Number'].to_numpy()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write seeded presentation plans to a .csv file")
+    parser.add_argument('sentence_file', help="sentence list .csv file")
+    parser.add_argument('out_path', help="plans .csv file to write")
+    parser.add_argument('--plans', type=int, default=1, 
+        help="number of plans (e.g., one per subject)")
+    parser.add_argument('--lists', type=int, nargs='+', 
+        help="list numbers (default: all)")
+    parser.add_argument('--conditions', nargs='+', default=(),
+        help="conditions to counterbalance the lists across")
+    parser.add_argument('--shuffle', action='store_true',
+        help="shuffle sentences within each list")
+    parser.add_argument('--latin', action='store_true',
+        help="order lists by a balanced Latin square")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    sentences = m_index.read_sentences(args.sentence_file)
+    lists = args.lists or sorted(sentences['list_num'].unique())
+    sentences = sentences.loc[sentences['list_num'].isin(lists)]
+    try:
+        generator = PlanGenerator(lists, args.conditions, args.shuffle,
+            args.latin, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    generator.table(np.arange(1, args.plans + 1), sentences
+        ).to_csv(args.out_path, index=False)
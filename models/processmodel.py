@@ -0,0 +1,430 @@
+""" Audio engine in a separate process.
+
+    Runs an AudioEngine in a child process, so that work on the
+    Tk main thread (garbage collection, printing, drawing
+    dialogs) can never delay the audio callback. Trial audio is
+    passed to the child in shared memory, and commands and
+    replies through queues. Streamed files are opened again in
+    the child, which reads them itself. The child reports when trials
+    finish (with their onset timing), how many dropouts and
+    clipped meter readings have occurred, and each new meter
+    reading.
+
+    EngineProcess can be used in place of an AudioEngine.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import multiprocessing
+import queue
+import threading
+import time as _time
+from multiprocessing import shared_memory
+
+# Import data science packages
+import numpy as np
+
+# Import custom modules
+from models import audiomodel as m_audio
+from models import enginemodel as m_engine
+from models import maskermodel as m_masker
+
+
+#########
+# BEGIN #
+#########
+def _serve(commands, events, settings):
+    """ Child process: run an AudioEngine and carry out
+        commands until told to quit
+    """
+    engine = m_engine.AudioEngine(**settings)
+    # Shared trial buffers by trial ID: [SharedMemory, array,
+    # timing]
+    trials = dict()
+    # IDs of trials that have finished playing
+    finished = set()
+    dropouts = clips = 0
+    meter = None
+    while True:
+        try:
+            name, args = commands.get(timeout=engine.meter_interval)
+        except queue.Empty:
+            name = None
+        if name == 'quit':
+            break
+        if name is not None:
+            try:
+                value = _handle(engine, trials, finished, events, name,
+                    args)
+                error = None
+            except (ValueError, OSError) as e:
+                value, error = None, str(e)
+            events.put(('reply', value, error, engine.fs,
+                engine.output_latency))
+        _free(trials, finished, events, everything=name == 'close')
+        if engine.dropouts != dropouts:
+            dropouts = engine.dropouts
+            events.put(('dropouts', dropouts))
+        if engine.clips != clips:
+            clips = engine.clips
+            events.put(('clips', clips))
+        if engine.meter is not meter:
+            meter = engine.meter
+            events.put(('meter', meter))
+    engine.close()
+    _free(trials, finished, events, everything=True)
+
+
+def _handle(engine, trials, finished, events, name, args):
+    """ Carry out one command in the child process
+    """
+    if name in ('play', 'play_stream'):
+        if name == 'play':
+            trial_id, shm_name, shape, dtype, *args = args
+            shm = shared_memory.SharedMemory(name=shm_name)
+            sig = np.ndarray(shape, dtype, buffer=shm.buf)
+        else:
+            # Stream the file from here (see Audio.stream_source)
+            trial_id, (file_path, trim, target_fs), *args = args
+            shm = None
+            sig = m_audio.Audio(file_path, 0, trim=trim, stream=True,
+                target_fs=target_fs).stream_source()
+        fs, device_id, gain, ramp, masker_gain, onset = args
+        trial = [shm, sig, None]
+        # Held until the timing is assigned, in case the trial
+        # finishes first
+        assigned = threading.Lock()
+
+        def on_finished():
+            with assigned:
+                if trial[2] is not None:
+                    events.put(('finished', trial_id, dict(trial[2])))
+            # Only now may _free release the trial, so its 
+            # 'finished' event always goes out first
+            finished.add(trial_id)
+
+        try:
+            with assigned:
+                trial[2] = engine.play(sig, fs, device_id, gain, 
+                    ramp=ramp, masker_gain=masker_gain, 
+                    on_finished=on_finished, onset=onset)
+        except ValueError:
+            _close(shm, sig)
+            del sig, trial
+            raise
+        trials[trial_id] = trial
+        return trial[2]
+    if name == 'set_masker':
+        file_path, fs, gain = args
+        engine.set_masker(m_masker.MaskerStream(file_path, target_fs=fs),
+            gain)
+        return None
+    if name == 'time':
+        return engine.time
+    return getattr(engine, name)(*args)
+
+
+def _free(trials, finished, events, everything=False):
+    """ Close the shared buffers of trials that are no longer
+        playing: finished, or replaced by a later trial that
+        has started. Tell the GUI process to free them.
+    """
+    started = [trial_id for trial_id, trial in trials.items()
+        if trial[2]['onset'] is not None]
+    latest = max(started, default=-1)
+    for trial_id in list(trials):
+        if everything or trial_id in finished or trial_id < latest:
+            shm, sig, timing = trials.pop(trial_id)
+            finished.discard(trial_id)
+            _close(shm, sig)
+            events.put(('released', trial_id, dict(timing)))
+
+
+def _close(shm, sig):
+    """ Close a trial's shared buffer, or stop its stream
+    """
+    if shm is None:
+        sig.stop()
+    else:
+        shm.close()
+
+
+class EngineProcess:
+    """ AudioEngine running in a child process. Same settings
+        and methods as AudioEngine.
+    """
+    # Audio device queries don't need the child process
+    parse_speakers = staticmethod(m_engine.AudioEngine.parse_speakers)
+    device_rate = staticmethod(m_engine.AudioEngine.device_rate)
+    device_name = staticmethod(m_engine.AudioEngine.device_name)
+
+    # Seconds to wait for the child process to reply
+    timeout = 10.0
+
+    def __init__(self, blocksize=0, latency='low', onset_delay=0.0,
+        trigger_channel=None):
+        self.output_latency = None
+        self.fs = None
+        # Dropouts, clipped meter readings and the latest meter
+        # reading, reported by the child process
+        self.dropouts = 0
+        self.clips = 0
+        self.meter = None
+        self.onsets = []
+        self.last_timing = None
+        self.masker = None
+        self.noise = None
+
+        # Trials in shared memory by ID: [SharedMemory,
+        # on_finished, timing]. Shared with the listener thread.
+        self._trials = dict()
+        self._trials_lock = threading.Lock()
+        self._next_id = 0
+        # One command (and reply) at a time
+        self._lock = threading.Lock()
+        self._replies = queue.SimpleQueue()
+
+        ctx = multiprocessing.get_context('spawn')
+        self._commands = ctx.Queue()
+        self._events = ctx.Queue()
+        self._process = ctx.Process(target=_serve, daemon=True,
+            args=(self._commands, self._events, {
+                'blocksize': blocksize,
+                'latency': latency,
+                'onset_delay': onset_delay,
+                'trigger_channel': trigger_channel
+            }))
+        self._process.start()
+        self._listener = threading.Thread(target=self._listen, daemon=True)
+        self._listener.start()
+        print(f"Models_Process_143: Started audio process " +
+            f"{self._process.pid}")
+
+
+    def configure(self, blocksize, latency, onset_delay=0.0,
+        trigger_channel=None):
+        """ See AudioEngine.configure
+        """
+        self._call('configure', blocksize, latency, onset_delay,
+            trigger_channel)
+
+
+    @property
+    def time(self):
+        """ See AudioEngine.time
+        """
+        return self._call('time')
+
+
+    def open(self, device_id, channels, fs):
+        """ See AudioEngine.open
+        """
+        self._call('open', device_id, channels, fs)
+
+
+    def set_masker(self, masker, gain=None):
+        """ Start the masker in the child process. MASKER is a
+            maskermodel.MaskerStream for a file: the child
+            reads the same file (at the same rate), and the 
+            local one is only used for its gain_matrix and 
+            sample rate.
+        """
+        masker.stop()
+        self._call('set_masker', masker.audio.file_path, masker.fs, gain)
+        self.masker = masker
+
+
+    def remove_masker(self):
+        """ See AudioEngine.remove_masker
+        """
+        self.masker = None
+        self._call('remove_masker')
+
+
+    def play_noise(self, noise, device_id, gain):
+        """ See AudioEngine.play_noise
+        """
+        self._call('play_noise', noise, device_id, gain)
+        self.noise = noise
+
+
+    def set_noise_gain(self, gain):
+        """ See AudioEngine.set_noise_gain
+        """
+        if self.noise is not None:
+            self._call('set_noise_gain', gain)
+
+
+    def stop_noise(self):
+        """ See AudioEngine.stop_noise
+        """
+        self.noise = None
+        self._call('stop_noise')
+
+
+    def play(self, sig, fs, device_id, gain, ramp=None, masker_gain=None,
+        on_finished=None, onset=None):
+        """ Queue the signal in the child process. Arrays are 
+            copied into shared memory. A BlockStream of a file 
+            is opened again in the child, which streams the file
+            itself; other BlockStreams are read into shared 
+            memory in full. See AudioEngine.play.
+        """
+        trial_id = self._next_id
+        self._next_id += 1
+        source = getattr(sig, 'source', None)
+        if source is not None:
+            sig.stop()
+            shm = None
+            command = ('play_stream', trial_id, source)
+        else:
+            shape = sig.shape if len(sig.shape) == 2 else (len(sig), 1)
+            dtype = np.dtype(sig.dtype)
+            shm = shared_memory.SharedMemory(create=True,
+                size=max(1, int(np.prod(shape)) * dtype.itemsize))
+            self._copy(sig, np.ndarray(shape, dtype, buffer=shm.buf))
+            command = ('play', trial_id, shm.name, shape, dtype)
+
+        # The trial's events can be handled before the reply 
+        # arrives, so its timing is in place first
+        timing = {'onset': None}
+        with self._trials_lock:
+            self._trials[trial_id] = [shm, on_finished, timing]
+        try:
+            reply = self._call(*command, fs, device_id, gain, ramp,
+                masker_gain, onset)
+        except ValueError:
+            with self._trials_lock:
+                self._trials.pop(trial_id, None)
+            self._unlink(shm)
+            raise
+        with self._trials_lock:
+            # Keep any later timing from the trial's events
+            for key, value in reply.items():
+                timing.setdefault(key, value)
+        self.last_timing = timing
+        return timing
+
+
+    def stop(self):
+        """ See AudioEngine.stop
+        """
+        self._call('stop')
+
+
+    def close(self):
+        """ See AudioEngine.close
+        """
+        self.noise = None
+        self._call('close')
+
+
+    def onset_stats(self):
+        """ See enginemodel.onset_stats
+        """
+        return m_engine.onset_stats(self.onsets)
+
+
+    def shutdown(self):
+        """ Stop the child process and free all shared memory
+        """
+        self._commands.put(('quit', None))
+        self._process.join(self.timeout)
+        with self._trials_lock:
+            for shm, _, _ in self._trials.values():
+                self._unlink(shm)
+            self._trials.clear()
+
+
+    #####################
+    # Private functions #
+    #####################
+    def _call(self, name, *args):
+        """ Send a command to the child process and return its
+            reply. Errors in the child are raised as ValueError.
+        """
+        with self._lock:
+            self._commands.put((name, args))
+            try:
+                value, error, fs, latency = self._replies.get(
+                    timeout=self.timeout)
+            except queue.Empty:
+                raise ValueError("The audio process is not responding") \
+                    from None
+        self.fs = fs
+        self.output_latency = latency
+        if error is not None:
+            raise ValueError(error)
+        return value
+
+
+    @staticmethod
+    def _copy(sig, buf):
+        """ Copy an array, or all frames of a BlockStream, into
+            BUF
+        """
+        if isinstance(sig, np.ndarray):
+            buf[:] = sig.reshape(buf.shape)
+            return
+        pos = 0
+        while pos < len(buf):
+            chunk = sig.read(len(buf) - pos)
+            if len(chunk) == 0:
+                _time.sleep(0.001)
+                continue
+            buf[pos:pos + len(chunk)] = chunk
+            pos += len(chunk)
+        sig.stop()
+
+
+    @staticmethod
+    def _unlink(shm):
+        """ Free a shared memory block (if any)
+        """
+        if shm is None:
+            return
+        shm.close()
+        shm.unlink()
+
+
+    def _record(self, trial, timing):
+        """ Update a trial's timing and add it to the session's
+            onsets (once). Call with the trials lock held.
+        """
+        first = trial[2]['onset'] is None
+        trial[2].update(timing)
+        if first and timing['onset'] is not None:
+            self.onsets.append(trial[2])
+
+
+    def _listen(self):
+        """ Handle replies and reports from the child process
+        """
+        while True:
+            event = self._events.get()
+            kind = event[0]
+            if kind == 'reply':
+                self._replies.put(event[1:])
+            elif kind == 'meter':
+                self.meter = event[1]
+            elif kind == 'dropouts':
+                self.dropouts = event[1]
+                print(f"Models_Process_318: {self.dropouts} audio dropouts")
+            elif kind == 'clips':
+                self.clips = event[1]
+            elif kind == 'finished':
+                with self._trials_lock:
+                    trial = self._trials.get(event[1])
+                    if trial is not None:
+                        self._record(trial, event[2])
+                if trial is not None and trial[1] is not None:
+                    trial[1]()
+            elif kind == 'released':
+                with self._trials_lock:
+                    trial = self._trials.pop(event[1], None)
+                    if trial is not None:
+                        self._record(trial, event[2])
+                if trial is not None:
+                    self._unlink(trial[0])
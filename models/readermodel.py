@@ -0,0 +1,171 @@
+""" Pluggable audio file readers.
+
+    Audio files are decoded by a reader chosen by file
+    extension. WAV files are read with scipy (and can be
+    memory-mapped). FLAC and Ogg files are decoded with the
+    optional soundfile package. Decoded audio is returned like
+    wavfile.read output (fs, frames or frames x channels), in
+    int16/int32 for integer PCM and float32 otherwise. Like a
+    memory-mapped WAV file, a compressed file read with MMAP is
+    only decoded a block at a time, as its frames are used.
+
+    More formats can be added with register().
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import os
+
+# Import audio packages
+from scipy.io import wavfile
+
+# soundfile is optional: only needed for compressed formats
+try:
+    import soundfile as sf
+except (ImportError, OSError):
+    sf = None
+
+
+#########
+# BEGIN #
+#########
+def read_wav(file_path, mmap=False):
+    """ Read a .wav file with scipy
+    """
+    return wavfile.read(file_path, mmap=mmap)
+
+
+class SoundFileFrames:
+    """ Frames of a compressed file, decoded only when used. 
+        Stands in for the decoded array (like a memory map): 
+        slicing frames, or reshaping to (frames, channels), 
+        gives another SoundFileFrames, and only converting to
+        an array (np.asarray, astype) decodes. Each conversion
+        opens the file, so blocks can be decoded on any thread.
+    """
+    def __init__(self, file_path, dtype, frames, channels, start=0,
+        squeeze=None):
+        self.file_path = file_path
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.start = start
+        # Mono files are 1-D, as in wavfile.read output
+        self.squeeze = channels == 1 if squeeze is None else squeeze
+        self.shape = (frames,) if self.squeeze else (frames, channels)
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+
+    def __getitem__(self, idx):
+        """ Frames START:STOP (not decoded). Other indexes 
+            decode the frames first.
+        """
+        if not isinstance(idx, slice) or idx.step not in (None, 1):
+            return np.asarray(self)[idx]
+        start, stop, _ = idx.indices(len(self))
+        return SoundFileFrames(self.file_path, self.dtype, 
+            max(stop - start, 0), self.channels, self.start + start,
+            self.squeeze)
+
+
+    def reshape(self, *shape):
+        """ Frames x channels (not decoded) for (frames, -1)
+            or (frames, channels). Other shapes decode the 
+            frames first.
+        """
+        if len(shape) == 1 and isinstance(shape[0], tuple):
+            shape = shape[0]
+        if tuple(shape) in ((len(self), -1), (len(self), self.channels)):
+            return SoundFileFrames(self.file_path, self.dtype, len(self),
+                self.channels, self.start, squeeze=False)
+        return np.asarray(self).reshape(shape)
+
+
+    def astype(self, dtype):
+        return np.asarray(self).astype(dtype)
+
+
+    def __array__(self, dtype=None, copy=None):
+        with sf.SoundFile(self.file_path) as f:
+            f.seek(self.start)
+            audio = f.read(len(self), dtype=str(self.dtype), 
+                always_2d=True)
+        if self.squeeze:
+            audio = audio[:, 0]
+        return audio if dtype is None else audio.astype(dtype)
+
+
+def read_soundfile(file_path, mmap=False):
+    """ Decode a compressed file (e.g., FLAC or Ogg) with
+        soundfile. With MMAP, returns SoundFileFrames, decoded
+        as the frames are used.
+    """
+    if sf is None:
+        raise ValueError("Reading " +
+            f"{os.path.splitext(file_path)[1]} files needs the " +
+            "'soundfile' package")
+    # Keep integer PCM as integers (no float64 copy)
+    info = sf.info(file_path)
+    dtype = {'PCM_16': 'int16', 'PCM_24': 'int32',
+        'PCM_32': 'int32'}.get(info.subtype, 'float32')
+    if mmap:
+        return info.samplerate, SoundFileFrames(file_path, dtype,
+            info.frames, info.channels)
+    audio, fs = sf.read(file_path, dtype=dtype, always_2d=False)
+    return fs, audio
+
+
+# Readers by (lower case) file extension
+readers = {
+    '.wav': read_wav,
+    '.flac': read_soundfile,
+    '.ogg': read_soundfile
+}
+
+
+def register(extension, reader):
+    """ Add (or replace) the reader for a file extension. A
+        reader takes (file_path, mmap) and returns (fs, audio).
+    """
+    readers[extension.lower()] = reader
+
+
+def extensions():
+    """ Supported file extensions
+    """
+    return tuple(readers)
+
+
+def patterns():
+    """ Glob patterns for supported files
+    """
+    return tuple(f"*{ext}" for ext in readers)
+
+
+def read(file_path, mmap=False):
+    """ Read an audio file with the reader for its extension.
+        Returns (fs, audio).
+    """
+    ext = os.path.splitext(str(file_path))[1].lower()
+    try:
+        reader = readers[ext]
+    except KeyError:
+        raise ValueError(f"Unsupported audio file type: {ext}") from None
+    return reader(file_path, mmap)
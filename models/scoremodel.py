@@ -18,7 +18,10 @@ class ScoreModel:
         'Num Words Correct': {'type': 'int', 'value': 0},
         'Words Incorrect': {'type': 'str', 'value': ''},
         'Outcome': {'type': 'int', 'value': None},
-        'Trial': {'type': 'int', 'value': None}
+        'Trial': {'type': 'int', 'value': None},
+        'Sentence Number': {'type': 'int', 'value': None},
+        'Masker Level': {'type': 'float', 'value': None},
+        'SNR': {'type': 'float', 'value': None}
     }
 
 
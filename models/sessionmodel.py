@@ -22,16 +22,44 @@ class SessionParsModel:
         'Condition': {'type': 'str', 'value': 'Quiet'},
         'List Number': {'type': 'str', 'value': '1'},
         'Presentation Level': {'type': 'float', 'value': 65},
-        'Speaker Number': {'type': 'int', 'value': 1},
+        'Speaker Number': {'type': 'str', 'value': '1'},
         'Audio Files Path': {'type': 'str', 'value': 'Please select a path'},
         'Sentence File Path': {'type': 'str', 'value': 'Please select a path'},
+        'Key Word Markup': {'type': 'str', 'value': 'Capitals'},
+        'Shuffle Sentences': {'type': 'bool', 'value': False},
+        'List Order': {'type': 'str', 'value': 'As Entered'},
+        'Counterbalance Conditions': {'type': 'str', 'value': ''},
+        'Randomization Seed': {'type': 'int', 'value': 1},
+        'Plan Number': {'type': 'int', 'value': 1},
         'Audio Device ID': {'type': 'int', 'value': None},
         'raw_lvl': {'type': 'float', 'value': -30},
         'slm_cal_value': {'type': 'float', 'value': 65},
         'slm_offset': {'type': 'float', 'value': 95.0},
         'new_raw_lvl': {'type': 'float', 'value': -30},
         'new_db_lvl': {'type': 'float', 'value': 65},
-        'Calibration File': {'type': 'str', 'value': 'cal_stim.wav'}
+        'Calibration File': {'type': 'str', 'value': 'cal_stim.wav'},
+        'Calibration Type': {'type': 'str', 'value': 'white'},
+        'Calibration Max Age (days)': {'type': 'float', 'value': 30.0},
+        'Measurement Input': {'type': 'str', 'value': ''},
+        'Measurement Channel': {'type': 'int', 'value': 1},
+        'Input Reference (dB SPL)': {'type': 'float', 'value': 120.0},
+        'Block Size': {'type': 'int', 'value': 0},
+        'Stream Latency': {'type': 'str', 'value': 'low'},
+        'Onset Delay (ms)': {'type': 'float', 'value': 0.0},
+        'Trigger Channel': {'type': 'int', 'value': 0},
+        'Separate Audio Process': {'type': 'bool', 'value': False},
+        'Match Device Rate': {'type': 'bool', 'value': True},
+        'Pre-convert List': {'type': 'bool', 'value': False},
+        'Stream Files Over (s)': {'type': 'float', 'value': 30.0},
+        'Preserve ILD': {'type': 'bool', 'value': False},
+        'Trim Silence': {'type': 'bool', 'value': False},
+        'Masker File': {'type': 'str', 'value': ''},
+        'Masker Speaker(s)': {'type': 'str', 'value': ''},
+        'SNR': {'type': 'float', 'value': 0.0},
+        'Adaptive Track': {'type': 'str', 'value': 'Level'},
+        'Babble Talkers': {'type': 'int', 'value': 0},
+        'Babble Seed': {'type': 'int', 'value': 1},
+        'Local Mirror': {'type': 'bool', 'value': False}
     }
 
     def __init__(self):
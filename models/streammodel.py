@@ -0,0 +1,140 @@
+""" Block-wise streaming of long audio files.
+
+    A background thread pulls blocks from a generator (e.g.,
+    Audio.blocks, reading a memory-mapped file) into a
+    fixed-size ring buffer, and the audio engine callback takes
+    samples from the ring. Playback starts once the first block
+    is ready, and memory use does not depend on file length.
+"""
+
+###########
+# Imports #
+###########
+# Import system packages
+import threading
+
+# Import data science packages
+import numpy as np
+
+
+#########
+# BEGIN #
+#########
+class BlockStream:
+    """ Feed blocks from a generator to the output stream.
+
+        blocks: iterator of (frames x channels) arrays
+        frames: total number of frames the iterator yields
+        channels: number of audio channels
+        dtype: data type of the blocks
+        ring_frames: ring buffer length (frames)
+        source: what the blocks are read from, so that the 
+            same stream can be opened in another process (see
+            Audio.stream_source); None if unknown
+    """
+    def __init__(self, blocks, frames, channels, dtype, ring_frames=131072,
+        source=None):
+        self._blocks = iter(blocks)
+        self.source = source
+        self.frames = int(frames)
+        self.shape = (self.frames, channels)
+        self.dtype = np.dtype(dtype)
+
+        self._ring = np.zeros((ring_frames, channels), dtype=self.dtype)
+        # Contiguous copy of a read that wraps around the ring
+        self._wrap = np.zeros((0, channels), dtype=self.dtype)
+        self._read = 0 # total frames released by the callback
+        self._held = 0 # frames returned by the last read
+        self._write = 0 # total frames written to the ring
+        # Part of the last block that did not fit in the ring
+        self._leftover = None
+        # Callbacks that found the ring empty
+        self.underruns = 0
+
+        self._space = threading.Event()
+        self._running = True
+        # Playback can start as soon as the first block is ready
+        self._fill(once=True)
+        self._worker = threading.Thread(target=self._fill_worker,
+            daemon=True)
+        self._worker.start()
+
+
+    def __len__(self):
+        return self.frames
+
+
+    def read(self, frames):
+        """ Return the next (at most FRAMES) frames as one
+            array. Returns fewer frames if the reader thread
+            has fallen behind. Called from the audio callback.
+            The array is valid until the next call.
+        """
+        # Release the frames returned by the last call
+        self._read += self._held
+        size = len(self._ring)
+        n = min(frames, self._write - self._read)
+        if n < frames and self._read + n < self.frames:
+            self.underruns += 1
+
+        start = self._read % size
+        if start + n <= size:
+            out = self._ring[start:start + n]
+        else:
+            # Stage both ring segments in one reused buffer
+            if len(self._wrap) < frames:
+                self._wrap = np.empty((frames, self.shape[1]), self.dtype)
+            first = size - start
+            out = self._wrap[:n]
+            out[:first] = self._ring[start:]
+            out[first:] = self._ring[:n - first]
+        self._held = n
+        self._space.set()
+        return out
+
+
+    def stop(self):
+        """ Stop the reader thread
+        """
+        self._running = False
+        self._space.set()
+
+
+    #####################
+    # Private functions #
+    #####################
+    def _fill(self, once=False):
+        """ Copy blocks into free ring space (only one block
+            if ONCE). Returns False once the generator is used
+            up.
+        """
+        size = len(self._ring)
+        # Frames held by the callback are not free yet
+        free = size - (self._write - self._read)
+        while free > 0:
+            if self._leftover is None:
+                try:
+                    self._leftover = next(self._blocks)
+                except StopIteration:
+                    return False
+            block = self._leftover
+            start = self._write % size
+            count = min(free, size - start, len(block))
+            self._ring[start:start + count] = block[:count]
+            self._leftover = block[count:] if count < len(block) else None
+            self._write += count
+            free -= count
+            if once and self._leftover is None:
+                break
+        return True
+
+
+    def _fill_worker(self):
+        """ Refill the ring whenever the callback has used some
+            of it
+        """
+        while self._running:
+            self._space.wait()
+            self._space.clear()
+            if self._running and not self._fill():
+                break
@@ -0,0 +1,2 @@
+""" Tests for Speech Task Controller models
+"""
@@ -0,0 +1,97 @@
+""" Buffer copies made when reading and presenting audio.
+
+    Run with: python -m pytest tests
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import tracemalloc
+
+# Import testing packages
+import pytest
+
+# Import audio packages
+from scipy.io import wavfile
+
+# Import custom modules
+from models import audiomodel as a
+from models import cachemodel as m_cache
+
+
+#########
+# BEGIN #
+#########
+@pytest.fixture(params=['int16', 'float32'])
+def wav_path(request, tmp_path):
+    """ Ten second stereo .wav file of the given data type
+    """
+    rng = np.random.default_rng(0)
+    sig = rng.uniform(-0.5, 0.5, (480000, 2))
+    if request.param == 'int16':
+        sig = (sig * 32767).astype(np.int16)
+    else:
+        sig = sig.astype(np.float32)
+    path = tmp_path / f"1_{request.param}.wav"
+    wavfile.write(path, 48000, sig)
+    return str(path)
+
+
+def _peak_alloc(func):
+    """ Call FUNC and return (result, bytes allocated at peak)
+    """
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def test_cached_audio_is_not_copied(wav_path):
+    """ Audio objects use the cached buffer itself, in its
+        native data type
+    """
+    cache = m_cache.AudioCache()
+    _, buffer = cache.read(wav_path)
+
+    audio, peak = _peak_alloc(lambda: a.Audio(wav_path, -30, cache=cache))
+    assert audio.working_audio.dtype == buffer.dtype
+    assert np.shares_memory(audio.working_audio, buffer)
+    # No full-size copy of the buffer was allocated
+    assert peak < buffer.nbytes / 2
+
+
+def test_trimmed_audio_is_a_view(wav_path):
+    """ Trimming slices the cached buffer without copying
+    """
+    cache = m_cache.AudioCache()
+    _, buffer = cache.read(wav_path)
+    audio = a.Audio(wav_path, -30, cache=cache, trim=(100, 20000))
+    assert len(audio.working_audio) == 19900
+    assert np.shares_memory(audio.working_audio, buffer)
+
+
+def test_level_measurement_makes_no_full_copy(wav_path):
+    """ Channel levels are measured in blocks
+    """
+    cache = m_cache.AudioCache()
+    audio = a.Audio(wav_path, -30, cache=cache)
+    _, peak = _peak_alloc(lambda: audio.channel_rms(block=4096))
+    assert peak < audio.working_audio.nbytes / 2
+
+
+def test_cache_hit_returns_same_buffer(wav_path):
+    """ A second read is served from the cache (no decode)
+    """
+    cache = m_cache.AudioCache()
+    _, first = cache.read(wav_path)
+    _, second = cache.read(wav_path)
+    assert first is second
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert not first.flags.writeable
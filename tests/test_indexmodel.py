@@ -0,0 +1,63 @@
+""" Index of sentence and audio file directories.
+
+    Run with: python -m pytest tests
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import pandas as pd
+
+# Import testing packages
+import pytest
+
+# Import custom modules
+from models import indexmodel as m_index
+
+
+#########
+# BEGIN #
+#########
+@pytest.fixture
+def index(tmp_path):
+    """ Empty index in a temporary database
+    """
+    return m_index.CorpusIndex(tmp_path / 'index.sqlite')
+
+
+def _write_sentences(path, nums, lists):
+    pd.DataFrame({
+        'sentence': [f"Sentence {num}." for num in nums],
+        'list_num': lists,
+        'sentence_num': nums
+    }).to_csv(path, index=False)
+
+
+def test_other_csv_files_are_skipped(index, tmp_path):
+    _write_sentences(tmp_path / 'a.csv', [1, 2, 3], [1, 1, 2])
+    (tmp_path / 'notes.csv').write_text("name,size\nx,1\n")
+    (tmp_path / 'empty.csv').write_text("")
+    (tmp_path / 'stc_metadata.csv').write_text("name,size\nx,1\n")
+    df, num_files, skipped = index.sentences(tmp_path, [1],
+        exclude=('stc_metadata.csv',))
+    assert num_files == 1
+    assert skipped == ['empty.csv', 'notes.csv']
+    assert df['sentence_num'].tolist() == [1, 2]
+
+
+def test_no_sentence_files(index, tmp_path):
+    (tmp_path / 'notes.csv').write_text("name,size\nx,1\n")
+    with pytest.raises(FileNotFoundError):
+        index.sentences(tmp_path, [1])
+
+
+def test_selections_longer_than_sqlite_parameter_limit(index, tmp_path):
+    nums = list(range(1, 2001))
+    _write_sentences(tmp_path / 'a.csv', nums, nums)
+    for num in nums:
+        (tmp_path / f"{num}.wav").touch()
+    df, _, _ = index.sentences(tmp_path, nums)
+    assert df['sentence_num'].tolist() == nums
+    audio = index.audio_files(tmp_path, nums)
+    assert audio['file_num'].tolist() == nums
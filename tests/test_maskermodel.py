@@ -0,0 +1,89 @@
+""" Continuous masker: memory use and looping.
+
+    Run with: python -m pytest tests
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import tracemalloc
+
+# Import testing packages
+import pytest
+
+# Import audio packages
+from scipy.io import wavfile
+
+# Import custom modules
+from models import maskermodel as m_masker
+
+
+#########
+# BEGIN #
+#########
+@pytest.fixture(params=['float64', 'uint8', 'int16'])
+def masker_path(request, tmp_path):
+    """ Thirty second stereo noise file of the given data type
+    """
+    rng = np.random.default_rng(0)
+    sig = rng.uniform(-0.5, 0.5, (30 * 48000, 2))
+    if request.param == 'uint8':
+        sig = (sig * 127 + 128).astype(np.uint8)
+    elif request.param == 'int16':
+        sig = (sig * 32767).astype(np.int16)
+    path = tmp_path / f"masker_{request.param}.wav"
+    wavfile.write(path, 48000, sig)
+    return str(path), sig
+
+
+def _mix(masker, frames, block=1024):
+    """ Mix FRAMES of MASKER (refilling the ring as the fill
+        thread would)
+    """
+    out = np.zeros((frames, masker.channels), np.float32)
+    for start in range(0, frames, block):
+        masker.mix_into(out[start:start + block])
+        masker._fill()
+    return out
+
+
+def test_masker_is_not_copied(masker_path):
+    path, sig = masker_path
+    tracemalloc.start()
+    try:
+        masker = m_masker.MaskerStream(path, ring_dur=0.5)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    masker.stop()
+    # Ring buffer and a few blocks, not a float32 copy of the
+    # whole file
+    assert peak < sig.size * 4 / 2
+
+
+def test_masker_loops(masker_path):
+    path, sig = masker_path
+    masker = m_masker.MaskerStream(path, ring_dur=0.5)
+    masker.stop()
+    masker.gain = np.eye(2, dtype=np.float32)
+    out = _mix(masker, len(sig) + 4096)
+    assert masker.underruns == 0
+    # The mix holds the samples (with any int scaling left to
+    # the gain), and starts over at the end of the file
+    assert np.allclose(out[len(sig):], out[:4096])
+    assert np.allclose(out[:len(sig)], sig.astype(np.float32), atol=1e-6)
+
+
+def test_masker_level(masker_path):
+    path, _ = masker_path
+    masker = m_masker.MaskerStream(path, ring_dur=0.5)
+    masker.stop()
+    masker.gain = masker.gain_matrix(-30, [1, 2])
+    out = _mix(masker, 96000)
+    rms = 20 * np.log10(np.sqrt(np.mean(np.square(out, dtype=np.float64),
+        axis=0)))
+    assert rms == pytest.approx([-30, -30], abs=0.1)
@@ -0,0 +1,133 @@
+""" Calibration measurements, using audio files in place of
+    the measurement input.
+
+    Run with: python -m pytest tests
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import time
+
+# Import testing packages
+import pytest
+
+# Import audio packages
+from scipy.io import wavfile
+
+# Import custom modules
+from models import measuremodel as m_measure
+
+
+#########
+# BEGIN #
+#########
+fs = 48000
+
+
+def _write(path, sig):
+    wavfile.write(path, fs, sig)
+    return str(path)
+
+
+@pytest.fixture
+def sine_path(tmp_path):
+    """ Five seconds of a full scale 1 kHz sine (float32)
+    """
+    t = np.arange(5 * fs) / fs
+    return _write(tmp_path / 'sine.wav',
+        np.sin(2 * np.pi * 1000 * t).astype(np.float32))
+
+
+@pytest.fixture
+def noise_path(tmp_path):
+    """ Five seconds of white noise at -20 dB FS (float32)
+    """
+    rng = np.random.default_rng(0)
+    return _write(tmp_path / 'noise.wav',
+        (0.1 * rng.standard_normal(5 * fs)).astype(np.float32))
+
+
+def _levels(path):
+    inp = m_measure.FileInput(path)
+    return m_measure.band_levels(inp.record(4 * inp.fs), inp.fs)
+
+
+def test_sine_level(sine_path):
+    overall, bands = _levels(sine_path)
+    assert overall == pytest.approx(-3.01, abs=0.02)
+    levels = dict(zip(m_measure.octave_bands, bands))
+    assert levels[1000] == pytest.approx(-3.01, abs=0.02)
+    # Other bands hold only window leakage
+    for band, level in levels.items():
+        if band != 1000:
+            assert level < -60
+
+
+def test_noise_level(noise_path):
+    overall, bands = _levels(noise_path)
+    assert overall == pytest.approx(-20.0, abs=0.1)
+    # White noise: each octave band has twice the power of the
+    # one below (from 250 Hz: the 125 Hz band is only 15 FFT 
+    # bins wide)
+    assert np.diff(bands[1:]) == pytest.approx(np.full(len(bands) - 2,
+        10 * np.log10(2)), abs=0.3)
+    # The bands cover 88 Hz to 11.3 kHz of the 24 kHz spectrum
+    low, high = m_measure.octave_bands[0], m_measure.octave_bands[-1]
+    covered = 10 * np.log10(np.sum(10 ** (bands / 10)))
+    assert covered == pytest.approx(overall + 10 * np.log10(
+        (2 * high - low) / np.sqrt(2) / (fs / 2)), abs=0.2)
+
+
+def test_integer_file_is_scaled_to_full_scale(tmp_path):
+    t = np.arange(2 * fs) / fs
+    path = _write(tmp_path / 'half.wav',
+        (0.5 * 32767 * np.sin(2 * np.pi * 1000 * t)).astype(np.int16))
+    overall, _ = _levels(path)
+    assert overall == pytest.approx(-9.03, abs=0.02)
+
+
+def test_bands_above_nyquist_are_silent(noise_path):
+    inp = m_measure.FileInput(noise_path)
+    _, bands = m_measure.band_levels(inp.record(fs)[::6], fs // 6)
+    assert bands[-1] == -np.inf
+    assert np.isfinite(bands[:-1]).all()
+
+
+def test_file_input_loops(sine_path):
+    inp = m_measure.FileInput(sine_path)
+    recording = inp.record(2 * len(inp.audio) + 10)
+    assert np.array_equal(recording[len(inp.audio):2 * len(inp.audio)],
+        inp.audio)
+    assert np.array_equal(recording[-10:], inp.audio[:10])
+
+
+def test_file_input_channel(sine_path):
+    with pytest.raises(ValueError):
+        m_measure.FileInput(sine_path, channel=2)
+
+
+def test_open_input(sine_path, tmp_path):
+    assert isinstance(m_measure.open_input(sine_path),
+        m_measure.FileInput)
+    with pytest.raises(ValueError):
+        m_measure.open_input(tmp_path / 'missing.wav')
+    with pytest.raises(ValueError):
+        m_measure.open_input('microphone')
+
+
+def test_measurement(sine_path):
+    measurement = m_measure.Measurement(
+        m_measure.FileInput(sine_path), reference=100)
+    deadline = time.monotonic() + 10
+    while not measurement.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert measurement.error is None
+    assert measurement.result['overall'] == pytest.approx(96.99, abs=0.02)
+    assert measurement.result['bands'][1000] == \
+        pytest.approx(96.99, abs=0.02)
+    assert set(measurement.result['bands']) == set(m_measure.octave_bands)
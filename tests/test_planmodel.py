@@ -0,0 +1,202 @@
+""" Trial plans: pairing sentences with audio files, key
+    word markup, and seeded presentation orders.
+
+    Run with: python -m pytest tests
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+import pandas as pd
+
+# Import testing packages
+import pytest
+
+# Import custom modules
+from models import planmodel as m_plan
+
+
+#########
+# BEGIN #
+#########
+@pytest.fixture
+def sentence_df():
+    """ Six sentences in two lists, out of number order
+    """
+    return pd.DataFrame({
+        'sentence_num': [3, 1, 2, 6, 4, 5],
+        'list_num': [1, 1, 1, 2, 2, 2],
+        'sentence': [f"The BOY saw sentence {num}." for num in
+            (3, 1, 2, 6, 4, 5)]
+    })
+
+
+@pytest.fixture
+def audio_df():
+    """ Audio files for every sentence but 4, plus one that
+        is not in the lists
+    """
+    nums = [1, 2, 3, 5, 6, 7]
+    return pd.DataFrame({
+        'file_num': nums,
+        'path': [f"/audio/{num}.wav" for num in nums]
+    })
+
+
+def test_sentences_are_paired_with_their_audio_file(sentence_df, audio_df):
+    plan = m_plan.TrialPlan(sentence_df, audio_df)
+    for trial in plan:
+        assert trial.path == f"/audio/{trial.sentence_num}.wav"
+        assert trial.sentence == f"The BOY saw sentence {trial.sentence_num}."
+
+
+def test_plan_keeps_sentence_order(sentence_df, audio_df):
+    plan = m_plan.TrialPlan(sentence_df, audio_df)
+    assert [trial.sentence_num for trial in plan] == [3, 1, 2, 6, 5]
+    assert [trial.list_num for trial in plan] == [1, 1, 1, 2, 2]
+    assert plan.paths == [f"/audio/{num}.wav" for num in (3, 1, 2, 6, 5)]
+
+
+def test_sentences_without_audio_are_missing(sentence_df, audio_df):
+    plan = m_plan.TrialPlan(sentence_df, audio_df)
+    assert plan.missing == (4,)
+    assert len(plan) == 5
+    assert plan.lookup(4) is None
+    assert plan.lookup(6).path == "/audio/6.wav"
+
+
+def test_nothing_missing_when_every_sentence_has_audio(sentence_df,
+    audio_df):
+    audio_df = pd.concat([audio_df, pd.DataFrame({'file_num': [4],
+        'path': ["/audio/4.wav"]})])
+    plan = m_plan.TrialPlan(sentence_df, audio_df)
+    assert plan.missing == ()
+    assert len(plan) == len(sentence_df)
+
+
+def test_trials_are_read_only(sentence_df, audio_df):
+    trial = m_plan.TrialPlan(sentence_df, audio_df)[0]
+    with pytest.raises(AttributeError):
+        trial.path = "/audio/other.wav"
+    with pytest.raises(ValueError):
+        trial.mask[0] = True
+
+
+@pytest.mark.parametrize('markup, sentence', [
+    ('Capitals', "A BOY fell FROM the window."),
+    ('Asterisks', "A *boy* fell *from* the window."),
+    ('Brackets', "A [boy] fell [from] the window."),
+    ('Underscores', "A _boy_ fell _from_ the window.")
+])
+def test_tokenize_finds_marked_key_words(markup, sentence):
+    words, mask = m_plan.tokenize(sentence, markup)
+    assert [word.lower() for word in words] == \
+        ["a", "boy", "fell", "from", "the", "window"]
+    assert mask == [False, True, False, True, False, False]
+
+
+@pytest.mark.parametrize('markup, sentence', [
+    ('Asterisks', "The *dog*, sat *down*."),
+    ('Brackets', "The [dog], sat [down]."),
+    ('Underscores', "The _dog_, sat _down_.")
+])
+def test_tokenize_keeps_punctuation_after_marks(markup, sentence):
+    words, mask = m_plan.tokenize(sentence, markup)
+    assert words == ["The", "dog,", "sat", "down"]
+    assert mask == [False, True, False, True]
+
+
+def test_tokenize_other_marks_are_not_key_words():
+    words, mask = m_plan.tokenize("The *dog* SAT [down].", 'Brackets')
+    assert words == ["The", "*dog*", "SAT", "down"]
+    assert mask == [False, False, False, True]
+
+
+def test_trial_key_words(sentence_df, audio_df):
+    sentence_df['sentence'] = "The *cat* ran *away*."
+    trial = m_plan.TrialPlan(sentence_df, audio_df, 'Asterisks')[0]
+    assert list(trial.words) == ["The", "cat", "ran", "away"]
+    assert list(trial.keywords) == [1, 3]
+
+
+#################
+# Randomization #
+#################
+@pytest.fixture
+def list_sentences():
+    """ Four lists of five sentences
+    """
+    return pd.DataFrame({
+        'sentence_num': range(1, 21),
+        'list_num': [num // 5 + 1 for num in range(20)]
+    })
+
+
+@pytest.mark.parametrize('n', [2, 3, 4, 5, 6])
+def test_latin_square_is_balanced(n):
+    square = m_plan.latin_square(n)
+    assert len(square) == (2 * n if n % 2 else n)
+    # Each treatment once per order, and equally often in each
+    # position
+    for row in square:
+        assert sorted(row) == list(range(n))
+    for col in square.T:
+        counts = np.bincount(col, minlength=n)
+        assert (counts == len(square) // n).all()
+    # Each treatment follows every other equally often
+    pairs = np.zeros((n, n), int)
+    for row in square:
+        np.add.at(pairs, (row[:-1], row[1:]), 1)
+    off_diagonal = pairs[~np.eye(n, dtype=bool)]
+    assert (off_diagonal == off_diagonal[0]).all()
+    assert (np.diag(pairs) == 0).all()
+
+
+def test_plans_do_not_depend_on_batch(list_sentences):
+    generator = m_plan.PlanGenerator([1, 2, 3, 4], ['Quiet', 'Noise'],
+        shuffle=True, latin=True, seed=7)
+    batch = generator.table(np.arange(1, 11), list_sentences)
+    for plan in (1, 4, 10):
+        single = generator.table([plan], list_sentences)
+        in_batch = batch.loc[batch['Plan Number'] == plan
+            ].reset_index(drop=True)
+        pd.testing.assert_frame_equal(single, in_batch)
+
+
+def test_same_seed_same_plan(list_sentences):
+    def order(seed):
+        return m_plan.PlanGenerator([1, 2, 3, 4], shuffle=True,
+            seed=seed).order(3, list_sentences)
+    assert (order(5) == order(5)).all()
+    assert not (order(5) == order(6)).all()
+
+
+def test_shuffle_stays_within_lists(list_sentences):
+    order = m_plan.PlanGenerator([1, 2, 3, 4], shuffle=True, seed=1
+        ).order(1, list_sentences)
+    lists = (order - 1) // 5 + 1
+    assert lists.tolist() == sorted(lists.tolist())
+    assert sorted(order.tolist()) == list(range(1, 21))
+
+
+def test_lists_in_order_entered_without_randomization(list_sentences):
+    generator = m_plan.PlanGenerator([3, 1, 2, 4])
+    assert not generator.randomized
+    assert generator.order(1, list_sentences).tolist() == \
+        list(range(11, 16)) + list(range(1, 11)) + list(range(16, 21))
+
+
+def test_conditions_rotate_lists(list_sentences):
+    generator = m_plan.PlanGenerator([1, 2, 3, 4], ['Quiet', 'Noise'])
+    assert generator.assign([1]).tolist() == [[[1, 2], [3, 4]]]
+    assert generator.assign([2]).tolist() == [[[3, 4], [1, 2]]]
+    assert generator.order(2, list_sentences, 'Quiet').tolist() == \
+        list(range(11, 21))
+
+
+@pytest.mark.parametrize('seed', [-1, 2 ** 64])
+def test_seed_out_of_range_is_rejected(seed):
+    with pytest.raises(ValueError):
+        m_plan.PlanGenerator([1, 2], seed=seed)
@@ -0,0 +1,74 @@
+""" Compressed audio files, decoded as their frames are used.
+
+    Run with: python -m pytest tests
+"""
+
+###########
+# Imports #
+###########
+# Import data science packages
+import numpy as np
+
+# Import system packages
+import tracemalloc
+
+# Import testing packages
+import pytest
+
+# Import custom modules
+from models import audiomodel as a
+from models import readermodel as m_reader
+
+sf = pytest.importorskip('soundfile')
+
+
+#########
+# BEGIN #
+#########
+@pytest.fixture
+def flac(tmp_path):
+    """ Path and samples of a 20 second stereo .flac file
+    """
+    rng = np.random.default_rng(0)
+    sig = (rng.uniform(-0.5, 0.5, (20 * 48000, 2)) * 32767).astype(np.int16)
+    path = str(tmp_path / '1.flac')
+    sf.write(path, sig, 48000, subtype='PCM_16')
+    return path, sig
+
+
+def test_mapped_read_is_not_decoded(flac):
+    path, sig = flac
+    fs, audio = m_reader.read(path, mmap=True)
+    assert isinstance(audio, m_reader.SoundFileFrames)
+    assert (fs, audio.shape, audio.dtype) == (48000, sig.shape, sig.dtype)
+    part = audio[1000:1010]
+    assert isinstance(part, m_reader.SoundFileFrames)
+    assert np.array_equal(np.asarray(part), sig[1000:1010])
+
+
+def test_mono_frames_are_1d(tmp_path):
+    sig = np.arange(-500, 500, dtype=np.int16)
+    path = str(tmp_path / '2.flac')
+    sf.write(path, sig, 48000, subtype='PCM_16')
+    _, audio = m_reader.read(path, mmap=True)
+    assert audio.shape == (1000,)
+    assert np.array_equal(np.asarray(audio[10:20]), sig[10:20])
+    assert np.array_equal(np.asarray(audio.reshape(1000, -1)),
+        sig[:, np.newaxis])
+
+
+def test_streamed_file_is_decoded_in_blocks(flac):
+    path, sig = flac
+    tracemalloc.start()
+    try:
+        audio = a.Audio(path, 0, trim=(100, len(sig) - 100), stream=True)
+        total = 0
+        for block in audio.blocks():
+            assert np.array_equal(np.asarray(block),
+                sig[100 + total:100 + total + len(block)])
+            total += len(block)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert total == len(sig) - 200
+    assert peak < sig.nbytes / 4
@@ -43,13 +43,20 @@ class AudioDialog(tk.Toplevel):
         frmTable = ttk.Frame(self)
         frmTable.grid(column=0, row=15, **options)
 
-        # Speaker number
-        lbl_speaker = ttk.Label(lblfrm_settings, text='Output Speaker:').grid(
+        # Speaker number(s)
+        lbl_speaker = ttk.Label(lblfrm_settings, text='Output Speaker(s):').grid(
             column=5, row=5, sticky='e', **options_small)
         ent_speaker = ttk.Entry(lblfrm_settings, 
             textvariable=self.sessionpars['Speaker Number'], width=6)
         ent_speaker.grid(column=10, row=5, sticky='w', **options_small)
 
+        # Masker speaker number(s)
+        ttk.Label(lblfrm_settings, text='Masker Speaker(s):').grid(
+            column=5, row=7, sticky='e', **options_small)
+        ttk.Entry(lblfrm_settings, 
+            textvariable=self.sessionpars['Masker Speaker(s)'], width=6
+            ).grid(column=10, row=7, sticky='w', **options_small)
+
         # Audio device ID
         lbl_device = ttk.Label(lblfrm_settings, text="Audio Device ID:").grid(
             column= 5, row=10, sticky='e', **options_small)
@@ -57,6 +64,66 @@ class AudioDialog(tk.Toplevel):
             textvariable=self.sessionpars['Audio Device ID'], width=6)
         ent_deviceID.grid(column=10, row=10, sticky='w', **options_small)
 
+        # Stream block size
+        ttk.Label(lblfrm_settings, text="Block Size (frames):").grid(
+            column=5, row=15, sticky='e', **options_small)
+        ttk.Entry(lblfrm_settings, 
+            textvariable=self.sessionpars['Block Size'], width=6
+            ).grid(column=10, row=15, sticky='w', **options_small)
+
+        # Stream latency
+        ttk.Label(lblfrm_settings, text="Latency (s, low, high):").grid(
+            column=5, row=20, sticky='e', **options_small)
+        ttk.Entry(lblfrm_settings, 
+            textvariable=self.sessionpars['Stream Latency'], width=6
+            ).grid(column=10, row=20, sticky='w', **options_small)
+
+        # Files longer than this are streamed from disk
+        ttk.Label(lblfrm_settings, text="Stream Files Over (s):").grid(
+            column=5, row=22, sticky='e', **options_small)
+        ttk.Entry(lblfrm_settings, 
+            textvariable=self.sessionpars['Stream Files Over (s)'], width=6
+            ).grid(column=10, row=22, sticky='w', **options_small)
+
+        # Keep level differences between channels
+        ttk.Checkbutton(lblfrm_settings, text="Preserve ILD", takefocus=0,
+            variable=self.sessionpars['Preserve ILD']
+            ).grid(column=5, columnspan=10, row=25, sticky='w', 
+            **options_small)
+
+        # Resample audio files to the device's native rate
+        ttk.Checkbutton(lblfrm_settings, text="Match device sample rate", 
+            takefocus=0, variable=self.sessionpars['Match Device Rate']
+            ).grid(column=5, columnspan=10, row=30, sticky='w', 
+            **options_small)
+
+        # Resample the whole list before the first trial
+        ttk.Checkbutton(lblfrm_settings, text="Pre-convert list on start", 
+            takefocus=0, variable=self.sessionpars['Pre-convert List']
+            ).grid(column=5, columnspan=10, row=35, sticky='w', 
+            **options_small)
+
+        # Start each trial this long after it is queued
+        ttk.Label(lblfrm_settings, text="Onset Delay (ms):").grid(
+            column=5, row=40, sticky='e', **options_small)
+        ttk.Entry(lblfrm_settings, 
+            textvariable=self.sessionpars['Onset Delay (ms)'], width=6
+            ).grid(column=10, row=40, sticky='w', **options_small)
+
+        # Output channel for onset trigger pulses (0: none)
+        ttk.Label(lblfrm_settings, text="Trigger Channel:").grid(
+            column=5, row=45, sticky='e', **options_small)
+        ttk.Entry(lblfrm_settings, 
+            textvariable=self.sessionpars['Trigger Channel'], width=6
+            ).grid(column=10, row=45, sticky='w', **options_small)
+
+        # Run playback in a child process (applied on restart)
+        ttk.Checkbutton(lblfrm_settings, 
+            text="Separate audio process (restart to apply)", takefocus=0,
+            variable=self.sessionpars['Separate Audio Process']
+            ).grid(column=5, columnspan=10, row=50, sticky='w', 
+            **options_small)
+
         # Submit button
         btnDeviceID = ttk.Button(self, text="Submit", 
             command=self._on_submit)
@@ -38,6 +38,11 @@ class CalibrationDialog(tk.Toplevel):
         # Enabled last used calibration method
         self._set_cal_val()
 
+        # Change the noise level while it plays
+        self._trace = self.sessionpars['raw_lvl'].trace_add(
+            'write', lambda *_: self.parent.event_generate('<<CalLevelChange>>'))
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+
         # Center calibration window dialog
         self.center_window()
 
@@ -65,24 +70,31 @@ class CalibrationDialog(tk.Toplevel):
         lf_record = ttk.Labelframe(self, text='Sound Level Meter')
         lf_record.grid(column=10, row=10, **options, sticky='e')
 
+        # Automated measurement controls
+        lf_measure = ttk.Labelframe(self, text='Automated Measurement')
+        lf_measure.grid(column=5, columnspan=10, row=15, **options, 
+            sticky='we')
+
 
         ##################################
         # Calibration selection controls #
         ##################################
         # Define variables for file path and radio button value
         self.cal_path = tk.StringVar(value='Please choose a calibration stimulus file')
-        self.cal_var = tk.StringVar()
+        self.cal_var = self.sessionpars['Calibration Type']
         
-        # Default white noise stimulus radio button
-        rad_wgn = ttk.Radiobutton(lf_load, text="White Noise", takefocus=0,
-            variable=self.cal_var, value='wgn', command=self._cal_type)
-        rad_wgn.grid(column=5, row=0, columnspan=10, sticky='w', 
-            **options_small)
+        # Generated noise radio buttons (play until stopped)
+        for row, (text, value) in enumerate([('White Noise', 'white'), 
+            ('Pink Noise', 'pink'), ('Speech-Shaped Noise', 'speech')]):
+            ttk.Radiobutton(lf_load, text=text, takefocus=0,
+                variable=self.cal_var, value=value, command=self._cal_type
+                ).grid(column=5, row=row, columnspan=10, sticky='w', 
+                **options_small)
 
         # Custom calibration stimulus radio button
         rad_custom = ttk.Radiobutton(lf_load, text="Custom File", takefocus=0,
             variable=self.cal_var, value='custom', command=self._cal_type)
-        rad_custom.grid(column=5, row=1, columnspan=10, sticky='w', 
+        rad_custom.grid(column=5, row=3, columnspan=10, sticky='w', 
             **options_small)
 
         # Get calibration file path
@@ -116,6 +128,10 @@ class CalibrationDialog(tk.Toplevel):
         btn_play.grid(column=10, row=10, sticky='w', **options_small)
         btn_play.focus()
 
+        # Stop calibration stimulus
+        ttk.Button(lf_present, text="Stop", command=self._on_stop
+            ).grid(column=15, row=10, sticky='w', **options_small)
+
 
         ########################
         # SLM reading controls #
@@ -132,19 +148,61 @@ class CalibrationDialog(tk.Toplevel):
             command=self._on_submit, state='disabled')
         self.btn_submit.grid(column=5, columnspan=10, row=20, **options_small)
 
+        # Calibration age warning
+        ttk.Label(lf_record, text="Recalibrate After (days):").grid(
+            column=5, row=25, sticky='e', **options_small)
+        ttk.Entry(lf_record, 
+            textvariable=self.sessionpars['Calibration Max Age (days)'], 
+            width=6).grid(column=10, row=25, sticky='w', **options_small)
+
+
+        ##################################
+        # Automated measurement controls #
+        ##################################
+        # Measurement input: device ID or audio file
+        ttk.Label(lf_measure, text="Input (device ID or file):").grid(
+            column=5, row=5, sticky='e', **options_small)
+        ttk.Entry(lf_measure, 
+            textvariable=self.sessionpars['Measurement Input'], width=40
+            ).grid(column=10, row=5, sticky='w', **options_small)
+        ttk.Button(lf_measure, text="Browse", takefocus=0,
+            command=self._load_input).grid(column=15, row=5, sticky='w', 
+            **options_small)
+
+        # Input channel
+        ttk.Label(lf_measure, text="Channel:").grid(
+            column=5, row=10, sticky='e', **options_small)
+        ttk.Entry(lf_measure, 
+            textvariable=self.sessionpars['Measurement Channel'], width=6
+            ).grid(column=10, row=10, sticky='w', **options_small)
+
+        # Input reference level
+        ttk.Label(lf_measure, text="Full Scale Input (dB SPL):").grid(
+            column=5, row=15, sticky='e', **options_small)
+        ttk.Entry(lf_measure, 
+            textvariable=self.sessionpars['Input Reference (dB SPL)'], 
+            width=6).grid(column=10, row=15, sticky='w', **options_small)
+
+        # Measure button
+        ttk.Button(lf_measure, text="Measure", command=self._on_measure
+            ).grid(column=15, row=15, sticky='w', **options_small)
+
+        # Band levels readout
+        self.bands_var = tk.StringVar()
+        ttk.Label(lf_measure, textvariable=self.bands_var).grid(
+            column=5, columnspan=15, row=20, sticky='w', **options_small)
+
 
     #############
     # FUNCTIONS #
     #############
     def _set_cal_val(self):
         """ Enable calibration controls for last method used 
-            (i.e., wgn or custom file)
+            (i.e., generated noise or custom file)
         """
-        if self.sessionpars['Calibration File'].get() == 'cal_stim.wav':
-            self.cal_var.set('wgn')
+        if self.cal_var.get() != 'custom':
             self._set_custom_cntrls_status('disabled')
         else:
-            self.cal_var.set('custom')
             self.cal_path.set(os.path.basename(
                 self.sessionpars['Calibration File'].get()))
             self._set_custom_cntrls_status('enabled')
@@ -185,16 +243,12 @@ class CalibrationDialog(tk.Toplevel):
             # Enable file browsing controls
             self._set_custom_cntrls_status('enabled')
 
-        # Default white noise
-        elif self.cal_var.get() == 'wgn':
-            # Assign default cal file
-            self.sessionpars['Calibration File'].set('cal_stim.wav')
-            # Update path text
-            self.cal_path.set('Please choose a calibration stimulus file')
+        # Generated noise
+        else:
             # Disable custom file controls
             self._set_custom_cntrls_status('disabled')
 
-        print(f"Cal file from cal dialog: {self.sessionpars['Calibration File'].get()}")
+        print(f"Cal type from cal dialog: {self.cal_var.get()}")
 
 
     def _load_cal(self):
@@ -209,16 +263,53 @@ class CalibrationDialog(tk.Toplevel):
         """ Send play event to controller and enable SLM value 
             entry controls
         """
-        print(f"Using calibration file: " +
-            f"{self.sessionpars['Calibration File'].get()}")
+        print(f"Using calibration stimulus: {self.cal_var.get()}")
         self.parent.event_generate('<<PlayCalStim>>')
         self.btn_submit.config(state='enabled')
         self.ent_slm.config(state='enabled')
 
 
+    def _load_input(self):
+        """ File dialog for a file-backed measurement input
+        """
+        file_path = filedialog.askopenfilename()
+        if file_path:
+            self.sessionpars['Measurement Input'].set(file_path)
+
+
+    def _on_measure(self):
+        """ Send measure event to controller
+        """
+        self.parent.event_generate('<<MeasureCalStim>>')
+
+
+    def show_measurement(self, result):
+        """ Display the measured octave band levels and enable
+            submitting the measured SLM value
+        """
+        self.bands_var.set("Octave bands (dB SPL): " + "  ".join(
+            f"{band}: {level:.1f}" for band, level in result['bands'].items()))
+        self.btn_submit.config(state='enabled')
+        self.ent_slm.config(state='enabled')
+
+
+    def _on_stop(self):
+        """ Send stop event to controller
+        """
+        self.parent.event_generate('<<StopCalStim>>')
+
+
+    def _on_close(self):
+        """ Stop the calibration stimulus and close the dialog
+        """
+        self.sessionpars['raw_lvl'].trace_remove('write', self._trace)
+        self._on_stop()
+        self.destroy()
+
+
     def _on_submit(self):
         """ Send save SLM value event to controller
         """
         print("\nViews_Cal_210: Sending save calibration event...")
         self.parent.event_generate('<<CalibrationSubmit>>')
-        self.destroy()
+        self._on_close()
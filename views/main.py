@@ -11,14 +11,20 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 
-# Import data science packages
-import numpy as np
+# Import system packages
+import os
+import queue
 
 # Import text packages
 import string # for creating alphabet list
 
+# Import data science packages
+import numpy as np
+
 # Import custom modules
 from models import audiomodel as a
+from models import maskermodel as m
+from views import meter as v_meter
 
 
 #########
@@ -26,16 +32,22 @@ from models import audiomodel as a
 #########
 class MainFrame(ttk.Frame):
     def __init__(self, parent, scoremodel, sessionpars, listmodel, 
-    *args, **kwargs):
+    audiocache, engine, *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
 
         # Initialize
         self.scoremodel = scoremodel
         self.sessionpars = sessionpars
         self.listmodel = listmodel
+        self.audiocache = audiocache
+        self.engine = engine
         self.counter = 0
         self.outcome = None
 
+        # Continuous masker and its current level (dB)
+        self.masker = None
+        self.masker_db = None
+
         # Set widget display options
         self.myFont = tk.font.nametofont('TkDefaultFont').configure(size=10)
         options = {'padx':10, 'pady':10}
@@ -75,6 +87,11 @@ class MainFrame(ttk.Frame):
         self.frm_params.grid(column=25, row=5, rowspan=15, sticky='n',
             **options, ipadx=5, ipady=5)
 
+        # Output level meter
+        self.meter = v_meter.LevelMeter(frm_main)
+        self.meter.grid(column=25, row=20, rowspan=10, sticky='n', 
+            **options)
+
 
         #######################
         # Session info labels #
@@ -83,9 +100,12 @@ class MainFrame(ttk.Frame):
         self.subject_var = tk.StringVar(value="Subject:")
         self.condition_var = tk.StringVar(value="Condition:")
         self.level_var = tk.StringVar(value="Level:")
+        self.snr_var = tk.StringVar(value="SNR:")
         self.list_var = tk.StringVar(value="List:")
         self.speaker_var = tk.StringVar(value="Speaker:")
         self.trial_var = tk.StringVar(value="Trial:")
+        self.mirror_var = tk.StringVar(value="")
+        self.dropout_var = tk.StringVar(value="")
 
         # Plot session info labels
         # Subject
@@ -103,9 +123,18 @@ class MainFrame(ttk.Frame):
         # Level
         ttk.Label(self.frm_params, 
            textvariable=self.level_var).grid(sticky='w')
+        # SNR
+        ttk.Label(self.frm_params, 
+           textvariable=self.snr_var).grid(sticky='w')
         # Trial number
         ttk.Label(self.frm_params, 
             textvariable=self.trial_var).grid(sticky='w')
+        # Local mirror status (if used)
+        ttk.Label(self.frm_params, 
+            textvariable=self.mirror_var).grid(sticky='w')
+        # Audio dropouts (if any)
+        ttk.Label(self.frm_params, 
+            textvariable=self.dropout_var).grid(sticky='w')
 
 
         #################
@@ -183,6 +212,26 @@ class MainFrame(ttk.Frame):
             self.word_chks.append(self.chk_word)
 
 
+        ###################
+        # Audio callbacks #
+        ###################
+        # Re-enable buttons as soon as the audio engine reports 
+        # that the trial has finished playing. The engine 
+        # reports from a worker thread, so the report is queued
+        # and picked up on the Tk thread.
+        self._finished = queue.SimpleQueue()
+        self.bind('<<PlaybackFinished>>', lambda _: self._on_trial_end())
+        self._poll_finished()
+
+        # Raw level the clipping warning was last shown for
+        self._clip_level = None
+
+        # Show the engine's output level readings
+        self._meter_reading = None
+        self._meter_stale = 0
+        self._poll_meter()
+
+
         #####################
         # Check for stimuli #
         #####################
@@ -197,8 +246,7 @@ class MainFrame(ttk.Frame):
         """ Load in current stimulus lists from listmodel
         """
         try:
-            self.audio_df = self.listmodel.audio_df
-            self.sentence_df = self.listmodel.sentence_df
+            self.plan = self.listmodel.plan
             self.text_vars[0].set("Click the START button to begin.")
         except AttributeError:
             print("Views_Main_178: Problem loading stimuli!")
@@ -219,10 +267,13 @@ class MainFrame(ttk.Frame):
         try:
             self.subject_var.set(f"Subject: {self.sessionpars['Subject'].get()}")
             self.condition_var.set(f"Condition: {self.sessionpars['Condition'].get()}")
-            self.speaker_var.set(f"Speaker: {self.sessionpars['Speaker Number'].get()}")
+            self.speaker_var.set(f"Speaker(s): {self.sessionpars['Speaker Number'].get()}")
             self.list_var.set(f"List(s): {self.sessionpars['List Number'].get()}")
             self.level_var.set(f"Level: {self.sessionpars['new_db_lvl'].get()}")
-            self.trial_var.set(f"Trial: {self.counter+1} of {len(self.sentence_df)}")
+            self.snr_var.set(f"SNR: {self._snr()}")
+            self.trial_var.set(f"Trial: {self.counter+1} of {len(self.plan)}")
+            status = self.listmodel.mirror_status()
+            self.mirror_var.set("" if status is None else f"Local copy: {status}")
         except AttributeError:
             print("Views_Main_189: Cannot calculate trials data: stimuli not yet loaded!")
 
@@ -271,6 +322,18 @@ class MainFrame(ttk.Frame):
         # Update session info labels after loading listmodel
         self._update_labels()
 
+        # Open the output stream for the session
+        if not self._open_engine():
+            return
+
+        # Start decoding the first files of the list
+        self._prefetch(self.counter)
+
+        # Start the continuous masker (if any)
+        if not self._start_masker():
+            return
+        self._update_labels()
+
         # Display first sentence and present first audio file
         self._display()
         self._play()
@@ -337,7 +400,7 @@ class MainFrame(ttk.Frame):
         # Update trial counter
         self.counter += 1
         # Update trial label
-        self.trial_var.set(f"Trial: {self.counter+1} of {len(self.sentence_df)}")
+        self.trial_var.set(f"Trial: {self.counter+1} of {len(self.plan)}")
         # Start next trial: display new word labels and checkbuttons
         self._display()
         self._play()
@@ -348,8 +411,11 @@ class MainFrame(ttk.Frame):
     ###################
     def _adjust_level(self):
         """ Apply right/wrong step size to presentation level
-            based on response outcome.
+            based on response outcome. With a masker, the step
+            changes the overall level (masker follows the 
+            speech, fixed SNR) or the SNR (fixed masker level).
         """
+        old_lvl = self.sessionpars['new_db_lvl'].get()
         if self.outcome == 1:
             # Apply step size offset to presentation level
             self.sessionpars['new_db_lvl'].set(
@@ -368,6 +434,18 @@ class MainFrame(ttk.Frame):
             )
             self.quit()
 
+        if self.masker is not None and \
+            self.sessionpars['Adaptive Track'].get() == 'Level':
+            self.masker_db += self.sessionpars['new_db_lvl'].get() - old_lvl
+
+
+    def _snr(self):
+        """ Current SNR (dB), or None without a masker
+        """
+        if self.masker is None:
+            return None
+        return round(self.sessionpars['new_db_lvl'].get() - self.masker_db, 2)
+
 
     def _get_level(self):
         """ Send event to controller to calculate new 
@@ -396,15 +474,225 @@ class MainFrame(ttk.Frame):
         self.btn_wrong.config(text=btntext)
 
 
+    def _prefetch(self, start):
+        """ Queue the next few audio files for background decoding
+        """
+        stop = start + self.audiocache.lookahead
+        self.audiocache.prefetch([trial.path for trial in 
+            self.plan[start:stop] if not self._streamed(trial.path)])
+
+
+    def _streamed(self, path):
+        """ True if a file is long enough to be streamed from
+            disk instead of read into memory
+        """
+        return self.listmodel.metadata.df.loc[
+            os.path.basename(path), 'dur'] > \
+            self.sessionpars['Stream Files Over (s)'].get()
+
+
+    def _open_engine(self):
+        """ Open the persistent output stream at the device's 
+            native sample rate (audio files at other rates are
+            resampled once), or at the rate of the first audio 
+            file. Returns False if the audio device could not 
+            be opened.
+        """
+        device_id = self.sessionpars['Audio Device ID'].get()
+        try:
+            if self.sessionpars['Match Device Rate'].get():
+                self.audiocache.set_rate(self.engine.device_rate(device_id))
+                if self.sessionpars['Pre-convert List'].get():
+                    self.audiocache.preconvert(self.plan.paths)
+            else:
+                self.audiocache.set_rate(None)
+            fs = self.audiocache.target_fs or \
+                self.listmodel.metadata.df.loc[os.path.basename(
+                    self.plan[self.counter].path), 'fs']
+            speakers = self.engine.parse_speakers(
+                self.sessionpars['Speaker Number'].get())
+            self.engine.open(
+                device_id=device_id,
+                channels=max(speakers),
+                fs=fs
+            )
+        except ValueError as e:
+            self._invalid_device(str(e))
+            return False
+        return True
+
+
+    def _start_masker(self):
+        """ Load the masker file or babble (if any) and start 
+            mixing it into the output stream. The starting masker level
+            is the presentation level minus the SNR. Returns 
+            False if the masker could not be started.
+        """
+        self.engine.remove_masker()
+        self.masker = None
+        self.masker_db = None
+        masker_file = self.sessionpars['Masker File'].get()
+        talkers = self.sessionpars['Babble Talkers'].get()
+        if not masker_file and talkers < 1:
+            return True
+
+        try:
+            if not masker_file:
+                # Babble from the corpus (built once, then cached)
+                masker_file = self.listmodel.babble(talkers,
+                    self.sessionpars['Babble Seed'].get())
+            # At the stream rate (resampled block by block by the
+            # masker's fill thread, if needed)
+            masker = m.MaskerStream(masker_file, 
+                target_fs=self.audiocache.target_fs)
+            self.masker_db = self.sessionpars['Presentation Level'].get() - \
+                self.sessionpars['SNR'].get()
+            self.engine.set_masker(masker, self._masker_gain(masker))
+        except (OSError, ValueError) as e:
+            self._invalid_device(f"Cannot start masker: {e}")
+            return False
+        self.masker = masker
+        print(f"Views_Main_452: Started masker at {self.masker_db} dB")
+        return True
+
+
+    def _masker_gain(self, masker):
+        """ Masker gain matrix for the current masker level, 
+            routed to the masker speaker(s) (or the speech 
+            speaker(s), if none are given)
+        """
+        speakers = self.sessionpars['Masker Speaker(s)'].get() or \
+            self.sessionpars['Speaker Number'].get()
+        return masker.gain_matrix(
+            self.masker_db - self.sessionpars['slm_offset'].get(),
+            self.engine.parse_speakers(speakers),
+            'n' if self.sessionpars['Preserve ILD'].get() else 'y'
+        )
+
+
+    def _invalid_device(self, detail=''):
+        """ Alert the user to an invalid audio device or 
+            speaker routing and return to the START screen.
+        """
+        # Show error messagebox
+        messagebox.showerror(title="Invalid Audio Device",
+            message="Please provide a valid audio device ID " +
+                "and speaker number(s)!",
+            detail=detail)
+        # Give instructions in sentence label
+        self._reset()
+        self.text_vars[0].set("Please restart the application " +
+            "to apply changes.")
+        # Open audio device dialog for user
+        self.event_generate('<<ToolsAudioSettings>>')
+        # Disable right/wrong buttons
+        self._disable_btns("Ready")
+        # Restore START button
+        self.btn_start.grid(column=7, row=15, rowspan=6, 
+            sticky='nsew', pady=(0,10))
+
+
+    def _on_playback_finished(self):
+        """ Called by the audio engine (from a worker thread) 
+            when the last sample has been played. Tkinter is
+            not thread-safe, so only queue the report.
+        """
+        self._finished.put(True)
+
+
+    def _poll_finished(self):
+        """ Hand playback reports from the audio engine to the
+            Tk event loop. Polled every 5 ms.
+        """
+        try:
+            while True:
+                self._finished.get_nowait()
+                self.event_generate('<<PlaybackFinished>>', when='tail')
+        except queue.Empty:
+            pass
+        self.after(5, self._poll_finished)
+
+
+    def _on_trial_end(self):
+        """ Enable scoring and show any audio dropouts
+        """
+        self._enable_btns()
+        dropouts = self.engine.dropouts
+        if dropouts:
+            self.dropout_var.set(f"Audio dropouts: {dropouts}")
+
+
+    def _poll_meter(self):
+        """ Show the engine's latest meter reading. Polled at 
+            25 Hz, so the audio thread never waits on Tk.
+        """
+        reading = self.engine.meter
+        if reading is not self._meter_reading:
+            self._meter_reading = reading
+            self._meter_stale = 0
+            self.meter.show(*reading)
+        else:
+            # Clear the meter once the stream has gone quiet
+            self._meter_stale += 1
+            if self._meter_stale == 10:
+                self.meter.show(None, None)
+        self.after(40, self._poll_meter)
+
+
+    def _check_clipping(self, path, level, eq):
+        """ Warn the user if the audio file would clip at 
+            the requested raw level. The warning is only shown
+            once per level, so it doesn't interrupt every 
+            trial.
+        """
+        peak = self.listmodel.metadata.headroom(path, level, eq)
+        if peak > 0:
+            print(f"Views_Main_470: Clipping! Peak level {peak:.1f} dB FS")
+            if level == self._clip_level:
+                return
+            self._clip_level = level
+            messagebox.showwarning(title="Clipping",
+                message="The audio will clip at this level!",
+                detail=f"Peak level: {peak:.1f} dB FS\n" +
+                    f"Reduce the level by at least {peak:.1f} dB " +
+                    "to avoid clipping.")
+
+
     def _play(self):
         """ Load next audio file and present it.
         """
+        if self.counter >= len(self.plan):
+            # Out of trials
+            return
         try:
             # Create audio object
             print(f"Views_Main_363: Raw level sent to audio object: " +
                 f"{self.sessionpars['new_raw_lvl'].get()}")
-            audio = a.Audio(self.audio_df.iloc[self.counter]['path'], 
-                self.sessionpars['new_raw_lvl'].get())
+            path = self.plan[self.counter].path
+            level = self.sessionpars['new_raw_lvl'].get()
+            eq = 'n' if self.sessionpars['Preserve ILD'].get() else 'y'
+            streamed = self._streamed(path)
+            trim = None
+            if self.sessionpars['Trim Silence'].get():
+                # Start and end the trial on speech (streamed files
+                # are trimmed before they are resampled)
+                trim = self.listmodel.metadata.speech_bounds(path,
+                    None if streamed else self.audiocache.target_fs)
+            if streamed:
+                # Long passage: memory-map the file and present it 
+                # block by block, resampled to the stream rate as 
+                # the blocks are read (off the GUI thread)
+                audio = a.Audio(path, level, trim=trim, stream=True,
+                    target_fs=self.audiocache.target_fs)
+            else:
+                audio = a.Audio(path, level, cache=self.audiocache, 
+                    trim=trim)
+
+            # Warn before presenting a level that would clip
+            self._check_clipping(path, level, eq)
+
+            # Decode upcoming files in the background while this one plays
+            self._prefetch(self.counter + 1)
 
             # Disable right/wrong buttons to prevent multiple clicks
             self._disable_btns("Presenting")
@@ -416,28 +704,18 @@ class MainFrame(ttk.Frame):
             try:
                 audio.play(
                     device_id=self.sessionpars['Audio Device ID'].get(),
-                    channels=self.sessionpars['Speaker Number'].get()
+                    channels=self.engine.parse_speakers(
+                        self.sessionpars['Speaker Number'].get()),
+                    engine=self.engine,
+                    eq=eq,
+                    rmsdb=self.listmodel.metadata.levels(path)[0],
+                    masker_gain=None if self.masker is None else
+                        self._masker_gain(self.masker),
+                    on_finished=self._on_playback_finished
                     )
-            except ValueError:
-                # Show error messagebox
-                messagebox.showerror(title="Invalid Audio Device",
-                    message="Please provide a valid audio device ID!")
-                # Give instructions in sentence label
-                self._reset()
-                self.text_vars[0].set("Please restart the application " +
-                    "to apply changes.")
-                # Open audio device dialog for user
-                self.event_generate('<<ToolsAudioSettings>>')
-                # Disable right/wrong buttons
-                self._disable_btns("Ready")
-                # Restore START button
-                self.btn_start.grid(column=7, row=15, rowspan=6, 
-                    sticky='nsew', pady=(0,10))
+            except ValueError as e:
+                self._invalid_device(str(e))
                 return
-
-            # Re-enable buttons after audio has finished playing
-            # NOTE: .after expects an integer duration in ms
-            self.after((int(np.ceil(audio.dur)))*1000, self._enable_btns)
         except KeyError:
             messagebox.showerror(title="Cannot Find File",
                 message="Requested audio file does not exist!")
@@ -450,43 +728,36 @@ class MainFrame(ttk.Frame):
     ##################################
     def _display(self):
         """ Display each word. Display checkbutton beneath 
-            each key word (capitalized). Underline each 
-            key word.
+            each key word (marked in the Key Word Markup 
+            style). Underline each key word.
         """
         # Track indexes of key word checkboxes for 
         # select all
         self.keyword_chks = []
         try:
-            # Get next sentence and split into a list of words
-            self.words = self.sentence_df.loc[
-                self.counter, 'sentence'].split()
-            # Remove period from last word
-            if self.words[-1][-1] == '.':
-                self.words[-1] = self.words[-1][:-1]
-
-            # Display words and checkboxes
-            for idx, word in enumerate(self.words):
-                if word.isupper() and word != 'A':
-                    # Words
-                    self.text_vars[idx].set(word)
-                    self.word_labels[idx].config(
-                        font=('TkDefaultFont 10 underline'))
-                    # Checkboxes
-                    self.word_chks[idx].grid(column=idx, row=1)
-                    self.keyword_chks.append(idx)
-                else:
-                    # Words
-                    self.text_vars[idx].set(word)
-        except KeyError:
+            # Get next sentence (split into words when the 
+            # list was loaded)
+            self.trial = self.plan[self.counter]
+        except IndexError:
             print("Out of sentences!")
             self.text_vars[0].set("Done!")
-            self.trial_var.set(f"Trial {len(self.sentence_df)} of " +
-                f"{len(self.sentence_df)}")
+            self.trial_var.set(f"Trial {len(self.plan)} of " +
+                f"{len(self.plan)}")
             self.btn_right.config(state='disabled')
             self.btn_wrong.config(state='disabled')
             self.event_generate('<<MainDone>>')
             return
 
+        # Display words
+        for idx, word in enumerate(self.trial.words):
+            self.text_vars[idx].set(word)
+        # Underline key words and display checkboxes
+        for idx in self.trial.keywords.tolist():
+            self.word_labels[idx].config(
+                font=('TkDefaultFont 10 underline'))
+            self.word_chks[idx].grid(column=idx, row=1)
+            self.keyword_chks.append(idx)
+
 
     ################################
     # Store correct response words #
@@ -495,23 +766,12 @@ class MainFrame(ttk.Frame):
         """ Get words marked correct and incorrect, update 
             scoremodel, and send event to controller.
         """
-        # Get correct words
-        correct = []
-        for idx, value in enumerate(self.chk_vars):
-            if value.get() != 0:
-                correct.append(self.words[idx])
-
-        # Get incorrect words
-        # Exclude correct words from list of words
-        incorrect = list(set(self.words).difference(correct))
-        # Only take capitalized words
-        incorrect = [word for word in incorrect if word.isupper()]
-        # Remove 'A' if it exists (never a key word, but can be capital)
-        try:
-            incorrect.remove('A')
-        except ValueError:
-            # There was no 'A' in the list
-            pass
+        # Key words checked correct or left unchecked
+        words = self.trial.words
+        checked = np.array([self.chk_vars[idx].get() != 0
+            for idx in range(len(words))], dtype=bool)
+        correct = list(words[self.trial.mask & checked])
+        incorrect = list(words[self.trial.mask & ~checked])
 
         # Update scoremodel with values
         self.scoremodel.fields['Words Correct'] = ' '.join(correct)
@@ -519,7 +779,10 @@ class MainFrame(ttk.Frame):
             self.scoremodel.fields['Words Correct'].split())
         self.scoremodel.fields['Words Incorrect'] = ' '.join(incorrect)
         self.scoremodel.fields['Trial'] = self.counter + 1
+        self.scoremodel.fields['Sentence Number'] = self.trial.sentence_num
         self.scoremodel.fields['Outcome'] = self.outcome
+        self.scoremodel.fields['Masker Level'] = self.masker_db
+        self.scoremodel.fields['SNR'] = self._snr()
 
         # Send event to controller to write response to file
         self.event_generate('<<SubmitResponse>>')
@@ -0,0 +1,87 @@
+""" Output level meter for Speech Task Controller
+
+    Written by: Travis M. Moore
+"""
+
+###########
+# Imports #
+###########
+# Import GUI packages
+import tkinter as tk
+from tkinter import ttk
+
+# Import data science packages
+import numpy as np
+
+
+#########
+# BEGIN #
+#########
+class LevelMeter(ttk.LabelFrame):
+    """ Horizontal RMS bar and peak marker for each output
+        channel. The peak marker turns red when a channel
+        clips.
+    """
+    # Meter range (dB FS)
+    floor = -60
+    width = 160
+    row_height = 14
+
+    def __init__(self, parent, *args, **kwargs):
+        super().__init__(parent, *args, text="Output Level", **kwargs)
+        self.canvas = tk.Canvas(self, width=self.width + 20,
+            height=self.row_height, highlightthickness=0)
+        self.canvas.grid(padx=5, pady=5)
+        # Canvas items (label, bar, peak marker) per channel
+        self._rows = []
+
+
+    def show(self, rms, peak):
+        """ Display linear RMS and peak values (one per
+            channel). None clears the meter.
+        """
+        if rms is None:
+            rms = peak = np.zeros(len(self._rows))
+        if len(rms) != len(self._rows):
+            self._build(len(rms))
+        with np.errstate(divide='ignore'):
+            rms_db = 20 * np.log10(rms)
+            peak_db = 20 * np.log10(peak)
+        for ii, (bar, marker) in enumerate(self._rows):
+            y = ii * self.row_height
+            self.canvas.coords(bar, 20, y + 2, 20 + self._x(rms_db[ii]),
+                y + self.row_height - 2)
+            x = 20 + self._x(peak_db[ii])
+            self.canvas.coords(marker, x, y + 1, x, y + self.row_height - 1)
+            self.canvas.itemconfig(marker,
+                fill='red' if peak[ii] >= 1 else 'black')
+
+
+    #####################
+    # Private functions #
+    #####################
+    def _x(self, db):
+        """ Bar length for a level in dB FS
+        """
+        if not np.isfinite(db):
+            return 0
+        return self.width * min(max(db - self.floor, 0) / -self.floor, 1)
+
+
+    def _build(self, channels):
+        """ Create the canvas items for CHANNELS channels
+        """
+        self.canvas.delete('all')
+        self.canvas.config(height=max(1, channels) * self.row_height)
+        self._rows = []
+        for ii in range(channels):
+            y = ii * self.row_height
+            self.canvas.create_text(10, y + self.row_height / 2,
+                text=str(ii + 1))
+            self.canvas.create_rectangle(20, y + 2, 20 + self.width,
+                y + self.row_height - 2, outline='gray')
+            bar = self.canvas.create_rectangle(20, y + 2, 20,
+                y + self.row_height - 2, fill='green', width=0)
+            marker = self.canvas.create_line(20, y + 1, 20,
+                y + self.row_height - 1, width=2)
+            self._rows.append((bar, marker))
@@ -9,6 +9,9 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
 
+# Import custom modules
+from models import planmodel as m_plan
+
 
 #########
 # BEGIN #
@@ -45,6 +48,16 @@ class SessionDialog(tk.Toplevel):
         frm_sentencepath = ttk.Labelframe(self, text='Sentence File Directory')
         frm_sentencepath.grid(column=0, row=15, padx=10, pady=10, ipadx=5, ipady=5)
 
+        # Masker frame
+        frm_masker = ttk.Labelframe(self, text='Masker (Optional)')
+        frm_masker.grid(column=0, row=17, padx=10, pady=10, ipadx=5, ipady=5,
+            sticky='nsew')
+
+        # Randomization frame
+        frm_random = ttk.Labelframe(self, text='Randomization (Optional)')
+        frm_random.grid(column=0, row=18, padx=10, pady=10, ipadx=5, ipady=5,
+            sticky='nsew')
+
 
         #######################
         # Create view widgets #
@@ -77,6 +90,11 @@ class SessionDialog(tk.Toplevel):
             textvariable=self.sessionpars['Presentation Level']
             ).grid(row=5, column=1, sticky='w')
 
+        # Trim leading/trailing silence
+        ttk.Checkbutton(frm_session, text="Trim leading/trailing silence",
+            takefocus=0, variable=self.sessionpars['Trim Silence']
+            ).grid(row=6, column=1, sticky='w', **options)
+
         # Audio directory
         ttk.Label(frm_audiopath, text="Path:"
             ).grid(row=6, column=0, sticky='e', **options)
@@ -85,6 +103,8 @@ class SessionDialog(tk.Toplevel):
             ).grid(row=6, column=1, sticky='w')
         ttk.Button(frm_audiopath, text="Browse", command=self._get_audio_directory
             ).grid(row=7, column=1, sticky='w', pady=(0, 10))
+        ttk.Button(frm_audiopath, text="Bundle", command=self._get_bundle_file
+            ).grid(row=7, column=1, sticky='w', padx=(85, 0), pady=(0, 10))
 
         # Sentence directory
         ttk.Label(frm_sentencepath, text="Path:"
@@ -95,6 +115,98 @@ class SessionDialog(tk.Toplevel):
         ttk.Button(frm_sentencepath, text="Browse", command=self._get_sentence_directory
             ).grid(row=10, column=1, sticky='w', pady=(0, 5))
 
+        # How key words are marked in the sentence file
+        ttk.Label(frm_sentencepath, text="Key Words:"
+            ).grid(row=11, column=0, sticky='e', **options)
+        ttk.Combobox(frm_sentencepath, width=12, state='readonly',
+            values=list(m_plan.markups),
+            textvariable=self.sessionpars['Key Word Markup']
+            ).grid(row=11, column=1, sticky='w', pady=(0, 5))
+
+        # Copy stimuli to the local disk (for network shares)
+        ttk.Checkbutton(self, text="Use a local copy of the stimulus directories",
+            takefocus=0, variable=self.sessionpars['Local Mirror']
+            ).grid(column=0, row=16, sticky='w', padx=10)
+
+        # Masker file
+        ttk.Label(frm_masker, text="File:"
+            ).grid(row=11, column=0, sticky='e', **options)
+        ttk.Label(frm_masker, textvariable=self.sessionpars['Masker File'], 
+            borderwidth=2, relief="solid", width=60
+            ).grid(row=11, column=1, columnspan=3, sticky='w')
+        ttk.Button(frm_masker, text="Browse", command=self._get_masker_file
+            ).grid(row=12, column=1, sticky='w')
+        ttk.Button(frm_masker, text="Clear", 
+            command=lambda: self.sessionpars['Masker File'].set('')
+            ).grid(row=12, column=2, sticky='w')
+
+        # Starting SNR
+        ttk.Label(frm_masker, text="SNR (dB):"
+            ).grid(row=13, column=0, sticky='e', **options)
+        ttk.Entry(frm_masker, width=8, textvariable=self.sessionpars['SNR']
+            ).grid(row=13, column=1, sticky='w')
+
+        # Adaptive track: overall level (fixed SNR) or SNR 
+        # (fixed masker level)
+        ttk.Label(frm_masker, text="Step Size Changes:"
+            ).grid(row=14, column=0, sticky='e', **options)
+        ttk.Radiobutton(frm_masker, text="Level", value='Level',
+            variable=self.sessionpars['Adaptive Track']
+            ).grid(row=14, column=1, sticky='w')
+        ttk.Radiobutton(frm_masker, text="SNR", value='SNR',
+            variable=self.sessionpars['Adaptive Track']
+            ).grid(row=14, column=2, sticky='w')
+
+        # Babble built from the audio files (used when no masker 
+        # file is given; 0 talkers for none)
+        ttk.Label(frm_masker, text="Babble Talkers:"
+            ).grid(row=15, column=0, sticky='e', **options)
+        ttk.Entry(frm_masker, width=8, 
+            textvariable=self.sessionpars['Babble Talkers']
+            ).grid(row=15, column=1, sticky='w')
+        ttk.Label(frm_masker, text="Seed:"
+            ).grid(row=15, column=2, sticky='e', **options)
+        ttk.Entry(frm_masker, width=8, 
+            textvariable=self.sessionpars['Babble Seed']
+            ).grid(row=15, column=3, sticky='w')
+
+        # Shuffle sentences within each list
+        ttk.Checkbutton(frm_random, text="Shuffle sentences within each list",
+            takefocus=0, variable=self.sessionpars['Shuffle Sentences']
+            ).grid(row=16, column=1, columnspan=3, sticky='w', **options)
+
+        # List order: as entered, or a balanced Latin square 
+        # across plans
+        ttk.Label(frm_random, text="List Order:"
+            ).grid(row=17, column=0, sticky='e', **options)
+        ttk.Radiobutton(frm_random, text="As Entered", value='As Entered',
+            variable=self.sessionpars['List Order']
+            ).grid(row=17, column=1, sticky='w')
+        ttk.Radiobutton(frm_random, text="Latin Square", value='Latin Square',
+            variable=self.sessionpars['List Order']
+            ).grid(row=17, column=2, sticky='w')
+
+        # Conditions to counterbalance the lists across (comma
+        # separated; the session uses the current condition's 
+        # lists)
+        ttk.Label(frm_random, text="Counterbalance Conditions:"
+            ).grid(row=18, column=0, sticky='e', **options)
+        ttk.Entry(frm_random, width=30, 
+            textvariable=self.sessionpars['Counterbalance Conditions']
+            ).grid(row=18, column=1, columnspan=3, sticky='w')
+
+        # Seed and plan number (one plan per subject)
+        ttk.Label(frm_random, text="Seed:"
+            ).grid(row=19, column=0, sticky='e', **options)
+        ttk.Entry(frm_random, width=8, 
+            textvariable=self.sessionpars['Randomization Seed']
+            ).grid(row=19, column=1, sticky='w')
+        ttk.Label(frm_random, text="Plan Number:"
+            ).grid(row=19, column=2, sticky='e', **options)
+        ttk.Entry(frm_random, width=8, 
+            textvariable=self.sessionpars['Plan Number']
+            ).grid(row=19, column=3, sticky='w')
+
         # Submit button
         btn_submit = ttk.Button(self, text="Submit", command=self._on_submit)
         btn_submit.grid(column=0, columnspan=2, row=20, pady=(0,10))
@@ -127,6 +239,15 @@ class SessionDialog(tk.Toplevel):
             filedialog.askdirectory(title="Audio File Directory"))
 
 
+    def _get_bundle_file(self):
+        """ Ask user to specify a corpus bundle file (audio and
+            sentences) and store it in sessionpars
+        """
+        self.sessionpars['Audio Files Path'].set(
+            filedialog.askopenfilename(title="Corpus Bundle",
+                filetypes=[('Corpus bundles', '*.stcb')]))
+
+
     def _get_sentence_directory(self):
         """ Ask user to specify sentence file and store
             it in sessionpars
@@ -135,6 +256,15 @@ class SessionDialog(tk.Toplevel):
             filedialog.askdirectory(title="Sentence File Directory"))
 
 
+    def _get_masker_file(self):
+        """ Ask user to specify a masker file and store it
+            in sessionpars
+        """
+        self.sessionpars['Masker File'].set(
+            filedialog.askopenfilename(title="Masker File",
+                filetypes=[('Audio files', '*.wav *.flac *.ogg')]))
+
+
     def _on_submit(self):
         """ Set new_db_lvl to specified presentation level.
             Send event to controller to write sessionpars data to file